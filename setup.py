@@ -47,6 +47,8 @@ setup(
     packages=find_packages(exclude=['contrib', 'docs', 'tests', 'files']),
 
     install_requires=[
+        'futures; python_version < "3"',
+        'selectors2; python_version < "3"',
     ],
 
     project_urls={
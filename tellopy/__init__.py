@@ -5,6 +5,14 @@ This is a python package which controlls DJI toy drone 'Tello'. The major portio
 code was ported from the driver of GOBOT project. Please refer their blog post at
 https://gobot.io/blog/2018/04/20/hello-tello-hacking-drones-with-go
 """
+import sys
+
 from tellopy._internal.tello import Tello
+from tellopy._internal.fleet import Fleet
+from tellopy._internal.logger import use_logging
+
+__all__ = ["Tello", "Fleet", "use_logging"]
 
-__all__ = ["Tello"]
+if (3, 5) <= sys.version_info:
+    from tellopy._internal.async_tello import AsyncTello
+    __all__.append("AsyncTello")
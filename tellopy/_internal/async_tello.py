@@ -0,0 +1,479 @@
+"""
+asyncio transport for the Tello
+
+AsyncTello speaks the same protocol as Tello, but it runs on an asyncio event loop instead of
+its own threads. Both the command port and the video port are served by
+asyncio.DatagramProtocol, commands return awaitables and telemetry and video can be consumed
+with async iterators:
+
+    drone = AsyncTello()
+    await drone.connect()
+    await drone.takeoff()
+    async for flight_data in drone.flight_data():
+        print(flight_data)
+
+Packet processing, the decoder registry and the stick axes come from TelloCore, which Tello
+builds on as well; the command channel and the clock service are the ones used by Tello, with
+the event loop itself as their timer.
+"""
+import asyncio
+import collections
+import socket
+
+from . import clock
+from . import command
+from . import error
+from . import logger
+from . import stick
+from . core import TelloCore
+from . utils import *
+from . protocol import *
+
+log = logger.Logger('AsyncTello')
+
+
+class _Receiver(asyncio.DatagramProtocol):
+    def __init__(self, received):
+        self.received = received
+
+    def datagram_received(self, data, addr):
+        self.received(data)
+
+    def error_received(self, exc):
+        log.info('recv: %s', str(exc))
+
+
+class EventStream(object):
+    """
+    EventStream is an async iterator over the data published for one or more events. It
+    yields the data alone when it follows one event and (event, data) tuples otherwise.
+    Up to maxsize items are buffered; when the consumer falls behind, the oldest item is
+    dropped and counted in dropped. Close() ends the iteration and unsubscribes the stream.
+    """
+
+    def __init__(self, owner, events, maxsize=64):
+        self.owner = owner
+        self.events = events
+        self.queue = collections.deque(maxlen=maxsize)
+        self.waiter = None
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, event, data):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        if len(self.events) == 1:
+            self.queue.append(data)
+        else:
+            self.queue.append((event, data))
+        self.__wakeup()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.owner._remove_stream(self)
+            self.__wakeup()
+
+    def __wakeup(self):
+        waiter = self.waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.queue:
+            if self.closed:
+                raise StopAsyncIteration
+            self.waiter = self.owner.loop.create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+        return self.queue.popleft()
+
+
+class AsyncTello(TelloCore):
+    # seconds between connection requests and without packets before the link is lost
+    CONN_REQ_INTERVAL = 1.0
+    RECV_TIMEOUT = 2.0
+    VIDEO_REFRESH_INTERVAL = 2.0
+
+    def __init__(self, port=9000, video_port=6038, tello_addr=('192.168.10.1', 8889),
+                 stick_rate=20.0):
+        self.tello_addr = tello_addr
+        self.port = port
+        self.video_port = video_port
+        self.loop = None
+        self.transport = None
+        self.video_transport = None
+        self.state = self.STATE_DISCONNECTED
+        self.connected = None
+        self.log = log
+        self.video_enabled = False
+        self.exposure = 0
+        self.video_encoder_rate = 4
+        self._init_core()
+        # the event loop becomes the scheduler's timer once connect() runs
+        self.stick_scheduler = stick.StickScheduler(None, self._send_stick_command, stick_rate)
+        self.command_channel = None
+        self.clock = None
+        self.last_recv = 0.0
+        self.last_conn_req = 0.0
+        self.__handles = {}
+        self.__subscribers = {}
+        self.__streams = []
+
+    def set_loglevel(self, level):
+        """Set_loglevel controls the output messages like Tello.set_loglevel()."""
+        log.set_level(level)
+
+    def subscribe(self, event, handler):
+        """
+        Subscribe calls handler(event=, sender=, data=) on the event loop whenever event is
+        published, with the same arguments as Tello handlers receive.
+        """
+        self.__subscribers.setdefault(event, []).append(handler)
+
+    def unsubscribe(self, event, handler):
+        handlers = self.__subscribers.get(event)
+        if handlers and handler in handlers:
+            handlers.remove(handler)
+
+    def events(self, *events, maxsize=64):
+        """
+        Events returns an EventStream over the given events. maxsize is the number of items
+        buffered for a slow consumer.
+        """
+        stream = EventStream(self, events, maxsize)
+        self.__streams.append(stream)
+        return stream
+
+    def flight_data(self, maxsize=1):
+        """Flight_data returns an async iterator over FlightData that keeps only the latest by default."""
+        return self.events(self.EVENT_FLIGHT_DATA, maxsize=maxsize)
+
+    def video_frames(self, maxsize=256):
+        """Video_frames returns an async iterator over the H.264 data received from the drone."""
+        return self.events(self.EVENT_VIDEO_FRAME, maxsize=maxsize)
+
+    def _remove_stream(self, stream):
+        if stream in self.__streams:
+            self.__streams.remove(stream)
+
+    def _publish(self, event, data=None):
+        for handler in tuple(self.__subscribers.get(event, ())):
+            try:
+                handler(event=event, sender=self, data=data)
+            except Exception as ex:
+                log.error('handler: %s', str(ex))
+                show_exception(ex)
+        for stream in self.__streams:
+            if event in stream.events:
+                stream.put(event, data)
+
+    async def connect(self, timeout=None):
+        """
+        Connect opens the sockets on the running event loop and sends connection requests
+        until the drone answers. It raises TelloError if timeout seconds pass first.
+        """
+        if self.transport is None:
+            await self.__open()
+        if self.state == self.STATE_DISCONNECTED:
+            self.state = self.STATE_CONNECTING
+            self.__send_conn_req()
+        try:
+            await asyncio.wait_for(self.connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            raise error.TelloError('timeout')
+
+    async def __open(self):
+        loop = self.loop = asyncio.get_event_loop()
+        self.connected = asyncio.Event()
+        self.command_channel = command.CommandChannel(self.send_packet, loop, log=log)
+        self.clock = clock.ClockService(loop, self._send_time_command)
+        self.stick_scheduler.timer = loop
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: _Receiver(self.__receive_packet), local_addr=('0.0.0.0', self.port))
+        self.video_transport, _ = await loop.create_datagram_endpoint(
+            lambda: _Receiver(self.__process_video), local_addr=('0.0.0.0', self.video_port))
+        sock = self.video_transport.get_extra_info('socket')
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 512 * 1024)
+        # ports given as 0 are chosen by the system
+        self.port = self.transport.get_extra_info('sockname')[1]
+        self.video_port = sock.getsockname()[1]
+        self.__schedule(0.5, self.__watchdog)
+
+    def __schedule(self, interval, func):
+        # run func every interval seconds until close(), replacing an earlier schedule of func
+        handle = self.__handles.get(func)
+        if handle is not None:
+            handle.cancel()
+        self.__handles[func] = self.loop.call_later(interval, self.__run_periodic, interval, func)
+
+    def __run_periodic(self, interval, func):
+        if self.state == self.STATE_QUIT:
+            return
+        self.__handles[func] = self.loop.call_later(interval, self.__run_periodic, interval, func)
+        func()
+
+    def close(self):
+        """Close disconnects, fails pending commands, ends the event streams and closes the sockets."""
+        if self.state == self.STATE_QUIT:
+            return
+        was_connected = self.state == self.STATE_CONNECTED
+        self.state = self.STATE_QUIT
+        for handle in self.__handles.values():
+            handle.cancel()
+        self.__handles.clear()
+        self.stick_scheduler.stop()
+        if self.clock is not None:
+            self.clock.stop()
+            self.command_channel.close()
+        if was_connected:
+            self.connected.clear()
+            self._publish(self.EVENT_DISCONNECTED)
+        for stream in list(self.__streams):
+            stream.close()
+        for transport in (self.transport, self.video_transport):
+            if transport is not None:
+                transport.close()
+
+    def quit(self):
+        """Quit is an alias of close() for code written against Tello."""
+        self.close()
+
+    def __watchdog(self):
+        now = self.loop.time()
+        if self.state == self.STATE_CONNECTING:
+            if self.CONN_REQ_INTERVAL <= now - self.last_conn_req:
+                self.__send_conn_req()
+        elif self.state == self.STATE_CONNECTED:
+            if self.RECV_TIMEOUT < now - self.last_recv:
+                log.error('recv: timeout')
+                self.state = self.STATE_CONNECTING
+                self.video_enabled = False
+                self.clock.stop()
+                self.stick_scheduler.stop()
+                self.connected.clear()
+                self._publish(self.EVENT_DISCONNECTED)
+                self.__send_conn_req()
+
+    def __send_conn_req(self):
+        self.last_conn_req = self.loop.time()
+        pkt = conn_req_packet(self.video_port)
+        log.info('send connection request (cmd="conn_req:%02x%02x")', pkt.buf[-2], pkt.buf[-1])
+        return self.send_packet(pkt)
+
+    def send_packet(self, pkt):
+        """Send_packet is used to send a command packet to the drone."""
+        if self.transport is None or self.transport.is_closing():
+            return False
+        self.transport.sendto(pkt.get_buffer(), self.tello_addr)
+        return True
+
+    def __channel(self):
+        # commands need the command channel, which connect() creates on the event loop
+        if self.command_channel is None:
+            raise error.TelloError('not connected')
+        return self.command_channel
+
+    def __send_command(self, pkt, cmd, ack=True, retransmit=True):
+        future = self.__channel().submit(pkt, cmd, ack, retransmit)
+        return asyncio.wrap_future(future, loop=self.loop)
+
+    def takeoff(self):
+        """
+        Takeoff tells the drone to liftoff. It returns an awaitable resolved by the drone's ack.
+        Like the other commands, it raises TelloError if connect() has not been called.
+        """
+        log.info('takeoff (cmd=0x%02x seq=0x%04x)', TAKEOFF_CMD, self.__channel().seq)
+        return self.__send_command(Packet(TAKEOFF_CMD), TAKEOFF_CMD)
+
+    def land(self):
+        """Land tells the drone to come in for landing. It returns an awaitable like takeoff()."""
+        log.info('land (cmd=0x%02x seq=0x%04x)', LAND_CMD, self.__channel().seq)
+        pkt = Packet(LAND_CMD)
+        pkt.add_byte(0x00)
+        return self.__send_command(pkt, LAND_CMD)
+
+    def flip(self, direction):
+        """
+        Flip tells the drone to flip in direction, one of the Flip* constants such as
+        FlipFront. It returns an awaitable like takeoff().
+        """
+        log.info('flip %d (cmd=0x%02x seq=0x%04x)', direction, FLIP_CMD, self.__channel().seq)
+        pkt = Packet(FLIP_CMD, 0x70)
+        pkt.add_byte(direction)
+        return self.__send_command(pkt, FLIP_CMD, retransmit=False)
+
+    def flip_forward(self):
+        """flip_forward tells the drone to perform a forwards flip"""
+        return self.flip(FlipFront)
+
+    def flip_back(self):
+        """flip_back tells the drone to perform a backwards flip"""
+        return self.flip(FlipBack)
+
+    def flip_right(self):
+        """flip_right tells the drone to perform a right flip"""
+        return self.flip(FlipRight)
+
+    def flip_left(self):
+        """flip_left tells the drone to perform a left flip"""
+        return self.flip(FlipLeft)
+
+    def flip_forwardleft(self):
+        """flip_forwardleft tells the drone to perform a forwards left flip"""
+        return self.flip(FlipForwardLeft)
+
+    def flip_backleft(self):
+        """flip_backleft tells the drone to perform a backwards left flip"""
+        return self.flip(FlipBackLeft)
+
+    def flip_forwardright(self):
+        """flip_forwardright tells the drone to perform a forwards right flip"""
+        return self.flip(FlipForwardRight)
+
+    def flip_backright(self):
+        """flip_backright tells the drone to perform a backwards right flip"""
+        return self.flip(FlipBackRight)
+
+    def set_exposure(self, level):
+        """Set_exposure sets the camera exposure level (0, 1 or 2) and returns an awaitable."""
+        if level < 0 or 2 < level:
+            raise error.TelloError('Invalid exposure level')
+        self.exposure = level
+        return self.__send_exposure()
+
+    def __send_exposure(self):
+        pkt = Packet(EXPOSURE_CMD, 0x48)
+        pkt.add_byte(self.exposure)
+        return self.__send_command(pkt, EXPOSURE_CMD)
+
+    def set_video_encoder_rate(self, rate):
+        """Set_video_encoder_rate sets the video encoder rate and returns an awaitable."""
+        self.video_encoder_rate = rate
+        return self.__send_video_encoder_rate()
+
+    def __send_video_encoder_rate(self):
+        pkt = Packet(VIDEO_ENCODER_RATE_CMD, 0x68)
+        pkt.add_byte(self.video_encoder_rate)
+        return self.__send_command(pkt, VIDEO_ENCODER_RATE_CMD)
+
+    def __send_start_video(self, ack=True):
+        return self.__send_command(Packet(VIDEO_START_CMD, 0x60), VIDEO_START_CMD, ack)
+
+    def start_video(self):
+        """
+        Start_video tells the drone to send the video stream and returns an awaitable that
+        resolves when the drone acknowledges the request.
+        """
+        log.info('start video (cmd=0x%02x seq=0x%04x)', VIDEO_START_CMD, self.__channel().seq)
+        self.video_enabled = True
+        self.__send_exposure()
+        self.__send_video_encoder_rate()
+        return self.__send_start_video()
+
+    def __refresh_video(self):
+        # the drone only sends key frames on request, so keep asking while video is enabled
+        if self.video_enabled and self.state == self.STATE_CONNECTED:
+            self.__send_start_video(ack=False)
+
+    def __receive_packet(self, data):
+        if self.state == self.STATE_QUIT:
+            return
+        self.last_recv = self.loop.time()
+        self._process_packet(data)
+
+    def _connection_acked(self, data):
+        if self.state != self.STATE_CONNECTING:
+            return
+        self.state = self.STATE_CONNECTED
+        if self.video_enabled:
+            self.__send_exposure()
+            self.__send_video_encoder_rate()
+            self.__send_start_video()
+        self.clock.start()
+        self.stick_scheduler.start()
+        self.__schedule(self.VIDEO_REFRESH_INTERVAL, self.__refresh_video)
+        self.connected.set()
+        self._publish(self.EVENT_CONNECTED)
+
+    def __process_video(self, data):
+        if not self.video_enabled or self.state != self.STATE_CONNECTED:
+            return
+        self._publish(self.EVENT_VIDEO_FRAME, data[2:])
+        self._publish(self.EVENT_VIDEO_DATA, data)
+
+
+if __name__ == '__main__':
+    class FakeDrone(asyncio.DatagramProtocol):
+        def connection_made(self, transport):
+            self.transport = transport
+            self.commands = []
+            self.flips = []
+
+        def datagram_received(self, data, addr):
+            if data.startswith(b'conn_req:'):
+                self.video_addr = (addr[0], data[9] | (data[10] << 8))
+                self.transport.sendto(b'conn_ack:' + data[9:11], addr)
+                return
+            pkt = PacketView(data)
+            self.commands.append(pkt.cmd)
+            if pkt.cmd == FLIP_CMD:
+                self.flips.append(pkt.payload[0])
+            if pkt.cmd in (TAKEOFF_CMD, VIDEO_START_CMD, EXPOSURE_CMD, VIDEO_ENCODER_RATE_CMD,
+                           FLIP_CMD):
+                ack = Packet(pkt.cmd, 0x90)
+                ack.add_byte(0)
+                ack.fixup(pkt.seq)
+                self.transport.sendto(bytes(ack.get_buffer()), addr)
+            if pkt.cmd == TAKEOFF_CMD:
+                flight = Packet(FLIGHT_MSG)
+                for i in range(24):
+                    flight.add_byte(i)
+                flight.fixup()
+                self.transport.sendto(bytes(flight.get_buffer()), addr)
+            if pkt.cmd == VIDEO_START_CMD:
+                self.transport.sendto(b'\x00\x00\x00\x00\x00\x01\x67', self.video_addr)
+
+    async def main():
+        loop = asyncio.get_event_loop()
+        transport, fake = await loop.create_datagram_endpoint(
+            FakeDrone, local_addr=('127.0.0.1', 0))
+        drone = AsyncTello(port=0, video_port=0, tello_addr=transport.get_extra_info('sockname'))
+        try:
+            drone.takeoff()
+            assert False
+        except error.TelloError:
+            pass
+        await drone.connect(timeout=2.0)
+        flight_data = drone.flight_data()
+        frames = drone.video_frames()
+        assert await asyncio.wait_for(drone.takeoff(), 2.0) is True
+        data = await asyncio.wait_for(flight_data.__anext__(), 2.0)
+        assert data.height == 0x0100
+        assert await asyncio.wait_for(drone.flip_backright(), 2.0) is True
+        assert fake.flips == [FlipBackRight]
+        assert await asyncio.wait_for(drone.start_video(), 2.0) is True
+        frame = await asyncio.wait_for(frames.__anext__(), 2.0)
+        assert frame == b'\x00\x00\x00\x01\x67'
+        await asyncio.sleep(0.2)
+        assert STICK_CMD in fake.commands and TIME_CMD in fake.commands
+        land = drone.land()
+        drone.close()
+        try:
+            await land
+            assert False
+        except error.TelloError:
+            pass
+        async for _ in frames:
+            assert False
+        transport.close()
+        print(drone.get_command_stats())
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(main())
+    loop.close()
@@ -0,0 +1,221 @@
+import errno
+import socket
+import struct
+import sys
+
+# Linux reports the number of datagrams the kernel dropped on a socket with this option
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40)
+
+
+class BufferPool(object):
+    """
+    BufferPool receives datagrams into count preallocated buffers of size bytes with
+    recv_into(), so the receive path allocates no data buffers. Drain() reads the datagrams
+    queued on a non-blocking socket, a batch of up to count at a time, and hands each one to
+    the handler as a memoryview into the pool. It stops after max_batches batches even if
+    more are queued, so a flood of datagrams on one socket cannot keep a shared loop thread
+    from its other sockets and timers; a level-triggered selector reports the socket again.
+
+    The views are only valid until the handler returns: the buffers are reused by the next
+    batch. Consumers that keep data, such as VideoStream, must copy it with bytes().
+
+    After track_overflow(), datagrams are received with recvmsg_into() and kernel_drops
+    follows the count of datagrams the kernel dropped because the socket queue was full, so
+    they can be told apart from loss on the radio link.
+    """
+
+    def __init__(self, count=64, size=2048, max_batches=4):
+        self.size = size
+        self.max_batches = max_batches
+        self.buffers = [bytearray(size) for i in range(count)]
+        self.views = [memoryview(buf) for buf in self.buffers]
+        # what handlers get slices of: views, or in python 2 the buffers, since the items of
+        # a memoryview are strings there and slicing a bytearray copies it
+        self.slices = self.buffers if str is bytes else self.views
+        self.lengths = [0] * count
+        self.ancillary = 0
+        self.kernel_drops = 0
+        self.truncated = 0
+        self.batches = 0
+        self.datagrams = 0
+        self.max_batch = 0
+        self.capped = 0
+
+    def track_overflow(self, sock):
+        """Track_overflow enables SO_RXQ_OVFL on sock and returns False where unsupported."""
+        if not sys.platform.startswith('linux') or not hasattr(sock, 'recvmsg_into'):
+            return False
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+        except socket.error:
+            return False
+        self.ancillary = socket.CMSG_SPACE(4)
+        return True
+
+    def drain(self, sock, handler=None):
+        """
+        Drain receives until sock would block or max_batches batches are read, and calls
+        handler(view) for each datagram, or drops the data if handler is None. It returns the
+        number of datagrams received.
+        """
+        views = self.views
+        lengths = self.lengths
+        total = 0
+        for batch in range(self.max_batches):
+            count = 0
+            for view in views:
+                try:
+                    if self.ancillary:
+                        lengths[count], ancdata, flags, addr = sock.recvmsg_into((view,), self.ancillary)
+                        if ancdata:
+                            self.__read_ancillary(ancdata)
+                        if flags & socket.MSG_TRUNC:
+                            self.truncated += 1
+                    else:
+                        lengths[count] = sock.recv_into(view)
+                except socket.error as ex:
+                    if ex.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        raise
+                    break
+                count += 1
+            if count:
+                self.batches += 1
+                self.datagrams += count
+                if self.max_batch < count:
+                    self.max_batch = count
+                if handler is not None:
+                    slices = self.slices
+                    for i in range(count):
+                        handler(slices[i][:lengths[i]])
+            total += count
+            if count < len(views):
+                return total
+        self.capped += 1
+        return total
+
+    def __read_ancillary(self, ancdata):
+        for level, kind, data in ancdata:
+            if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and 4 <= len(data):
+                # the kernel reports its running total of drops for the socket
+                self.kernel_drops = struct.unpack('=I', data[:4])[0]
+
+    def get_stats(self):
+        return {
+            'batches': self.batches,
+            'datagrams': self.datagrams,
+            'max_batch': self.max_batch,
+            'capped': self.capped,
+            'kernel_drops': self.kernel_drops,
+            'truncated': self.truncated,
+        }
+
+
+class ReceiveBufferSizer(object):
+    """
+    ReceiveBufferSizer sets SO_RCVBUF of sock and doubles it, up to maximum, each time grow()
+    is called, typically after the kernel dropped datagrams. The kernel may grant less than
+    requested (net.core.rmem_max on Linux); size is the size actually granted.
+    """
+
+    def __init__(self, sock, initial=512 * 1024, maximum=8 * 1024 * 1024, log=None):
+        self.sock = sock
+        self.maximum = maximum
+        self.log = log
+        self.requested = initial
+        self.grows = 0
+        self.size = self.__set(initial)
+
+    def __set(self, size):
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+        return self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+    def grow(self):
+        """Grow doubles the requested size and returns False if the kernel granted no more."""
+        if self.maximum <= self.requested:
+            return False
+        self.requested = min(self.maximum, self.requested * 2)
+        size = self.__set(self.requested)
+        grown = self.size < size
+        if grown:
+            self.grows += 1
+        else:
+            # the kernel limit is reached; do not ask again
+            self.requested = self.maximum
+        if self.log:
+            self.log.info('receive buffer size = %d (requested %d)', size, self.requested)
+        self.size = size
+        return grown
+
+
+if __name__ == '__main__':
+    import time
+
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+    receiver.setblocking(False)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    addr = receiver.getsockname()
+
+    pool = BufferPool(count=8, size=2048)
+    assert pool.drain(receiver) == 0
+    for i in range(20):
+        sender.sendto(bytes(bytearray([i])) * (100 + i), addr)
+    time.sleep(0.05)
+    received = []
+    assert pool.drain(receiver, lambda view: received.append(bytes(view))) == 20
+    assert [len(data) for data in received] == [100 + i for i in range(20)]
+    assert all(data == bytes(bytearray([i])) * (100 + i) for i, data in enumerate(received))
+    assert pool.batches == 3 and pool.max_batch == 8 and pool.capped == 0
+
+    # a long queue is read a few batches per call
+    pool.max_batches = 2
+    for i in range(20):
+        sender.sendto(b'\x00' * 100, addr)
+    time.sleep(0.05)
+    assert pool.drain(receiver) == 16 and pool.capped == 1
+    assert pool.drain(receiver) == 4 and pool.capped == 1
+    pool.max_batches = 4
+
+    # overflow a small queue and see the kernel's count of the drops
+    sizer = ReceiveBufferSizer(receiver, initial=4096, maximum=65536)
+    if pool.track_overflow(receiver):
+        for i in range(200):
+            sender.sendto(b'\x00' * 1000, addr)
+        time.sleep(0.05)
+        received = pool.drain(receiver)
+        # the count rides on datagrams queued after the drops
+        sender.sendto(b'\x00', addr)
+        time.sleep(0.05)
+        received += pool.drain(receiver)
+        assert 0 < pool.kernel_drops and received + pool.kernel_drops == 201, pool.get_stats()
+        assert sizer.grow() and 4096 < sizer.size
+        print('kernel drops %d, receive buffer %d' % (pool.kernel_drops, sizer.size))
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+
+    packet = b'\x00' * 1460
+    number = 20000
+    plain = BufferPool(count=64, size=2048)
+    results = []
+    for name, receive in [
+            ('recvfrom', None),
+            ('recv_into', lambda: plain.drain(receiver, lambda view: view[2:])),
+            ('recvmsg_into', lambda: pool.drain(receiver, lambda view: view[2:]))]:
+        elapsed = 0.0
+        for i in range(0, number, 500):
+            for j in range(500):
+                sender.sendto(packet, addr)
+            start = time.time()
+            if receive is None:
+                while True:
+                    try:
+                        data, server = receiver.recvfrom(2048)
+                    except socket.error:
+                        break
+                    data = data[2:]
+            else:
+                while receive():
+                    pass
+            elapsed += time.time() - start
+        results.append('%s %.2f' % (name, elapsed / number * 1e6))
+    print('usec/datagram: %s' % ', '.join(results))
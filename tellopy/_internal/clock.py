@@ -0,0 +1,211 @@
+import collections
+import datetime
+import threading
+import time
+
+from . utils import monotonic
+
+
+class Clock(object):
+    """
+    Clock gives wall clock time that advances with time.monotonic(). It is anchored to the
+    system clock once, so timestamps neither jump nor go backwards when the system clock is
+    adjusted while flying.
+    """
+
+    def __init__(self):
+        self.wall_base = time.time()
+        self.monotonic_base = monotonic()
+
+    def monotonic(self):
+        return monotonic()
+
+    def time(self):
+        return self.wall_base + (monotonic() - self.monotonic_base)
+
+    def now(self):
+        return datetime.datetime.fromtimestamp(self.time())
+
+
+default_clock = Clock()
+
+
+def now():
+    """Now returns the current local time of the default clock as a datetime."""
+    return default_clock.now()
+
+
+def time_of_day(timestamp):
+    dt = datetime.datetime.fromtimestamp(timestamp)
+    return dt.hour * 3600 + dt.minute * 60 + dt.second + dt.microsecond / 1e6
+
+
+def decode_time_of_day(payload):
+    """
+    Decode_time_of_day returns the seconds since midnight carried by a TIME_CMD payload in the
+    layout written by Packet.add_time(), or None if the payload does not hold a valid time.
+    """
+    if len(payload) < 11:
+        return None
+    hour = payload[1] | (payload[2] << 8)
+    minute = payload[3] | (payload[4] << 8)
+    second = payload[5] | (payload[6] << 8)
+    msec = payload[7] | (payload[9] << 8)
+    if 24 <= hour or 60 <= minute or 60 <= second or 1000 <= msec:
+        return None
+    return hour * 3600 + minute * 60 + second + msec / 1000.0
+
+
+class LinkEstimator(object):
+    """
+    LinkEstimator tracks round trip time and drone clock offset from request/reply samples.
+    The RTT is smoothed as in RFC 6298 and jitter is the RFC 3550 estimator applied to
+    consecutive RTTs. The clock offset is taken from the sample with the lowest RTT in a
+    small window, since that sample has the least queueing error (the NTP clock filter).
+    """
+
+    def __init__(self, window=8):
+        self.samples = 0
+        self.last_rtt = None
+        self.min_rtt = None
+        self.srtt = None
+        self.rttvar = None
+        self.jitter = 0.0
+        self.offset = None
+        self.window = collections.deque(maxlen=window)
+
+    def add_sample(self, rtt, offset=None):
+        self.samples += 1
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+            self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16.0
+        self.last_rtt = rtt
+        if self.min_rtt is None or rtt < self.min_rtt:
+            self.min_rtt = rtt
+        if offset is not None:
+            self.window.append((rtt, offset))
+            self.offset = min(self.window)[1]
+
+
+class ClockService(object):
+    """
+    ClockService runs periodic TIME_CMD exchanges with the drone and keeps a LinkEstimator up
+    to date from the replies. send_request() must send one time request and return its
+    sequence number; replies are passed in with reply_received(). Other parts of the library
+    can read rtt, jitter and offset at any time for latency aware decisions.
+    """
+
+    def __init__(self, timer, send_request, interval=1.0, timeout=2.0, clock=None):
+        self.timer = timer
+        self.send_request = send_request
+        self.interval = interval
+        self.timeout = timeout
+        self.clock = clock or default_clock
+        self.estimator = LinkEstimator()
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.handle = None
+        self.running = False
+        self.requests = 0
+        self.replies = 0
+        self.lost = 0
+
+    @property
+    def rtt(self):
+        return self.estimator.srtt
+
+    @property
+    def jitter(self):
+        return self.estimator.jitter
+
+    @property
+    def offset(self):
+        """Offset is the drone clock minus the local clock in seconds, or None if unknown."""
+        return self.estimator.offset
+
+    def now(self):
+        return self.clock.now()
+
+    def start(self):
+        self.stop()
+        self.running = True
+        self.handle = self.timer.call_later(0, self.__tick)
+
+    def stop(self):
+        self.running = False
+        handle = self.handle
+        self.handle = None
+        if handle is not None:
+            handle.cancel()
+
+    def __tick(self):
+        if not self.running:
+            return
+        self.handle = self.timer.call_later(self.interval, self.__tick)
+        sent_at = self.clock.monotonic()
+        seq = self.send_request()
+        if seq is None:
+            return
+        self.lock.acquire()
+        try:
+            for old_seq, old_sent_at in list(self.pending.items()):
+                if self.timeout < sent_at - old_sent_at[0]:
+                    del self.pending[old_seq]
+                    self.lost += 1
+            self.pending[seq] = (sent_at, self.clock.time())
+            self.requests += 1
+        finally:
+            self.lock.release()
+
+    def reply_received(self, seq, payload):
+        """Reply_received feeds a TIME_CMD from the drone; it returns True if it was a reply."""
+        received_at = self.clock.monotonic()
+        self.lock.acquire()
+        try:
+            request = self.pending.pop(seq, None)
+            if request is None:
+                return False
+            self.replies += 1
+            sent_at, sent_wall = request
+            rtt = received_at - sent_at
+            offset = None
+            drone_time = decode_time_of_day(payload)
+            if drone_time is not None:
+                offset = drone_time - time_of_day(sent_wall + rtt / 2.0)
+                # keep the offset in [-12h, 12h) across midnight
+                offset = (offset + 43200.0) % 86400.0 - 43200.0
+            self.estimator.add_sample(rtt, offset)
+        finally:
+            self.lock.release()
+        return True
+
+    def get_stats(self):
+        estimator = self.estimator
+        return {
+            'requests': self.requests,
+            'replies': self.replies,
+            'lost': self.lost,
+            'rtt': estimator.srtt,
+            'min_rtt': estimator.min_rtt,
+            'jitter': estimator.jitter,
+            'offset': estimator.offset,
+        }
+
+
+if __name__ == '__main__':
+    clock = Clock()
+    assert abs(clock.time() - time.time()) < 0.1
+
+    estimator = LinkEstimator()
+    for rtt, offset in [(0.020, 1.5), (0.010, 1.0), (0.030, 2.0)]:
+        estimator.add_sample(rtt, offset)
+    assert estimator.min_rtt == 0.010 and estimator.offset == 1.0
+    assert 0.0 < estimator.jitter and 0.010 < estimator.srtt < 0.030
+
+    assert decode_time_of_day(bytearray([0, 1, 0, 2, 0, 3, 0, 4, 0, 1, 0])) == 3723.26
+    assert decode_time_of_day(bytearray([0, 25, 0, 2, 0, 3, 0, 4, 0, 1, 0])) is None
+    assert decode_time_of_day(bytearray(3)) is None
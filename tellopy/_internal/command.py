@@ -0,0 +1,219 @@
+import threading
+from concurrent.futures import Future
+
+from . import error
+
+
+class PendingCommand(object):
+    __slots__ = ('cmd', 'seq', 'pkt', 'future', 'sent_at', 'retries', 'rto', 'timer',
+                 'retransmit')
+
+    def __init__(self, cmd, seq, pkt, future, sent_at, rto, retransmit=True):
+        self.cmd = cmd
+        self.seq = seq
+        self.pkt = pkt
+        self.future = future
+        self.sent_at = sent_at
+        self.retries = 0
+        self.rto = rto
+        self.timer = None
+        self.retransmit = retransmit
+
+
+class CommandChannel(object):
+    """
+    CommandChannel gives outgoing commands sequence numbers, matches the drone's acks to them
+    and retransmits commands that are not acknowledged in time.
+
+    The retransmission timeout is derived from measured round trip times as in RFC 6298:
+    smoothed RTT plus four times its variation, clamped to [min_rto, max_rto] and doubled
+    on each retransmission of a command. Following Karn's rule, acks of retransmitted
+    commands are not used as RTT samples since they cannot be attributed to one send.
+
+    Every submit() returns a concurrent.futures.Future. It resolves to True when the command
+    is acknowledged (or sent, for commands that are not acknowledged by the drone) and fails
+    with TelloError when it runs out of retries or the channel is closed.
+
+    Commands that must not be repeated, such as flips, are submitted with retransmit=False:
+    they are sent once, and if only the ack is lost the drone does not flip twice. Their
+    Future still follows the ack, and fails if none arrives within max_rto.
+    """
+
+    def __init__(self, send, timer, first_seq=0x01e4, initial_rto=0.3, min_rto=0.05,
+                 max_rto=2.0, max_retries=5, log=None):
+        self.send = send
+        self.timer = timer
+        self.log = log
+        self.lock = threading.Lock()
+        self.seq = first_seq
+        self.pending = {}
+        self.initial_rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.max_retries = max_retries
+        self.rto = initial_rto
+        self.srtt = None
+        self.rttvar = None
+        self.closed = False
+        self.sent = 0
+        self.acked = 0
+        self.retransmits = 0
+        self.failed = 0
+
+    def submit(self, pkt, cmd, ack=True, retransmit=True):
+        """Submit assigns the next sequence number to pkt, finalizes and sends it."""
+        future = Future()
+        self.lock.acquire()
+        try:
+            if self.closed:
+                future.set_exception(error.TelloError('command channel closed'))
+                return future
+            seq = self.seq
+            self.seq = (seq + 1) & 0xffff
+            pkt.fixup(seq)
+            self.sent += 1
+            if ack:
+                rto = self.rto if retransmit else self.max_rto
+                entry = PendingCommand(cmd, seq, pkt, future, self.timer.time(), rto, retransmit)
+                self.pending[(cmd, seq)] = entry
+                entry.timer = self.timer.call_later(rto, self.__expire, entry)
+        finally:
+            self.lock.release()
+        ok = self.send(pkt)
+        if not ack:
+            future.set_result(ok)
+        return future
+
+    def handle_ack(self, cmd, seq):
+        """Handle_ack resolves the command acknowledged by (cmd, seq) and returns it, if any."""
+        now = self.timer.time()
+        self.lock.acquire()
+        try:
+            entry = self.pending.pop((cmd, seq), None)
+            if entry is None:
+                # tolerate acks that do not echo our sequence number: take the oldest command
+                oldest = None
+                for candidate in self.pending.values():
+                    if candidate.cmd == cmd and (oldest is None or candidate.sent_at < oldest.sent_at):
+                        oldest = candidate
+                if oldest is None:
+                    return None
+                entry = self.pending.pop((oldest.cmd, oldest.seq))
+            entry.timer.cancel()
+            self.acked += 1
+            if entry.retries == 0:
+                self.__update_rtt(now - entry.sent_at)
+        finally:
+            self.lock.release()
+        entry.future.set_result(True)
+        return entry
+
+    def __update_rtt(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(self.max_rto, max(self.min_rto, self.srtt + 4.0 * self.rttvar))
+
+    def __expire(self, entry):
+        self.lock.acquire()
+        try:
+            if self.pending.get((entry.cmd, entry.seq)) is not entry:
+                return
+            if self.max_retries <= entry.retries or not entry.retransmit:
+                del self.pending[(entry.cmd, entry.seq)]
+                self.failed += 1
+                give_up = True
+            else:
+                give_up = False
+                entry.retries += 1
+                entry.rto = min(self.max_rto, entry.rto * 2)
+                entry.sent_at = self.timer.time()
+                entry.timer = self.timer.call_later(entry.rto, self.__expire, entry)
+                self.retransmits += 1
+        finally:
+            self.lock.release()
+        if give_up:
+            if self.log:
+                self.log.warn('command 0x%04x seq=0x%04x was not acknowledged',
+                              entry.cmd, entry.seq)
+            entry.future.set_exception(error.TelloError('no ack for command 0x%04x' % entry.cmd))
+        else:
+            if self.log:
+                self.log.info('retransmit command 0x%04x seq=0x%04x (rto=%dms)',
+                              entry.cmd, entry.seq, entry.rto * 1000)
+            self.send(entry.pkt)
+
+    def close(self):
+        """Close fails every pending command and rejects further submissions."""
+        self.lock.acquire()
+        try:
+            self.closed = True
+            entries = list(self.pending.values())
+            self.pending.clear()
+        finally:
+            self.lock.release()
+        for entry in entries:
+            entry.timer.cancel()
+            entry.future.set_exception(error.TelloError('command channel closed'))
+
+    def get_stats(self):
+        return {
+            'sent': self.sent,
+            'acked': self.acked,
+            'retransmits': self.retransmits,
+            'failed': self.failed,
+            'pending': len(self.pending),
+            'srtt': self.srtt,
+            'rttvar': self.rttvar,
+            'rto': self.rto,
+        }
+
+
+if __name__ == '__main__':
+    from . io_loop import IOLoop
+    from . protocol import Packet, TAKEOFF_CMD, LAND_CMD, FLIP_CMD
+
+    sent = []
+
+    def send(pkt):
+        sent.append(bytes(pkt.get_buffer()))
+        return True
+
+    timer = IOLoop()
+    channel = CommandChannel(send, timer, initial_rto=0.02, min_rto=0.01, max_retries=2)
+
+    takeoff = channel.submit(Packet(TAKEOFF_CMD), TAKEOFF_CMD)
+    assert channel.handle_ack(TAKEOFF_CMD, 0x01e4) is not None
+    assert takeoff.result(1.0) is True and channel.srtt is not None
+
+    land = channel.submit(Packet(LAND_CMD), LAND_CMD)
+    try:
+        land.result(2.0)
+        assert False
+    except error.TelloError:
+        pass
+    assert channel.retransmits == 2 and channel.failed == 1
+    assert sent[1] == sent[2] == sent[3]
+
+    # acks that do not echo the sequence number still resolve the oldest command
+    land = channel.submit(Packet(LAND_CMD), LAND_CMD)
+    assert channel.handle_ack(LAND_CMD, 0) is not None and land.result(0) is True
+
+    # a command submitted with retransmit=False is sent once and fails without an ack
+    channel.max_rto = 0.05
+    count = len(sent)
+    flip = channel.submit(Packet(FLIP_CMD, 0x70), FLIP_CMD, retransmit=False)
+    assert isinstance(flip.exception(2.0), error.TelloError)
+    assert len(sent) == count + 1 and channel.retransmits == 2 and channel.failed == 2
+    flip = channel.submit(Packet(FLIP_CMD, 0x70), FLIP_CMD, retransmit=False)
+    assert channel.handle_ack(FLIP_CMD, 0) is not None and flip.result(0) is True
+
+    pending = channel.submit(Packet(LAND_CMD), LAND_CMD)
+    channel.close()
+    assert isinstance(pending.exception(0), error.TelloError)
+    print(channel.get_stats())
+    timer.stop()
+    timer.thread.join(1.0)
@@ -0,0 +1,231 @@
+from . import event
+from . import log_data
+from . import logger
+from . import state
+from . utils import *
+from . protocol import *
+
+
+class TelloCore(object):
+    """
+    TelloCore is the part of the Tello protocol that does not depend on how datagrams are
+    sent and received: validation and decoding of received packets, the decoder registry,
+    the flight log, acks, time replies and the stick axes. Tello and AsyncTello both build on
+    it. A front end calls _init_core() from its __init__ and provides
+
+    - log, the Logger of the front end,
+    - command_channel, clock and stick_scheduler, as created by the front end,
+    - send_packet(pkt),
+    - _publish(event, data), which delivers data to the subscribers of event,
+    - _connection_acked(data), called when the drone answers a connection request.
+    """
+    EVENT_CONNECTED = event.Event('connected')
+    EVENT_WIFI = event.Event('wifi')
+    EVENT_LIGHT = event.Event('light')
+    EVENT_FLIGHT_DATA = event.Event('fligt_data')
+    EVENT_LOG = event.Event('log')
+    EVENT_LOG_IMU = event.Event('log imu')
+    EVENT_LOG_MVO = event.Event('log mvo')
+    EVENT_TIME = event.Event('time')
+    EVENT_VIDEO_FRAME = event.Event('video frame')
+    EVENT_VIDEO_DATA = event.Event('video data')
+    EVENT_DISCONNECTED = event.Event('disconnected')
+
+    STATE_DISCONNECTED = state.State('disconnected')
+    STATE_CONNECTING = state.State('connecting')
+    STATE_CONNECTED = state.State('connected')
+    STATE_QUIT = state.State('quit')
+
+    def _init_core(self):
+        self.left_x = 0.0
+        self.left_y = 0.0
+        self.right_x = 0.0
+        self.right_y = 0.0
+        self.packet_validator = PacketValidator()
+        self.stick_encoder = StickEncoder()
+        self.log_data = log_data.LogDecoder()
+        self._decoders = {}
+        self.register_decoder(LOG_HEADER_MSG, self._recv_log_header, self.EVENT_LOG)
+        self.register_decoder(LOG_DATA_MSG, self._recv_log_data)
+        self.register_decoder(WIFI_MSG, decode_payload, self.EVENT_WIFI)
+        self.register_decoder(LIGHT_MSG, decode_payload, self.EVENT_LIGHT)
+        self.register_decoder(FLIGHT_MSG, decode_flight_data, self.EVENT_FLIGHT_DATA)
+        self.register_decoder(TIME_CMD, self._recv_time, self.EVENT_TIME)
+        for cmd in (TAKEOFF_CMD, LAND_CMD, VIDEO_START_CMD, VIDEO_ENCODER_RATE_CMD,
+                    EXPOSURE_CMD, FLIP_CMD):
+            self.register_decoder(cmd, self._recv_ack)
+
+    def register_decoder(self, cmd, decoder, event=None):
+        """
+        Register_decoder routes received packets with the command id cmd to decoder, replacing
+        any previous registration. The decoder is called with a PacketView on the receive thread
+        and whatever it returns, unless None, is published as the data of event.
+        Pass decoder=None to drop the registration, after which cmd counts as unknown.
+        """
+        if decoder is None:
+            self._decoders.pop(cmd, None)
+        else:
+            self._decoders[cmd] = (decoder, event)
+
+    def get_packet_stats(self):
+        """
+        Get_packet_stats returns counters of received command packets, including the number
+        of malformed, bad crc and unknown command packets that were dropped.
+        """
+        return self.packet_validator.get_stats()
+
+    def _process_packet(self, data):
+        log = self.log
+        if str is bytes and not isinstance(data, bytearray):
+            # the items of str and memoryview are strings on python 2
+            data = bytearray(data)
+
+        if data[0:9] == b'conn_ack:':
+            log.info('connected. (port=%s)', byte_to_hexstring(data[9:11]).replace(' ', ''))
+            if log.is_enabled(logger.LOG_DEBUG):
+                log.debug('    %s', byte_to_hexstring(data))
+            self._connection_acked(data)
+            return True
+
+        if not self.packet_validator.check(data):
+            if log.is_enabled(logger.LOG_DEBUG):
+                log.limited(logger.LOG_DEBUG, 1.0, 'invalid packet (ignored): %s',
+                            byte_to_hexstring(data))
+            return False
+
+        pkt = PacketView(data)
+        entry = self._decoders.get(pkt.cmd)
+        if entry is None:
+            self.packet_validator.unknown_cmd += 1
+            if log.is_enabled(logger.LOG_INFO):
+                log.limited(logger.LOG_INFO, 1.0, 'unknown packet: %s', byte_to_hexstring(data))
+            return False
+
+        decoder, event = entry
+        result = decoder(pkt)
+        if event is not None and result is not None:
+            if log.is_enabled(logger.LOG_DEBUG):
+                log.debug("recv: %s: %s", event.getname(), byte_to_hexstring(pkt.payload))
+            self._publish(event, result)
+
+        return True
+
+    def _recv_log_header(self, pkt):
+        # the drone repeats the header until it is acknowledged, then streams LOG_DATA_MSG
+        payload = pkt.payload
+        if 2 <= len(payload):
+            ack = Packet(LOG_HEADER_MSG, 0x50)
+            ack.add_byte(0x00)
+            ack.add_int16(payload[0] | (payload[1] << 8))
+            self.command_channel.submit(ack, LOG_HEADER_MSG, ack=False)
+        return bytes(payload)
+
+    def _recv_log_data(self, pkt):
+        decoder = self.log_data
+        imu_seq = decoder.imu.seq
+        mvo_seq = decoder.mvo.seq
+        # the first byte of the payload is not part of the record stream
+        decoder.feed(pkt.payload[1:], self.clock.clock.time())
+        if imu_seq != decoder.imu.seq:
+            self._publish(self.EVENT_LOG_IMU, log_data.LogBatch(decoder.imu, imu_seq, decoder.imu.seq))
+        if mvo_seq != decoder.mvo.seq:
+            self._publish(self.EVENT_LOG_MVO, log_data.LogBatch(decoder.mvo, mvo_seq, decoder.mvo.seq))
+
+    def _recv_time(self, pkt):
+        self.clock.reply_received(pkt.seq, pkt.payload)
+        return decode_time(pkt)
+
+    def _recv_ack(self, pkt):
+        self.command_channel.handle_ack(pkt.cmd, pkt.seq)
+        if self.log.is_enabled(logger.LOG_INFO):
+            self.log.info("recv: ack: cmd=0x%02x seq=0x%04x %s",
+                          pkt.cmd, pkt.seq, byte_to_hexstring(pkt.data))
+
+    def _send_time_command(self):
+        self.log.debug('send_time (cmd=0x%02x seq=0x%04x)', TIME_CMD, self.command_channel.seq)
+        pkt = Packet(TIME_CMD, 0x50)
+        pkt.add_byte(0)
+        pkt.add_time(self.clock.now())
+        self.command_channel.submit(pkt, TIME_CMD, ack=False)
+        return int16(pkt.buf[7], pkt.buf[8])
+
+    def _send_stick_command(self):
+        pkt = self.stick_encoder
+        pkt.encode(self.right_x, self.right_y, self.left_y, self.left_x)
+        if self.log.is_enabled(logger.LOG_DEBUG):
+            self.log.debug("stick command: yaw=%4.2f thr=%4.2f pit=%4.2f rol=%4.2f %s",
+                           self.left_x, self.left_y, self.right_y, self.right_x,
+                           byte_to_hexstring(pkt.get_buffer()))
+        return self.send_packet(pkt)
+
+    def _fix_range(self, val, min=-1.0, max=1.0):
+        if val < min:
+            val = min
+        elif val > max:
+            val = max
+        return val
+
+    def set_throttle(self, throttle):
+        """
+        Set_throttle controls the vertical up and down motion of the drone.
+        Pass in an int from -1.0 ~ 1.0. (positive value means upward)
+        """
+        throttle = self._fix_range(throttle)
+        if self.left_y != throttle:
+            self.log.info('set_throttle(val=%4.2f)', throttle)
+            self.left_y = throttle
+            self.stick_scheduler.kick()
+
+    def set_yaw(self, yaw):
+        """
+        Set_yaw controls the left and right rotation of the drone.
+        Pass in an int from -1.0 ~ 1.0. (positive value will make the drone turn to the right)
+        """
+        yaw = self._fix_range(yaw)
+        if self.left_x != yaw:
+            self.log.info('set_yaw(val=%4.2f)', yaw)
+            self.left_x = yaw
+            self.stick_scheduler.kick()
+
+    def set_pitch(self, pitch):
+        """
+        Set_pitch controls the forward and backward tilt of the drone.
+        Pass in an int from -1.0 ~ 1.0. (positive value will make the drone move forward)
+        """
+        pitch = self._fix_range(pitch)
+        if self.right_y != pitch:
+            self.log.info('set_pitch(val=%4.2f)', pitch)
+            self.right_y = pitch
+            self.stick_scheduler.kick()
+
+    def set_roll(self, roll):
+        """
+        Set_roll controls the the side to side tilt of the drone.
+        Pass in an int from -1.0 ~ 1.0. (positive value will make the drone move to the right)
+        """
+        roll = self._fix_range(roll)
+        if self.right_x != roll:
+            self.log.info('set_roll(val=%4.2f)', roll)
+            self.right_x = roll
+            self.stick_scheduler.kick()
+
+    def get_stick_stats(self):
+        """
+        Get_stick_stats returns the stick command rate and counters of scheduled and immediate
+        sends, missed deadlines, and the jitter and maximum lateness of sends in seconds.
+        """
+        return self.stick_scheduler.get_stats()
+
+    def get_clock_stats(self):
+        """
+        Get_clock_stats returns the link round trip time, jitter and drone clock offset (all
+        in seconds, None until measured) estimated from the periodic time exchanges.
+        """
+        return self.clock.get_stats()
+
+    def get_command_stats(self):
+        """
+        Get_command_stats returns counters of sent, acknowledged, retransmitted and failed
+        commands along with the current round trip time estimate and retransmission timeout.
+        """
+        return self.command_channel.get_stats()
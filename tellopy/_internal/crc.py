@@ -1,3 +1,10 @@
+import binascii
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 crc8table = bytearray([
     0x00, 0x5e, 0xbc, 0xe2, 0x61, 0x3f, 0xdd, 0x83,
     0xc2, 0x9c, 0x7e, 0x20, 0xa3, 0xfd, 0x1f, 0x41,
@@ -33,10 +40,10 @@ crc8table = bytearray([
     0xb6, 0xe8, 0x0a, 0x54, 0xd7, 0x89, 0x6b, 0x35])
 
 
-def crc8(buf):
-    crc = 0x77
+def crc8(buf, crc=0x77):
+    table = crc8table
     for v in buf:
-        crc = crc8table[(crc ^ v) & 0xff]
+        crc = table[crc ^ v]
     return crc
 
 crc16table = [
@@ -74,8 +81,208 @@ crc16table = [
     0x7bc7, 0x6a4e, 0x58d5, 0x495c, 0x3de3, 0x2c6a, 0x1ef1, 0x0f78]
 
 
-def crc16(buf):
-    crc = 0x3692
-    for v in buf:
-        crc = crc16table[(crc ^ int(v)) & 0xff] ^ (crc >> 8)
+def _slice16(table, n):
+    tables = [table]
+    for k in range(1, n):
+        prev = tables[-1]
+        tables.append([(prev[i] >> 8) ^ table[prev[i] & 0xff] for i in range(256)])
+    return tables
+
+
+# slicing-by-4 tables: crc16slices[k][b] is the crc of byte b followed by k zero bytes
+crc16slices = _slice16(crc16table, 4)
+
+# crc16 is the bit-reflected form of CRC-CCITT (poly 0x1021). binascii.crc_hqx
+# implements the non-reflected form in C, so we feed it bit-reversed bytes and
+# bit-reverse the register on the way in and out.
+_reflect8 = bytes(bytearray([int('{0:08b}'.format(i)[::-1], 2) for i in range(256)]))
+_reflect8table = bytearray(_reflect8)
+
+
+def crc16(buf, crc=0x3692):
+    if len(buf) < 6:
+        # too short to amortize the translate() and crc_hqx() calls; a bytearray of buf
+        # indexes to ints on python 2 as well
+        table = crc16table
+        for v in bytearray(buf):
+            crc = table[(crc ^ v) & 0xff] ^ (crc >> 8)
+        return crc
+    if isinstance(buf, memoryview):
+        buf = buf.tobytes()
+    elif not isinstance(buf, (bytes, bytearray)):
+        buf = bytearray(buf)
+    rt = _reflect8table
+    crc = binascii.crc_hqx(buf.translate(_reflect8), (rt[crc & 0xff] << 8) | rt[crc >> 8])
+    return (rt[crc & 0xff] << 8) | rt[crc >> 8]
+
+
+def crc16_slow(buf, crc=0x3692):
+    """
+    Pure python slicing-by-4 implementation of crc16. It produces the same results as
+    crc16() and is kept as a reference for platforms where binascii is not accelerated.
+    """
+    t0, t1, t2, t3 = crc16slices
+    n = len(buf)
+    end = n - (n & 3)
+    i = 0
+    while i < end:
+        crc ^= buf[i] | (buf[i + 1] << 8)
+        crc = t3[crc & 0xff] ^ t2[crc >> 8] ^ t1[buf[i + 2]] ^ t0[buf[i + 3]]
+        i += 4
+    while i < n:
+        crc = t0[(crc ^ buf[i]) & 0xff] ^ (crc >> 8)
+        i += 1
     return crc
+
+
+class Crc16(object):
+    """
+    Crc16 is a resumable crc16 computation. Feed data with update() or update_byte() and read
+    the result from value. Start from crc=0 to get the raw contribution of a chunk, which can
+    later be joined to a prefix with crc16_combine() once the prefix is known.
+    """
+    __slots__ = ('value', 'length')
+
+    def __init__(self, crc=0x3692):
+        self.value = crc
+        self.length = 0
+
+    def update(self, chunk):
+        self.value = crc16(chunk, self.value)
+        self.length += len(chunk)
+        return self
+
+    def update_byte(self, val):
+        crc = self.value
+        self.value = crc16table[(crc ^ val) & 0xff] ^ (crc >> 8)
+        self.length += 1
+
+
+_zeros_tables = {}
+
+
+def _zeros_table(n):
+    # crc16 over n zero bytes is linear in the starting register, so it can be
+    # tabulated by register byte: zeros(c) == lo[c & 0xff] ^ hi[c >> 8]
+    table = _zeros_tables.get(n)
+    if table is None:
+        zeros = bytearray(n)
+        basis = [crc16(zeros, 1 << k) for k in range(16)]
+        lo = [0] * 256
+        hi = [0] * 256
+        for b in range(1, 256):
+            low_bit = (b & -b).bit_length() - 1
+            lo[b] = lo[b & (b - 1)] ^ basis[low_bit]
+            hi[b] = hi[b & (b - 1)] ^ basis[low_bit + 8]
+        if 64 <= len(_zeros_tables):
+            _zeros_tables.clear()
+        table = _zeros_tables[n] = (lo, hi)
+    return table
+
+
+def crc16_combine(crc1, crc2, len2):
+    """
+    Crc16_combine returns crc16(a + b, crc) given crc1 = crc16(a, crc) and crc2 = crc16(b, 0),
+    where len2 is len(b). Tables are cached per len2, so combining is two lookups.
+    """
+    lo, hi = _zeros_table(len2)
+    return lo[crc1 & 0xff] ^ hi[crc1 >> 8] ^ crc2
+
+
+_NUMPY_MIN_BATCH = 64
+_numpy_tables = None
+
+
+def crc16_many(bufs, crc=0x3692):
+    """
+    Crc16_many returns the crc16 of every buffer in bufs as a list of ints.
+
+    When numpy is available, buffers of the same length are stacked into a matrix and the
+    table lookup runs column-wise over all of them at once, two bytes per step. A packet
+    that still carries its trailing little-endian crc16 yields 0, so a whole capture can be
+    validated with crc16_many(packets) and a comparison against zero.
+    """
+    global _numpy_tables
+    if numpy is None or len(bufs) < _NUMPY_MIN_BATCH:
+        return [crc16(buf, crc) for buf in bufs]
+    if _numpy_tables is None:
+        _numpy_tables = [numpy.array(t, dtype=numpy.uint16) for t in crc16slices[0:2]]
+    t0, t1 = _numpy_tables
+
+    groups = {}
+    for i, buf in enumerate(bufs):
+        groups.setdefault(len(buf), []).append(i)
+
+    result = [crc] * len(bufs)
+    for length, indexes in groups.items():
+        if length == 0:
+            continue
+        joined = b''.join([bytes(bufs[i]) for i in indexes])
+        # one row per byte position so that each step reads a contiguous column
+        cols = numpy.frombuffer(joined, dtype=numpy.uint8).reshape(len(indexes), length)
+        cols = numpy.ascontiguousarray(cols.T).astype(numpy.uint16)
+        reg = numpy.full(len(indexes), crc, dtype=numpy.uint16)
+        pos = 0
+        while pos + 1 < length:
+            reg ^= cols[pos] | (cols[pos + 1] << 8)
+            reg = t1[reg & 0xff] ^ t0[reg >> 8]
+            pos += 2
+        if pos < length:
+            reg = t0[(reg ^ cols[pos]) & 0xff] ^ (reg >> 8)
+        for i, val in zip(indexes, reg.tolist()):
+            result[i] = val
+    return result
+
+
+if __name__ == '__main__':
+    import os
+    import timeit
+
+    def crc8_bytewise(buf):
+        crc = 0x77
+        for v in buf:
+            crc = crc8table[(crc ^ v) & 0xff]
+        return crc
+
+    def crc16_bytewise(buf):
+        crc = 0x3692
+        for v in buf:
+            crc = crc16table[(crc ^ int(v)) & 0xff] ^ (crc >> 8)
+        return crc
+
+    for n in range(0, 70):
+        buf = bytearray(os.urandom(n))
+        assert crc8(buf) == crc8_bytewise(buf)
+        assert crc16(buf) == crc16_bytewise(buf)
+        assert crc16(bytes(buf)) == crc16(memoryview(buf)) == crc16(list(buf)) == crc16(buf)
+        assert crc16_slow(buf) == crc16(buf)
+        sealed = buf + bytearray([crc16(buf) & 0xff, crc16(buf) >> 8])
+        assert crc16(sealed) == 0
+
+        head = bytearray(os.urandom(9))
+        state = Crc16(0)
+        for v in buf:
+            state.update_byte(v)
+        assert state.value == Crc16(0).update(buf).value == crc16(buf, 0)
+        assert crc16_combine(crc16(head), state.value, len(buf)) == crc16(head + buf)
+
+    packets = [bytearray(os.urandom(n)) for n in [11, 22, 13, 24, 1460] * 1000]
+    assert crc16_many(packets) == [crc16_bytewise(p) for p in packets]
+
+    def bench(name, func, number):
+        usec = timeit.timeit(func, number=number) / number * 1e6
+        print('%-40s %10.2f usec' % (name, usec))
+
+    for n in [3, 22, 1460]:
+        buf = bytearray(os.urandom(n))
+        bench('crc8_bytewise(%d bytes)' % n, lambda: crc8_bytewise(buf), 2000)
+        bench('crc8(%d bytes)' % n, lambda: crc8(buf), 2000)
+        bench('crc16_bytewise(%d bytes)' % n, lambda: crc16_bytewise(buf), 2000)
+        bench('crc16_slow(%d bytes)' % n, lambda: crc16_slow(buf), 2000)
+        bench('crc16(%d bytes)' % n, lambda: crc16(buf), 2000)
+
+    packets = [bytearray(os.urandom(22)) for i in range(10000)]
+    bench('crc16_bytewise x 10000 packets', lambda: [crc16_bytewise(p) for p in packets], 5)
+    bench('crc16 x 10000 packets', lambda: [crc16(p) for p in packets], 5)
+    bench('crc16_many(10000 packets)%s' % ('' if numpy else ' (no numpy)'),
+          lambda: crc16_many(packets), 5)
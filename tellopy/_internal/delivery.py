@@ -0,0 +1,179 @@
+import collections
+import threading
+
+from . utils import *
+
+# what a QueuedReceiver does with an event that arrives while its queue is full
+LATEST = 'latest'
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+POLICIES = (LATEST, DROP_OLDEST, DROP_NEWEST)
+
+
+class QueuedReceiver(object):
+    """
+    QueuedReceiver calls a handler on a worker thread of its own instead of the thread the
+    event is sent on, so a slow handler does not hold up receiving. Events wait in a queue of
+    up to maxsize items; when it is full, policy decides which one is dropped:
+
+    - LATEST keeps only the newest event, for state such as flight data where older values
+      are useless once a newer one has arrived (maxsize is 1),
+    - DROP_OLDEST drops the oldest queued event, for streams such as video,
+    - DROP_NEWEST drops the arriving event and keeps the queue as it is.
+
+    Memoryview data, such as video data, is copied with bytes() when it is queued, since the
+    buffers behind it are reused once the sender returns. Close() delivers what is queued and
+    ends the worker.
+    """
+
+    def __init__(self, handler, policy=DROP_OLDEST, maxsize=64, name=None, log=None):
+        if policy not in POLICIES:
+            raise ValueError('unknown policy %s' % str(policy))
+        if policy == LATEST:
+            maxsize = 1
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.handler = handler
+        self.policy = policy
+        self.maxsize = maxsize
+        self.log = log
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.queued = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+        if name is None:
+            name = 'tellopy %s' % getattr(handler, '__name__', 'receiver')
+        self.thread = threading.Thread(target=self.__run, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __call__(self, event, sender, data=None, **args):
+        self.cond.acquire()
+        try:
+            if self.closed:
+                return
+            queue = self.queue
+            if len(queue) == self.maxsize:
+                self.dropped += 1
+                if self.policy == DROP_NEWEST:
+                    return
+                queue.popleft()
+            if isinstance(data, memoryview):
+                data = data.tobytes()
+            queue.append((event, sender, data, args))
+            self.queued += 1
+            if self.max_depth < len(queue):
+                self.max_depth = len(queue)
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    @property
+    def depth(self):
+        """Depth is the number of events waiting for the handler."""
+        return len(self.queue)
+
+    def close(self, timeout=None):
+        """Close stops taking events and waits up to timeout for the queued ones to be handled."""
+        self.cond.acquire()
+        self.closed = True
+        self.cond.notify()
+        self.cond.release()
+        if self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def get_stats(self):
+        return {
+            'policy': self.policy,
+            'maxsize': self.maxsize,
+            'depth': len(self.queue),
+            'max_depth': self.max_depth,
+            'queued': self.queued,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'errors': self.errors,
+        }
+
+    def __run(self):
+        queue = self.queue
+        while True:
+            self.cond.acquire()
+            try:
+                while not queue and not self.closed:
+                    self.cond.wait()
+                if not queue:
+                    return
+                event, sender, data, args = queue.popleft()
+            finally:
+                self.cond.release()
+            try:
+                self.handler(event=event, sender=sender, data=data, **args)
+            except Exception as ex:
+                self.errors += 1
+                if self.log:
+                    self.log.error('%s: %s', self.thread.name, ex)
+                show_exception(ex)
+            self.delivered += 1
+
+
+if __name__ == '__main__':
+    import time
+
+    # delivery order and the ends of the queue kept by each policy while the handler is busy
+    for policy, expected in ((DROP_OLDEST, [0, 7, 8, 9]), (DROP_NEWEST, [0, 1, 2, 3]),
+                             (LATEST, [0, 9])):
+        gate = threading.Event()
+        started = threading.Event()
+        handled = []
+
+        def blocking(event, sender, data, **args):
+            started.set()
+            gate.wait()
+            handled.append(data)
+        receiver = QueuedReceiver(blocking, policy, 3)
+        receiver('event', None, 0)
+        started.wait(1.0)
+        for i in range(1, 10):
+            receiver('event', None, i)
+        stats = receiver.get_stats()
+        assert stats['depth'] == stats['max_depth'] == receiver.maxsize, stats
+        assert stats['dropped'] == 9 - receiver.maxsize, stats
+        gate.set()
+        receiver.close(1.0)
+        assert not receiver.thread.is_alive()
+        assert handled == expected, (policy, handled)
+        assert receiver.delivered == len(expected) and receiver.depth == 0
+
+    # queued views are copied, so the buffer may be reused as soon as the call returns
+    handled = []
+    receiver = QueuedReceiver(lambda event, sender, data, **args: handled.append(data))
+    buf = bytearray(4)
+    for i in range(3):
+        buf[0] = i
+        receiver('event', None, memoryview(buf))
+    receiver.close(1.0)
+    assert handled == [bytes(bytearray([i, 0, 0, 0])) for i in range(3)], handled
+
+    # handler errors are counted and do not stop the worker
+    def failing(event, sender, data, **args):
+        raise RuntimeError('failing')
+    receiver = QueuedReceiver(failing)
+    for i in range(3):
+        receiver('event', None, i)
+    receiver.close(1.0)
+    assert receiver.errors == 3 and receiver.delivered == 3
+
+    gate = threading.Event()
+    receiver = QueuedReceiver(lambda event, sender, data, **args: gate.wait(), DROP_OLDEST, 64)
+    view = memoryview(bytearray(1460))
+    number = 100000
+    begin = time.time()
+    for i in range(number):
+        receiver('event', None, view)
+    print('%.2f usec/event queued for a blocked handler' % ((time.time() - begin) / number * 1e6))
+    gate.set()
+    receiver.close(1.0)
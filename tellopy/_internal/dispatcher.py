@@ -1,3 +1,5 @@
+import threading
+
 from . import event
 
 
@@ -5,34 +7,83 @@ class signal(object):
     All = event.Event('*')
 
 
-signals = {}
+class Dispatcher(object):
+    """
+    Dispatcher delivers signals to the receivers connected to them. Every Tello owns one, so
+    several drones in one process never see each other's events. The module level functions
+    below act on a default instance for code that used the module directly.
+
+    For each signal the receivers, followed by those connected to signal.All, are kept in a
+    precomputed tuple that is rebuilt only by connect() and disconnect(). Send() therefore
+    builds nothing, and it is safe against receivers being connected from another thread
+    while it runs since the routes are replaced, never changed in place.
+    """
+
+    def __init__(self):
+        self.signals = {}
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.all_receivers = ()
+
+    def connect(self, receiver, sig=signal.All):
+        self.lock.acquire()
+        try:
+            if sig in self.signals:
+                receivers = self.signals[sig]
+            else:
+                receivers = self.signals[sig] = []
+            receivers.append(receiver)
+            self.__rebuild()
+        finally:
+            self.lock.release()
+
+    def disconnect(self, receiver, sig=signal.All):
+        self.lock.acquire()
+        try:
+            signals = self.signals
+            if sig is signal.All:
+                for sig in signals:
+                    if receiver in signals[sig]:
+                        signals[sig].remove(receiver)
+            elif sig in signals:
+                if receiver in signals[sig]:
+                    signals[sig].remove(receiver)
+            self.__rebuild()
+        finally:
+            self.lock.release()
+
+    def __rebuild(self):
+        all_receivers = tuple(self.signals.get(signal.All, ()))
+        routes = {}
+        for sig, receivers in self.signals.items():
+            if sig is not signal.All:
+                routes[sig] = tuple(receivers) + all_receivers
+        self.all_receivers = all_receivers
+        self.routes = routes
+
+    def receivers(self, sig):
+        """Receivers returns the tuple of receivers send(sig) would call, possibly empty."""
+        return self.routes.get(sig, self.all_receivers)
+
+    def send(self, sig, **named):
+        for receiver in self.routes.get(sig, self.all_receivers):
+            receiver(event=sig, **named)
+
+
+default_dispatcher = Dispatcher()
+signals = default_dispatcher.signals
 
 
 def connect(receiver, sig=signal.All):
-    if sig in signals:
-        receivers = signals[sig]
-    else:
-        receivers = signals[sig] = []
-    receivers.append(receiver)
+    default_dispatcher.connect(receiver, sig)
 
 
 def disconnect(receiver, sig=signal.All):
-    if sig is signal.All:
-        for sig in signals:
-            if receiver in signals[sig]:
-                signals[sig].remove(receiver)
-    elif sig in signals:
-        if receiver in signals[sig]:
-            signals[sig].remove(receiver)
+    default_dispatcher.disconnect(receiver, sig)
 
 
 def send(sig, **named):
-    if sig in signals:
-        receivers = signals[sig] + signals[signal.All]
-    else:
-        receivers = signals[signal.All]
-    for receiver in receivers:
-        receiver(event=sig, **named)
+    default_dispatcher.send(sig, **named)
 
 
 if __name__ == '__main__':
@@ -64,3 +115,18 @@ if __name__ == '__main__':
     recvs = []
     send(test_signal0, sender=None, arg0=0, arg1=1, arg2=2)
     assert len(recvs) == 1 and 0 in recvs
+
+    # instances do not share receivers
+    dispatcher0 = Dispatcher()
+    dispatcher1 = Dispatcher()
+    dispatcher0.connect(handler1, test_signal0)
+    recvs = []
+    dispatcher1.send(test_signal0, sender=None)
+    assert len(recvs) == 0
+    dispatcher0.send(test_signal0, sender=None)
+    assert recvs == [1]
+    assert dispatcher0.receivers(test_signal0) == (handler1,)
+    assert dispatcher0.receivers(test_signal1) == ()
+    dispatcher0.connect(handler0)
+    assert dispatcher0.receivers(test_signal0) == (handler1, handler0)
+    assert dispatcher0.receivers(test_signal1) == (handler0,)
@@ -0,0 +1,110 @@
+import time
+
+from . import io_loop
+from . import logger
+from . tello import Tello
+from . utils import monotonic
+
+log = logger.Logger('Fleet')
+
+
+class Fleet(object):
+    """
+    Fleet runs any number of drones in one process on a single shared IOLoop. Receiving,
+    stick commands, retransmissions and timeouts of the whole fleet are handled by that one
+    thread, so the thread count does not grow with the fleet. Each drone keeps its own
+    dispatcher, sockets and state, so drones never see each other's events.
+    """
+
+    def __init__(self):
+        self.io_loop = io_loop.IOLoop(name='tellopy fleet', log=log)
+        self.drones = []
+
+    def add(self, tello_addr=('192.168.10.1', 8889), local_ip='', port=0, video_port=0, **kwargs):
+        """
+        Add creates a Tello on the fleet's loop and returns it. Local ports are chosen by the
+        system unless given; local_ip selects the interface the drone is reachable through.
+        """
+        drone = Tello(port=port, tello_addr=tello_addr, video_port=video_port, local_ip=local_ip,
+                      io_loop=self.io_loop, **kwargs)
+        self.drones.append(drone)
+        return drone
+
+    def connect(self):
+        """Connect sends the connection request to every drone."""
+        for drone in self.drones:
+            drone.connect()
+
+    def wait_for_connection(self, timeout=None):
+        """Wait_for_connection blocks until every drone is connected or timeout passes."""
+        deadline = None if timeout is None else monotonic() + timeout
+        for drone in self.drones:
+            remaining = None if deadline is None else max(0.0, deadline - monotonic())
+            drone.wait_for_connection(remaining)
+
+    def quit(self):
+        """Quit quits every drone and stops the loop."""
+        for drone in self.drones:
+            drone.quit()
+        # the loop closes the sockets released by quit() before it stops
+        self.io_loop.stop()
+
+    def __len__(self):
+        return len(self.drones)
+
+    def __iter__(self):
+        return iter(self.drones)
+
+    def __getitem__(self, index):
+        return self.drones[index]
+
+
+if __name__ == '__main__':
+    import socket
+    import threading
+
+    fakes = []
+    for i in range(4):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(0.1)
+        fakes.append(sock)
+    running = True
+
+    def serve():
+        # answer connection requests and keep every drone's link alive with a wifi message
+        peers = {}
+        while running:
+            for sock in fakes:
+                try:
+                    data, addr = sock.recvfrom(2000)
+                except socket.timeout:
+                    continue
+                if data.startswith(b'conn_req:'):
+                    peers[sock] = addr
+                    sock.sendto(b'conn_ack:' + data[9:11], addr)
+            for sock, addr in peers.items():
+                sock.sendto(b'\xcc\x58\x00\x7c\x48\x1a\x00\x00\x00\x50\x00\x00\x00', addr)
+
+    server = threading.Thread(target=serve)
+    server.start()
+    threads = set(threading.enumerate())
+    fleet = Fleet()
+    connected = []
+    for sock in fakes:
+        drone = fleet.add(tello_addr=sock.getsockname())
+        drone.subscribe(drone.EVENT_CONNECTED,
+                        lambda event, sender, data, **args: connected.append(sender))
+    # the fleet's loop and the log writer are the only threads added
+    added = [thread.name for thread in threading.enumerate() if thread not in threads]
+    assert sorted(added) in (['tellopy fleet'], ['tellopy fleet', 'tellopy log']), added
+    fleet.connect()
+    fleet.wait_for_connection(5.0)
+    assert sorted(map(id, connected)) == sorted(map(id, fleet)), connected
+    time.sleep(0.3)
+    for drone in fleet:
+        assert 3 <= drone.get_stick_stats()['ticks'] and drone.state == drone.STATE_CONNECTED
+    fleet.quit()
+    assert not fleet.io_loop.thread.is_alive()
+    running = False
+    server.join()
@@ -0,0 +1,339 @@
+import collections
+import heapq
+import select
+import socket
+import threading
+import time
+
+try:
+    import selectors
+except ImportError:
+    # python 2 has the selectors2 backport, and select() below without it
+    try:
+        import selectors2 as selectors
+    except ImportError:
+        selectors = None
+
+from . utils import *
+
+EVENT_READ = 1
+
+SelectorKey = collections.namedtuple('SelectorKey', ['fileobj', 'fd', 'events', 'data'])
+
+
+class SelectSelector(object):
+    """SelectSelector is the part of selectors.SelectSelector that IOLoop uses, on select()."""
+
+    def __init__(self):
+        self.keys = {}
+
+    def register(self, fileobj, events, data=None):
+        key = SelectorKey(fileobj, fileobj.fileno(), events, data)
+        if key.fd in self.keys:
+            raise KeyError('%r is already registered' % fileobj)
+        self.keys[key.fd] = key
+        return key
+
+    def unregister(self, fileobj):
+        return self.keys.pop(fileobj.fileno())
+
+    def select(self, timeout=None):
+        readable, writable, failed = select.select(list(self.keys), [], [], timeout)
+        return [(self.keys[fd], EVENT_READ) for fd in readable if fd in self.keys]
+
+    def close(self):
+        self.keys.clear()
+
+
+if selectors is not None:
+    EVENT_READ = selectors.EVENT_READ
+    DefaultSelector = selectors.DefaultSelector
+else:
+    DefaultSelector = SelectSelector
+
+
+class TimerHandle(object):
+    __slots__ = ('when', 'func', 'args', 'cancelled')
+
+    def __init__(self, when, func, args):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class IOLoop(object):
+    """
+    IOLoop waits for readable sockets and due timers with selectors on one thread, so any
+    number of drones can share it without threads of their own. Its timer methods (time(),
+    call_at() and call_later()) match asyncio's, so the command channel, clock service and
+    stick scheduler run on either.
+
+    Timers are kept in a hashed timer wheel of slots tick seconds wide: scheduling and
+    cancelling are O(1) however many drones add stick ticks and retransmissions, and a slot
+    only holds the timers of the next few seconds plus the rare ones a whole turn ahead.
+    A heap of the occupied slots, which many timers share, gives the nearest one without
+    walking the wheel, and timers still fire at their exact time, since the loop sleeps until
+    the earliest one in that slot. When no timer is due and no socket is readable the thread
+    sleeps, so an idle loop does not wake up.
+
+    Add_reader() and remove_reader() may be called from any thread; they take effect on the
+    loop thread. Callbacks run one at a time and should return quickly. Stop() ends the loop
+    after the callbacks already due and, called from another thread, waits for it to finish.
+    """
+
+    def __init__(self, name='tellopy io', log=None, tick=0.002, slots=1024):
+        self.log = log
+        self.selector = DefaultSelector()
+        self.lock = threading.Lock()
+        self.tick = tick
+        self.slots = [[] for i in range(slots)]
+        self.timers = 0
+        # heap of the slots holding timers, and the same slots as a set; stale ones are
+        # dropped when they reach the top
+        self.occupied = []
+        self.occupied_set = set()
+        # the slot of the last time timers were collected; earlier slots are empty
+        self.current = int(self.time() / tick)
+        self.wake_at = None
+        self.wakeups = 0
+        self.running = True
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.selector.register(self.wakeup_recv, EVENT_READ, None)
+        self.thread = threading.Thread(target=self.__run, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def time(self):
+        return monotonic()
+
+    def call_at(self, when, func, *args):
+        handle = TimerHandle(when, func, args)
+        slot = int(when / self.tick)
+        self.lock.acquire()
+        try:
+            if slot < self.current:
+                slot = self.current
+            self.slots[slot % len(self.slots)].append((slot, handle))
+            self.timers += 1
+            if slot not in self.occupied_set:
+                self.occupied_set.add(slot)
+                heapq.heappush(self.occupied, slot)
+            earlier = self.wake_at is None or when < self.wake_at
+        finally:
+            self.lock.release()
+        if earlier and threading.current_thread() is not self.thread:
+            self.__wakeup()
+        return handle
+
+    def call_later(self, delay, func, *args):
+        return self.call_at(self.time() + delay, func, *args)
+
+    def call_soon(self, func, *args):
+        """Call_soon runs func(*args) on the loop thread after the callbacks already due."""
+        return self.call_at(self.time(), func, *args)
+
+    def add_reader(self, sock, callback):
+        """Add_reader calls callback(sock) on the loop thread whenever sock is readable."""
+        self.call_later(0, self.selector.register, sock, EVENT_READ, callback)
+
+    def remove_reader(self, sock, close=False):
+        """Remove_reader stops watching sock and, if close is set, closes it afterwards."""
+        self.call_later(0, self.__remove_reader, sock, close)
+
+    def __remove_reader(self, sock, close):
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        if close:
+            sock.close()
+
+    def stop(self, timeout=1.0):
+        """
+        Stop ends the loop once the callbacks already due have run, so readers removed just
+        before are closed, and then closes the selector. Called from another thread it waits
+        up to timeout for the loop thread to finish.
+        """
+        self.call_soon(self.__halt)
+        if threading.current_thread() is not self.thread:
+            self.thread.join(timeout)
+
+    def __halt(self):
+        self.running = False
+
+    def get_stats(self):
+        return {'timers': self.timers, 'wakeups': self.wakeups}
+
+    def __wakeup(self):
+        try:
+            self.wakeup_send.send(b'\0')
+        except socket.error:
+            # the pipe is full, so the loop is going to wake up anyway
+            pass
+
+    def __collect(self, now):
+        # called with the lock held; returns the handles due at now in time order
+        due = []
+        slots = self.slots
+        count = len(slots)
+        last = int(now / self.tick)
+        first = max(self.current, last - count + 1)
+        if self.timers:
+            for k in range(first, last + 1):
+                bucket = slots[k % count]
+                if not bucket:
+                    continue
+                keep = []
+                for entry in bucket:
+                    slot, handle = entry
+                    if handle.cancelled:
+                        self.timers -= 1
+                    elif slot <= last and handle.when <= now:
+                        due.append(handle)
+                        self.timers -= 1
+                    else:
+                        keep.append(entry)
+                slots[k % count] = keep
+        self.current = last
+        due.sort(key=lambda handle: handle.when)
+        return due
+
+    def __timeout(self, now):
+        # called with the lock held; returns how long to sleep until the next timer
+        slots = self.slots
+        count = len(slots)
+        occupied = self.occupied
+        while occupied:
+            k = occupied[0]
+            earliest = None
+            for slot, handle in slots[k % count]:
+                if slot == k and not handle.cancelled:
+                    if earliest is None or handle.when < earliest:
+                        earliest = handle.when
+            if earliest is not None:
+                return max(0.0, earliest - now)
+            # every timer of the slot has fired or was cancelled
+            heapq.heappop(occupied)
+            self.occupied_set.discard(k)
+        return None
+
+    def __run(self):
+        while self.running:
+            self.lock.acquire()
+            now = self.time()
+            timeout = self.__timeout(now)
+            self.wake_at = None if timeout is None else now + timeout
+            self.lock.release()
+            events = self.selector.select(timeout)
+            self.wakeups += 1
+            for key, mask in events:
+                if key.data is None:
+                    try:
+                        while self.wakeup_recv.recv(512):
+                            pass
+                    except socket.error:
+                        pass
+                    continue
+                self.__call(key.data, (key.fileobj,))
+            self.lock.acquire()
+            due = self.__collect(self.time())
+            self.lock.release()
+            for handle in due:
+                if not handle.cancelled:
+                    self.__call(handle.func, handle.args)
+        self.selector.close()
+        self.wakeup_recv.close()
+        self.wakeup_send.close()
+
+    def __call(self, func, args):
+        try:
+            func(*args)
+        except Exception as ex:
+            if self.log:
+                self.log.error('io loop: %s', ex)
+            show_exception(ex)
+
+
+if __name__ == '__main__':
+    loop = IOLoop()
+    done = threading.Event()
+    received = []
+
+    def on_readable(sock):
+        data = sock.recv(2000)
+        received.append(data)
+        if data == b'last':
+            done.set()
+
+    socks = []
+    for i in range(3):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.setblocking(False)
+        loop.add_reader(sock, on_readable)
+        socks.append(sock)
+    fired = []
+    loop.call_later(0.02, fired.append, 2)
+    loop.call_later(0.01, fired.append, 1)
+    loop.call_later(0.015, fired.append, 0).cancel()
+    time.sleep(0.05)
+    loop.remove_reader(socks[0])
+    time.sleep(0.05)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for i, sock in enumerate(socks):
+        sender.sendto(b'data %d' % i, sock.getsockname())
+    sender.sendto(b'last', socks[2].getsockname())
+    assert done.wait(1.0)
+    assert fired == [1, 2], fired
+    assert sorted(received) == [b'data 1', b'data 2', b'last'], received
+    assert threading.active_count() == 2
+
+    # timers beyond one turn of the wheel, and timers that keep the wheel turning
+    loop.call_later(loop.tick * len(loop.slots) * 1.5, fired.append, 4)
+    deadline = loop.time() + 0.2
+    ticks = []
+
+    def tick():
+        ticks.append(loop.time())
+        if len(ticks) < 10:
+            loop.call_at(deadline + len(ticks) * 0.02, tick)
+    loop.call_at(deadline, tick)
+    time.sleep(0.5)
+    # timers fire in order and never early; how late depends on the scheduler, so the bound
+    # is generous and the lateness is reported
+    late = [ticks[i] - deadline - i * 0.02 for i in range(len(ticks))]
+    assert len(ticks) == 10 and ticks == sorted(ticks) and 0 <= min(late), late
+    assert max(late) < 0.05, late
+    print('timer lateness: max %.1f ms' % (max(late) * 1000))
+    wakeups = loop.wakeups
+    time.sleep(loop.tick * len(loop.slots) * 1.5)
+    assert fired == [1, 2, 4], fired
+    # one wakeup per turn of the wheel at most while the far timer is pending
+    assert loop.wakeups - wakeups <= 3, loop.wakeups - wakeups
+    # with every timer fired, the slot heap is empty and the loop sleeps
+    assert not loop.occupied and loop.timers == 0, loop.occupied
+    # stop() runs the callbacks already due, closing sock, before the loop ends
+    loop.remove_reader(socks[1], close=True)
+    loop.stop()
+    assert not loop.thread.is_alive()
+    try:
+        socks[1].getsockname()
+        assert False, 'socket left open'
+    except socket.error:
+        pass
+    loop.stop()
+
+    # the select() fallback for python 2 without selectors2
+    selector = SelectSelector()
+    selector.register(socks[2], EVENT_READ, on_readable)
+    sender.sendto(b'fallback', socks[2].getsockname())
+    events = selector.select(1.0)
+    assert len(events) == 1 and events[0][0].data is on_readable
+    selector.unregister(socks[2])
+    assert selector.select(0) == []
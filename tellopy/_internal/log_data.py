@@ -0,0 +1,277 @@
+"""
+Decoder for the flight log stream (LOG_DATA_MSG)
+
+The drone streams its internal flight log once the log header (LOG_HEADER_MSG) has been
+acknowledged. Each LOG_DATA_MSG carries one or more records:
+
+    offset  size
+         0     1  0x55
+         1     2  record length including this header (little endian)
+         3     1  crc8 of bytes 0 to 2, as in the packet header
+         4     2  record id (little endian)
+         6     1  xor key, applied to every byte from offset 10
+         7     3  unknown
+        10     -  record body
+
+Record layouts are the ones used by other open source Tello clients; unknown ids are counted
+and skipped. A header with a bad checksum or an impossible length is counted as invalid and
+the decoder resyncs on the next 0x55. Decoded records are stored in array backed ring buffers rather than as one
+python object per record, and handed to subscribers as LogBatch views over those rings.
+"""
+import array
+import struct
+
+from . crc import crc8
+
+RECORD_MAGIC = 0x55
+RECORD_HEADER = struct.Struct('<BHBHB')
+RECORD_HEADER_SIZE = 10
+# records are far shorter; a longer length is a corrupt header, not a record to wait for
+MAX_RECORD_SIZE = 2048
+ID_NEW_MVO_FEEDBACK = 0x001d
+ID_IMU_ATTI = 0x0800
+
+_xor_tables = {}
+
+
+def _xor_table(key):
+    table = _xor_tables.get(key)
+    if table is None:
+        table = _xor_tables[key] = bytes(bytearray([i ^ key for i in range(256)]))
+    return table
+
+
+class RecordRing(object):
+    """
+    RecordRing keeps the latest capacity records of one type in a flat array of doubles, one
+    row of len(fields) columns per record. seq counts every record ever appended, so a reader
+    can ask for the records after the last seq it has seen.
+    """
+
+    def __init__(self, fields, capacity=4096):
+        self.fields = tuple(fields)
+        self.width = len(self.fields)
+        self.capacity = capacity
+        self.data = array.array('d', [0.0]) * (self.width * capacity)
+        self.seq = 0
+        self._row = struct.Struct('=%dd' % self.width)
+
+    def append(self, values):
+        offset = (self.seq % self.capacity) * self._row.size
+        self._row.pack_into(self.data, offset, *values)
+        self.seq += 1
+
+    def first_seq(self):
+        """First_seq returns the seq of the oldest record still held."""
+        return max(0, self.seq - self.capacity)
+
+    def read(self, start, stop=None):
+        """
+        Read returns the records with seq in [start, stop) as a flat array of doubles,
+        clipped to the records still held.
+        """
+        if stop is None or self.seq < stop:
+            stop = self.seq
+        start = max(start, self.first_seq())
+        if stop <= start:
+            return array.array('d')
+        width = self.width
+        first = (start % self.capacity) * width
+        last = (stop % self.capacity) * width
+        if first < last:
+            return self.data[first:last]
+        return self.data[first:] + self.data[:last]
+
+    def column(self, name, start, stop=None):
+        index = self.fields.index(name)
+        return self.read(start, stop)[index::self.width]
+
+
+class LogBatch(object):
+    """
+    LogBatch refers to records [start, stop) of a RecordRing. Records are copied out of the
+    ring only when they are read, so a batch should be consumed before the ring wraps.
+    """
+
+    def __init__(self, ring, start, stop):
+        self.ring = ring
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    @property
+    def fields(self):
+        return self.ring.fields
+
+    def array(self):
+        return self.ring.read(self.start, self.stop)
+
+    def column(self, name):
+        return self.ring.column(name, self.start, self.stop)
+
+    def rows(self):
+        data = self.array()
+        width = self.ring.width
+        return [tuple(data[i:i + width]) for i in range(0, len(data), width)]
+
+    def __str__(self):
+        return '%s(%d records of %s)' % (self.__class__.__name__, len(self), ', '.join(self.fields))
+
+
+class LogDecoder(object):
+    """
+    LogDecoder splits the log stream into records and appends the known ones to its rings.
+    Feed() accepts any chunking of the stream; a record split across chunks is kept until
+    the rest of it arrives.
+    """
+    IMU_FIELDS = ('time', 'acc_x', 'acc_y', 'acc_z', 'gyro_x', 'gyro_y', 'gyro_z',
+                  'q0', 'q1', 'q2', 'q3', 'vg_x', 'vg_y', 'vg_z')
+    MVO_FIELDS = ('time', 'vel_x', 'vel_y', 'vel_z', 'pos_x', 'pos_y', 'pos_z')
+    # the body starts with longitude, latitude (doubles) and altitude (float); acceleration and
+    # gyro follow at offset 30 of the record, the attitude quaternion at 58 and velocity at 86
+    IMU_FORMAT = struct.Struct('<6f4x4f12x3f')
+    IMU_OFFSET = 30
+    # observation count, velocity in cm/s and position in m from offset 10 of the record
+    MVO_FORMAT = struct.Struct('<H3h3f')
+    MVO_OFFSET = 10
+
+    def __init__(self, capacity=4096):
+        self.imu = RecordRing(self.IMU_FIELDS, capacity)
+        self.mvo = RecordRing(self.MVO_FIELDS, capacity)
+        self.pending = b''
+        self.records = 0
+        self.unknown_records = 0
+        self.invalid_records = 0
+        self.skipped_bytes = 0
+
+    def feed(self, data, now=0.0):
+        """
+        Feed decodes the records contained in data, stamping them with now, and returns the
+        number of records appended to the rings.
+        """
+        # a bytearray indexes to ints on python 2 as well
+        if self.pending:
+            data = self.pending + bytearray(data)
+            self.pending = b''
+        else:
+            data = bytearray(data)
+        decoded = 0
+        pos = 0
+        end = len(data)
+        while pos < end:
+            if data[pos] != RECORD_MAGIC:
+                found = data.find(b'\x55', pos)
+                if found < 0:
+                    found = end
+                self.skipped_bytes += found - pos
+                pos = found
+                continue
+            if end - pos < RECORD_HEADER_SIZE:
+                self.pending = data[pos:]
+                break
+            magic, length, checksum, rec_id, key = RECORD_HEADER.unpack_from(data, pos)
+            if (length < RECORD_HEADER_SIZE or MAX_RECORD_SIZE < length or
+                    crc8(data[pos:pos + 3]) != checksum):
+                self.invalid_records += 1
+                self.skipped_bytes += 1
+                pos += 1
+                continue
+            if end - pos < length:
+                self.pending = data[pos:]
+                break
+            self.records += 1
+            if rec_id == ID_IMU_ATTI and self.IMU_OFFSET + self.IMU_FORMAT.size <= length:
+                body = data[pos:pos + length].translate(_xor_table(key))
+                self.imu.append((now,) + self.IMU_FORMAT.unpack_from(body, self.IMU_OFFSET))
+                decoded += 1
+            elif rec_id == ID_NEW_MVO_FEEDBACK and self.MVO_OFFSET + self.MVO_FORMAT.size <= length:
+                body = data[pos:pos + length].translate(_xor_table(key))
+                (count, vel_x, vel_y, vel_z,
+                 pos_x, pos_y, pos_z) = self.MVO_FORMAT.unpack_from(body, self.MVO_OFFSET)
+                self.mvo.append((now, vel_x / 100.0, vel_y / 100.0, vel_z / 100.0,
+                                 pos_x, pos_y, pos_z))
+                decoded += 1
+            else:
+                self.unknown_records += 1
+            pos += length
+        return decoded
+
+
+def encode_record(rec_id, body, key=0):
+    """Encode_record builds a log record around body, mainly for tests and simulation."""
+    length = RECORD_HEADER_SIZE + len(body)
+    checksum = crc8(bytearray(struct.pack('<BH', RECORD_MAGIC, length)))
+    header = bytearray(RECORD_HEADER.pack(RECORD_MAGIC, length, checksum, rec_id, key)) + bytearray(3)
+    body = bytearray(body)
+    for i in range(len(body)):
+        body[i] ^= key
+    return bytes(header + body)
+
+
+if __name__ == '__main__':
+    import binascii
+    import time
+
+    def imu_record(i, key):
+        body = bytearray(LogDecoder.IMU_OFFSET - RECORD_HEADER_SIZE)
+        body += LogDecoder.IMU_FORMAT.pack(*[float(i + k) for k in range(13)])
+        return encode_record(ID_IMU_ATTI, body, key)
+
+    def mvo_record(i, key):
+        body = LogDecoder.MVO_FORMAT.pack(1, 100 * i, 200, -300, 1.5, 2.5, float(i))
+        return encode_record(ID_NEW_MVO_FEEDBACK, body, key)
+
+    stream = b''
+    for i in range(100):
+        stream += imu_record(i, i & 0xff) + mvo_record(i, 0x5a) + encode_record(0x1234, b'abc')
+
+    # an IMU_ATTI record written out byte by byte: longitude 8.5, latitude 47.25, altitude
+    # 430.5, acceleration, gyro, 4 unknown bytes, quaternion, 12 unknown bytes and velocity,
+    # xored with the key 0x5a
+    record = binascii.unhexlify(
+        '5562001000085a0000005a5a5a5a5a5a7b1a5a5a5a5a5afa1d1a5a1a8d195a5a'
+        '5a645a5adae45a5adae55a5a5a655a5a1a655a5a5ae5f0f0f0f05a5a5a655a5a'
+        '5ae55a5ada645a5adae4e1e1e1e1e1e1e1e1e1e1e1e15a5a9a655a5a7a9a5a5a'
+        'da64')
+    decoder = LogDecoder()
+    assert decoder.feed(record, 1.0) == 1 and decoder.invalid_records == 0
+    assert LogBatch(decoder.imu, 0, 1).rows() == [(
+        1.0, 0.125, -0.25, -1.0, 0.5, 0.75, -0.5, 0.5, -0.5, 0.25, -0.25, 1.5, -2.5, 0.25)]
+
+    decoder = LogDecoder(capacity=64)
+    # feed in awkward chunks to exercise records split across packets
+    for i in range(0, len(stream), 37):
+        decoder.feed(stream[i:i + 37], now=1.0)
+    assert decoder.records == 300 and decoder.unknown_records == 100
+    assert decoder.skipped_bytes == 0 and decoder.pending == b''
+    assert decoder.imu.seq == 100 and decoder.mvo.seq == 100
+
+    batch = LogBatch(decoder.imu, 90, 100)
+    rows = batch.rows()
+    assert len(rows) == 10 and rows[0] == (1.0,) + tuple(float(90 + k) for k in range(13))
+    assert list(LogBatch(decoder.mvo, 98, 100).column('vel_x')) == [98.0, 99.0]
+    assert list(decoder.mvo.column('pos_z', 0)) == [float(i) for i in range(36, 100)]
+
+    decoder.feed(b'\x00\x01' + mvo_record(7, 1))
+    assert decoder.skipped_bytes == 2 and decoder.mvo.seq == 101
+
+    # a corrupt header is dropped at once instead of holding the stream for a long record
+    corrupt = bytearray(mvo_record(8, 1))
+    corrupt[2] = 0xff
+    decoder.feed(bytes(corrupt) + mvo_record(9, 1))
+    assert decoder.invalid_records == 1 and decoder.pending == b'' and decoder.mvo.seq == 102
+    corrupt = bytearray(mvo_record(10, 1))
+    corrupt[3] ^= 0x01
+    decoder.feed(bytes(corrupt) + mvo_record(11, 1))
+    assert decoder.invalid_records == 2 and decoder.mvo.seq == 103
+    assert list(decoder.mvo.column('pos_z', 101)) == [9.0, 11.0]
+
+    decoder = LogDecoder()
+    start = time.time()
+    for i in range(0, len(stream), 400):
+        decoder.feed(stream[i:i + 400])
+    elapsed = time.time() - start
+    print('decoded %d records in %.4f sec (%.0f records/sec)' %
+          (decoder.records, elapsed, decoder.records / elapsed))
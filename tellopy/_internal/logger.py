@@ -1,5 +1,13 @@
+import atexit
+import collections
 import datetime
+import json
+import logging
+import sys
 import threading
+import time
+
+from . utils import monotonic
 
 LOG_ERROR = 0
 LOG_WARN = 1
@@ -7,51 +15,417 @@ LOG_INFO = 2
 LOG_DEBUG = 3
 LOG_ALL = 99
 
+LABELS = {LOG_ERROR: 'Error', LOG_WARN: ' Warn', LOG_INFO: ' Info', LOG_DEBUG: 'Debug'}
+NAMES = {LOG_ERROR: 'error', LOG_WARN: 'warn', LOG_INFO: 'info', LOG_DEBUG: 'debug'}
+LOGGING_LEVELS = {LOG_ERROR: logging.ERROR, LOG_WARN: logging.WARNING, LOG_INFO: logging.INFO,
+                  LOG_DEBUG: logging.DEBUG}
+
+
+class PrintSink(object):
+    """
+    PrintSink writes records as lines of text to stream, sys.stdout at the time of writing
+    by default, in the format tellopy always used.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def format(self, record):
+        when, level, name, msg = record
+        now = datetime.datetime.fromtimestamp(when)
+        return "%s: %02d:%02d:%02d.%03d: %s: %s" % (
+            name, now.hour, now.minute, now.second, now.microsecond // 1000,
+            LABELS.get(level, 'Debug'), msg)
+
+    def write(self, record):
+        stream = self.stream or sys.stdout
+        stream.write(self.format(record) + '\n')
+
+    def flush(self):
+        (self.stream or sys.stdout).flush()
+
+    def close(self):
+        self.flush()
+
+
+class JsonLinesSink(object):
+    """
+    JsonLinesSink appends records to the file at path as JSON objects, one per line, with
+    the fields time (seconds since the epoch), level, logger and message.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a')
+
+    def write(self, record):
+        when, level, name, msg = record
+        self.file.write(json.dumps({'time': when, 'level': NAMES.get(level, 'debug'),
+                                    'logger': name, 'message': msg}) + '\n')
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class LoggingSink(object):
+    """
+    LoggingSink hands records to the logging module, to loggers named prefix.name (e.g.
+    tellopy.Tello). The records keep the time the message was logged at.
+    """
+
+    def __init__(self, prefix='tellopy'):
+        self.prefix = prefix
+
+    def write(self, record):
+        when, level, name, msg = record
+        name = '%s.%s' % (self.prefix, name) if name else self.prefix
+        target = logging.getLogger(name)
+        level = LOGGING_LEVELS.get(level, logging.DEBUG)
+        if not target.isEnabledFor(level):
+            return
+        rec = target.makeRecord(name, level, '(tellopy)', 0, msg, None, None)
+        rec.created = when
+        rec.msecs = (when - int(when)) * 1000
+        target.handle(rec)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class AsyncSink(object):
+    """
+    AsyncSink hands records to sink on a writer thread of its own, so logging from the
+    receive loop never waits for a slow terminal, pipe or disk. Up to maxsize records wait in
+    a queue; when it is full further records are dropped and counted, and the writer logs
+    how many were lost once it catches up. The thread is started by the first record.
+    """
+
+    def __init__(self, sink, maxsize=4096):
+        self.sink = sink
+        self.maxsize = maxsize
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.busy = False
+        self.closed = False
+        self.written = 0
+        self.dropped = 0
+        self.reported = 0
+        self.errors = 0
+        self.max_depth = 0
+
+    def write(self, record):
+        queue = self.queue
+        depth = len(queue)
+        if self.maxsize <= depth or self.closed:
+            self.dropped += 1
+            return
+        queue.append(record)
+        if self.max_depth <= depth:
+            self.max_depth = depth + 1
+        self.cond.acquire()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.__run, name='tellopy log')
+            self.thread.daemon = True
+            self.thread.start()
+        self.cond.notify()
+        self.cond.release()
+
+    def flush(self, timeout=1.0):
+        """Flush waits up to timeout for the queued records to be written."""
+        deadline = time.time() + timeout
+        self.cond.acquire()
+        try:
+            while (self.queue or self.busy) and self.thread is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+            return True
+        finally:
+            self.cond.release()
+
+    def close(self, timeout=1.0):
+        self.flush(timeout)
+        self.cond.acquire()
+        self.closed = True
+        self.cond.notify_all()
+        self.cond.release()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.sink.close()
+
+    def get_stats(self):
+        return {
+            'depth': len(self.queue),
+            'max_depth': self.max_depth,
+            'written': self.written,
+            'dropped': self.dropped,
+            'errors': self.errors,
+        }
+
+    def __run(self):
+        queue = self.queue
+        sink = self.sink
+        while True:
+            self.cond.acquire()
+            self.busy = False
+            self.cond.notify_all()
+            while not queue and not self.closed:
+                self.cond.wait()
+            if not queue:
+                self.cond.release()
+                return
+            self.busy = True
+            self.cond.release()
+            try:
+                while queue:
+                    sink.write(queue.popleft())
+                    self.written += 1
+                # records are dropped only while the queue is full, so by now every drop
+                # happened after the records just written
+                dropped = self.dropped
+                if dropped != self.reported:
+                    sink.write((time.time(), LOG_WARN, 'Logger',
+                                '%d log messages dropped' % (dropped - self.reported)))
+                    self.reported = dropped
+                sink.flush()
+            except Exception:
+                # there is nowhere left to report the failure of the sink itself
+                self.errors += 1
+
+
+# where every Logger writes its messages
+sink = AsyncSink(PrintSink())
+
+
+def set_sink(new_sink):
+    """
+    Set_sink makes every Logger write to new_sink and returns the previous sink. A previous
+    AsyncSink is closed, which stops its writer thread, and any other sink is flushed.
+    Wrap a sink in AsyncSink to keep it from blocking the threads that log.
+    """
+    global sink
+    old_sink = sink
+    sink = new_sink
+    if isinstance(old_sink, AsyncSink):
+        old_sink.close()
+    elif hasattr(old_sink, 'flush'):
+        old_sink.flush()
+    return old_sink
+
+
+def get_sink():
+    return sink
+
+
+def use_logging(prefix='tellopy'):
+    """
+    Use_logging sends the messages of every Logger to the logging module instead of printing
+    them, to a logger named prefix.header (e.g. tellopy.Tello). Messages must pass the level
+    of the Logger (see set_level) as well as the logging configuration. Pass None to print
+    them again. Either way messages are written by a background thread, which replaces the
+    one of the previous sink.
+    """
+    if prefix is None:
+        set_sink(AsyncSink(PrintSink()))
+    else:
+        set_sink(AsyncSink(LoggingSink(prefix)))
+
+
+@atexit.register
+def flush():
+    """Flush waits briefly for the messages logged so far to be written."""
+    if hasattr(sink, 'flush'):
+        sink.flush()
+
 
 class Logger:
+    """
+    Logger writes messages of at most the set level to the current sink, which by default
+    prints them from a background thread. Messages may be given as a format string and
+    arguments, as in log.debug('recv: %s', data), in which case the formatting is done only
+    if the message is logged; messages without arguments are used as they are.
+    Is_enabled() guards the computation of arguments that are costly in themselves.
+
+    Limited() logs a message at most once per interval, for messages that may be triggered
+    by every packet, and reports how many were suppressed in between.
+    """
+
     def __init__(self, header=''):
         self.log_level = LOG_INFO
         self.header_string = header
-        self.lock = threading.Lock()
-
-    def header(self):
-        now = datetime.datetime.now()
-        ts = ("%02d:%02d:%02d.%03d" % (now.hour, now.minute, now.second, now.microsecond/1000))
-        return "%s: %s" % (self.header_string, ts)
+        self.limits = {}
 
     def set_level(self, level):
         self.log_level = level
 
-    def output(self, msg):
-        self.lock.acquire()
-        print(msg)
-        self.lock.release()
+    def is_enabled(self, level):
+        """Is_enabled returns True if messages of level are logged."""
+        return level <= self.log_level
 
-    def error(self, str):
+    def log(self, level, msg, *args):
+        if self.log_level < level:
+            return
+        if args:
+            msg = msg % args
+        sink.write((time.time(), level, self.header_string, msg))
+
+    def error(self, msg, *args):
         if self.log_level < LOG_ERROR:
             return
-        self.output("%s: Error: %s" % (self.header(), str))
+        self.log(LOG_ERROR, msg, *args)
 
-    def warn(self, str):
+    def warn(self, msg, *args):
         if self.log_level < LOG_WARN:
             return
-        self.output("%s:  Warn: %s" % (self.header(), str))
+        self.log(LOG_WARN, msg, *args)
 
-    def info(self, str):
+    def info(self, msg, *args):
         if self.log_level < LOG_INFO:
             return
-        self.output("%s:  Info: %s" % (self.header(), str))
+        self.log(LOG_INFO, msg, *args)
 
-    def debug(self, str):
+    def debug(self, msg, *args):
         if self.log_level < LOG_DEBUG:
             return
-        self.output("%s: Debug: %s" % (self.header(), str))
+        self.log(LOG_DEBUG, msg, *args)
+
+    def limited(self, level, interval, msg, *args):
+        """
+        Limited logs msg % args unless a message with the same format string was logged less
+        than interval seconds ago. Suppressed messages are counted and the count is appended
+        to the next message logged.
+        """
+        if self.log_level < level:
+            return
+        now = monotonic()
+        last, suppressed = self.limits.get(msg, (None, 0))
+        if last is not None and now - last < interval:
+            self.limits[msg] = (last, suppressed + 1)
+            return
+        self.limits[msg] = (now, 0)
+        if args:
+            msg = msg % args
+        if suppressed:
+            msg = '%s (%d suppressed)' % (msg, suppressed)
+        self.log(level, msg)
+
 
 if __name__ == '__main__':
+    import os
+    import tempfile
+
     log = Logger('test')
     log.error('This is an error message')
     log.warn('This is a warning message')
     log.info('This is an info message')
+    log.info('This is an info message with %d %s', 2, 'arguments')
+    log.info('This message has a 100% sign and no arguments')
     log.debug('This should ** NOT **  be displayed')
     log.set_level(LOG_ALL)
     log.debug('This is a debug message')
+    assert flush() is None and sink.written == 6, sink.get_stats()
+
+    class ListSink(object):
+        def __init__(self):
+            self.records = []
+
+        def write(self, record):
+            self.records.append(record)
+
+        def flush(self):
+            pass
+
+        def close(self):
+            pass
+
+    lines = ListSink()
+    set_sink(lines)
+    for i in range(5):
+        log.limited(LOG_WARN, 60.0, 'limited message %d', i)
+    log.limits['limited message %d'] = (monotonic() - 60.0, 4)
+    log.limited(LOG_WARN, 60.0, 'limited message %d', 5)
+    assert [record[3] for record in lines.records] == [
+        'limited message 0', 'limited message 5 (4 suppressed)'], lines.records
+
+    class Costly(object):
+        def __str__(self):
+            raise AssertionError('formatted a disabled message')
+    log.set_level(LOG_INFO)
+    log.debug('costly %s', Costly())
+    log.limited(LOG_DEBUG, 1.0, 'costly %s', Costly())
+    assert not log.is_enabled(LOG_DEBUG) and log.is_enabled(LOG_WARN)
+
+    records = []
+
+    class Handler(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+    logging.getLogger('tellopy').addHandler(Handler())
+    logging.getLogger('tellopy').setLevel(logging.DEBUG)
+    use_logging()
+    log.warn('bridged %s', 'message')
+    bridge = get_sink()
+    use_logging(None)
+    assert bridge.closed and not bridge.thread.is_alive()
+    assert len(lines.records) == 2 and len(records) == 1
+    assert records[0].name == 'tellopy.test' and records[0].levelno == logging.WARNING
+    assert records[0].getMessage() == 'bridged message'
+
+    # a sink that cannot keep up drops records instead of blocking the caller, and the
+    # drops are reported as soon as the writer catches up
+    entered = threading.Event()
+    gate = threading.Event()
+
+    class SlowSink(ListSink):
+        def write(self, record):
+            entered.set()
+            gate.wait()
+            self.records.append(record)
+    slow = AsyncSink(SlowSink(), maxsize=10)
+    set_sink(slow)
+    log.info('first')
+    assert entered.wait(1.0)
+    begin = time.time()
+    for i in range(100):
+        log.info('message %d', i)
+    elapsed = time.time() - begin
+    assert elapsed < 0.1 and slow.dropped == 90, (elapsed, slow.get_stats())
+    gate.set()
+    assert slow.flush()
+    messages = [record[3] for record in slow.sink.records]
+    assert messages == ['first'] + ['message %d' % i for i in range(10)] + [
+        '90 log messages dropped'], messages
+    assert slow.written == 11
+
+    path = os.path.join(tempfile.mkdtemp(), 'tellopy.log')
+    set_sink(AsyncSink(JsonLinesSink(path)))
+    log.info('json %s', 'line')
+    log.warn('second')
+    sink.close()
+    with open(path) as f:
+        rows = [json.loads(line) for line in f]
+    assert [(row['level'], row['logger'], row['message']) for row in rows] == [
+        ('info', 'test', 'json line'), ('warn', 'test', 'second')], rows
+    os.remove(path)
+
+    set_sink(lines)
+    number = 1000000
+    data = bytearray(1460)
+    begin = time.time()
+    for i in range(number):
+        log.debug('recv: %s', data)
+    print('%.3f usec/disabled debug call' % ((time.time() - begin) / number * 1e6))
+    set_sink(AsyncSink(ListSink()))
+    number = 100000
+    begin = time.time()
+    for i in range(number):
+        log.info('recv: %d', i)
+    print('%.3f usec/message queued' % ((time.time() - begin) / number * 1e6))
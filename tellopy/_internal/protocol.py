@@ -1,5 +1,7 @@
 import datetime
+import struct
 
+from . import clock
 from . import crc
 from . utils import *
 
@@ -9,6 +11,8 @@ VIDEO_RATE_QUERY = 40
 LIGHT_MSG = 53
 FLIGHT_MSG = 0x56
 LOG_MSG = 0x1050
+LOG_HEADER_MSG = LOG_MSG
+LOG_DATA_MSG = 0x1051
 
 VIDEO_ENCODER_RATE_CMD = 0x20
 VIDEO_START_CMD = 0x25
@@ -37,8 +41,22 @@ FlipBackRight = 6
 #FlipForwardRight flips forwards and to the right.
 FlipForwardRight = 7
 
+_header_crc8 = {}
+_header_crc16 = {}
+
+
+def header_crc8(size):
+    """Header_crc8 returns the crc8 of a packet header for the given (shifted) size field."""
+    val = _header_crc8.get(size)
+    if val is None:
+        val = _header_crc8[size] = crc.crc8(bytearray([START_OF_PACKET, size & 0xff, size >> 8]))
+    return val
+
+
 class Packet(object):
     def __init__(self, cmd, pkt_type=0x68):
+        # crc16 of the bytes after the header, kept up to date while the payload is built
+        self.payload_crc = None
         if isinstance(cmd, str):
             self.buf = bytearray()
             for c in cmd:
@@ -54,15 +72,31 @@ class Packet(object):
                 pkt_type,
                 (cmd & 0xff), ((cmd >> 8) & 0xff),
                 0, 0])
+            self.payload_crc = crc.Crc16(0)
 
     def fixup(self, seq_num=0):
         buf = self.get_buffer()
         if buf[0] == START_OF_PACKET:
-            buf[1], buf[2] = le16(len(buf)+2)
-            buf[1] = (buf[1] << 3)
-            buf[3] = crc.crc8(buf[0:3])
+            size = (len(buf) + 2) << 3
+            buf[1], buf[2] = le16(size)
+            buf[3] = header_crc8(size)
             buf[7], buf[8] = le16(seq_num)
-            self.add_int16(crc.crc16(buf))
+            payload_crc = self.payload_crc
+            self.payload_crc = None
+            if payload_crc is None or payload_crc.length != len(buf) - 9:
+                val = crc.crc16(buf)
+            else:
+                # bytes 0..6 only depend on size, type and command, so their crc is cached
+                key = (size << 24) | (buf[6] << 16) | (buf[5] << 8) | buf[4]
+                val = _header_crc16.get(key)
+                if val is None:
+                    val = _header_crc16[key] = crc.crc16(buf[0:7])
+                table = crc.crc16table
+                val = table[(val ^ buf[7]) & 0xff] ^ (val >> 8)
+                val = table[(val ^ buf[8]) & 0xff] ^ (val >> 8)
+                val = crc.crc16_combine(val, payload_crc.value, payload_crc.length)
+            buf.append(val & 0xff)
+            buf.append(val >> 8)
 
     def get_buffer(self):
         return self.buf
@@ -71,13 +105,18 @@ class Packet(object):
         return self.buf[9:len(self.buf)-2]
 
     def add_byte(self, val):
-        self.buf.append(val & 0xff)
+        val &= 0xff
+        self.buf.append(val)
+        if self.payload_crc is not None:
+            self.payload_crc.update_byte(val)
 
     def add_int16(self, val):
         self.add_byte(val)
         self.add_byte(val >> 8)
 
-    def add_time(self, time=datetime.datetime.now()):
+    def add_time(self, time=None):
+        if time is None:
+            time = clock.now()
         self.add_int16(time.hour)
         self.add_int16(time.minute)
         self.add_int16(time.second)
@@ -95,87 +134,216 @@ class Packet(object):
         return datetime.datetime(now.year, now.month, now.day, hour, min, sec, millisec)
 
 
+def conn_req_packet(video_port=6038):
+    """
+    Conn_req_packet returns the connection request. Its last two bytes are the UDP port the
+    drone streams video to, in little endian ("conn_req:\\x96\\x17" for port 6038).
+    """
+    return Packet('conn_req:%c%c' % (chr(video_port & 0xff), chr((video_port >> 8) & 0xff)))
+
+
+class PacketView(object):
+    """
+    PacketView gives read only access to a received packet without copying it. Header fields
+    are decoded when they are accessed and payload is a memoryview into the datagram, so the
+    datagram must not be modified while views of it are in use.
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = byte_view(data)
+
+    @property
+    def size(self):
+        data = self.data
+        return (data[1] | (data[2] << 8)) >> 3
+
+    @property
+    def type(self):
+        return self.data[4]
+
+    @property
+    def cmd(self):
+        data = self.data
+        return data[5] | (data[6] << 8)
+
+    @property
+    def seq(self):
+        data = self.data
+        return data[7] | (data[8] << 8)
+
+    @property
+    def payload(self):
+        """Payload returns the bytes between the header and the trailing crc16."""
+        return self.data[9:-2]
+
+    def get_buffer(self):
+        return self.data
+
+    def __len__(self):
+        return len(self.data)
+
+
+class StickEncoder(object):
+    """
+    StickEncoder builds STICK_CMD packets in a single reusable buffer. The header of a stick
+    packet never changes, so it is written once along with its crc8 and crc16 contribution;
+    each encode() only packs the payload and refreshes the trailing crc16. It has get_buffer()
+    so it can be handed to Tello.send_packet() like a Packet.
+    """
+    PAYLOAD = struct.Struct('<IH5H')
+    SIZE = 9 + PAYLOAD.size + 2
+
+    def __init__(self):
+        pkt = Packet(STICK_CMD, 0x60)
+        pkt.buf.extend(bytearray(self.PAYLOAD.size))
+        pkt.fixup()
+        self.buf = pkt.buf
+        self.header_crc = crc.crc16(self.buf[0:9])
+        self.payload = memoryview(self.buf)[9:9 + self.PAYLOAD.size]
+
+    def encode(self, roll, pitch, throttle, yaw, now=None):
+        """Encode stores stick values in the range -1.0 ~ 1.0 and the time into the buffer."""
+        axis1 = int(1024 + 660.0 * roll) & 0x7ff
+        axis2 = int(1024 + 660.0 * pitch) & 0x7ff
+        axis3 = int(1024 + 660.0 * throttle) & 0x7ff
+        axis4 = int(1024 + 660.0 * yaw) & 0x7ff
+        '''
+        11 bits (-1024 ~ +1023) x 4 axis = 44 bits
+        44 bits will be packed in to 6 bytes (48 bits)
+
+                    axis4      axis3      axis2      axis1
+             |          |          |          |          |
+                 4         3         2         1         0
+        98765432109876543210987654321098765432109876543210
+         |       |       |       |       |       |       |
+             byte5   byte4   byte3   byte2   byte1   byte0
+        '''
+        packed = axis1 | (axis2 << 11) | (axis3 << 22) | (axis4 << 33)
+        if now is None:
+            now = clock.now()
+        msec = now.microsecond // 1000
+        buf = self.buf
+        self.PAYLOAD.pack_into(buf, 9, packed & 0xffffffff, packed >> 32,
+                               now.hour, now.minute, now.second, msec & 0xff, msec >> 8)
+        val = crc.crc16(self.payload, self.header_crc)
+        buf[-2] = val & 0xff
+        buf[-1] = val >> 8
+        return buf
+
+    def get_buffer(self):
+        return self.buf
+
+
+class PacketValidator(object):
+    """
+    PacketValidator checks datagrams received from the drone before they are dispatched.
+    Checks are ordered from cheapest to most expensive and stop at the first failure. The
+    counters are plain attributes and can be read at any time.
+    """
+    # start of packet, size (2), crc8, type, command (2), sequence (2), crc16 (2)
+    MIN_SIZE = 11
+
+    def __init__(self):
+        self.received = 0
+        self.malformed = 0
+        self.bad_crc8 = 0
+        self.bad_crc16 = 0
+        self.unknown_cmd = 0
+
+    def check(self, data):
+        """Check returns True if data is a complete packet with a valid header and crc16."""
+        self.received += 1
+        length = len(data)
+        if length < self.MIN_SIZE or data[0] != START_OF_PACKET:
+            self.malformed += 1
+            return False
+        size = data[1] | (data[2] << 8)
+        if (size >> 3) != length:
+            self.malformed += 1
+            return False
+        if data[3] != header_crc8(size):
+            self.bad_crc8 += 1
+            return False
+        # the crc16 over a packet including its own little endian crc16 is zero
+        if crc.crc16(data) != 0:
+            self.bad_crc16 += 1
+            return False
+        return True
+
+    def get_stats(self):
+        return {
+            'received': self.received,
+            'malformed': self.malformed,
+            'bad_crc8': self.bad_crc8,
+            'bad_crc16': self.bad_crc16,
+            'unknown_cmd': self.unknown_cmd,
+        }
+
+
+def _bit(field, shift, doc=None):
+    def get(self):
+        return (getattr(self, field) >> shift) & 0x1
+
+    def set(self, value):
+        bits = getattr(self, field) & ~(1 << shift)
+        setattr(self, field, bits | (1 << shift) if value else bits)
+    return property(get, set, doc=doc)
+
+
 class FlightData(object):
+    """
+    FlightData holds one FLIGHT_MSG. Numeric fields are decoded by a single struct call and
+    the status flags are derived from the raw status bytes when they are read. Assigning a
+    flag sets or clears its bit in the status byte, so patched data packs back with FORMAT.
+    """
+    FORMAT = struct.Struct('<5H3B2H7B')
+    __slots__ = (
+        'height', 'north_speed', 'east_speed', 'ground_speed', 'fly_time',
+        'state0', 'imu_calibration_state', 'battery_percentage',
+        'drone_battery_left', 'drone_fly_time_left',
+        'state1', 'fly_mode', 'throw_fly_timer', 'camera_state',
+        'electrical_machinery_state', 'state2', 'state3',
+        # not reported by the drone in FLIGHT_MSG
+        'fly_speed', 'light_strength', 'smart_video_exit_mode', 'wifi_disturb', 'wifi_strength')
+    _empty = bytes(bytearray(FORMAT.size))
+
+    imu_state = _bit('state0', 0)
+    pressure_state = _bit('state0', 1)
+    down_visual_state = _bit('state0', 2)
+    power_state = _bit('state0', 3)
+    battery_state = _bit('state0', 4)
+    gravity_state = _bit('state0', 5)
+    wind_state = _bit('state0', 7)
+
+    em_sky = _bit('state1', 0)
+    em_ground = _bit('state1', 1)
+    em_open = _bit('state1', 2)
+    drone_hover = _bit('state1', 3)
+    outage_recording = _bit('state1', 4)
+    battery_low = _bit('state1', 5)
+    battery_lower = _bit('state1', 6)
+    factory_mode = _bit('state1', 7)
+
+    front_in = _bit('state2', 0)
+    front_out = _bit('state2', 1)
+    front_lsc = _bit('state2', 2)
+
+    temperature_height = _bit('state3', 0)
+
     def __init__(self, data):
-        self.battery_low = 0
-        self.battery_lower = 0
-        self.battery_percentage = 0
-        self.battery_state = 0
-        self.camera_state = 0
-        self.down_visual_state = 0
-        self.drone_battery_left = 0
-        self.drone_fly_time_left = 0
-        self.drone_hover = 0
-        self.em_open = 0
-        self.em_sky = 0
-        self.em_ground = 0
-        self.east_speed = 0
-        self.electrical_machinery_state = 0
-        self.factory_mode = 0
-        self.fly_mode = 0
+        if len(data) < self.FORMAT.size:
+            data = self._empty
+        (self.height, self.north_speed, self.east_speed, self.ground_speed, self.fly_time,
+         self.state0, self.imu_calibration_state, self.battery_percentage,
+         self.drone_battery_left, self.drone_fly_time_left,
+         self.state1, self.fly_mode, self.throw_fly_timer, self.camera_state,
+         self.electrical_machinery_state, self.state2, self.state3) = self.FORMAT.unpack_from(data)
         self.fly_speed = 0
-        self.fly_time = 0
-        self.front_in = 0
-        self.front_lsc = 0
-        self.front_out = 0
-        self.gravity_state = 0
-        self.ground_speed = 0
-        self.height = 0
-        self.imu_calibration_state = 0
-        self.imu_state = 0
         self.light_strength = 0
-        self.north_speed = 0
-        self.outage_recording = 0
-        self.power_state = 0
-        self.pressure_state = 0
         self.smart_video_exit_mode = 0
-        self.temperature_height = 0
-        self.throw_fly_timer = 0
         self.wifi_disturb = 0
         self.wifi_strength = 0
-        self.wind_state = 0
-
-        if len(data) < 24:
-            return
-
-        self.height = int16(data[0], data[1])
-        self.north_speed = int16(data[2], data[3])
-        self.east_speed = int16(data[4], data[5])
-        self.ground_speed = int16(data[6], data[7])
-        self.fly_time = int16(data[8], data[9])
-
-        self.imu_state = ((data[10] >> 0) & 0x1)
-        self.pressure_state = ((data[10] >> 1) & 0x1)
-        self.down_visual_state = ((data[10] >> 2) & 0x1)
-        self.power_state = ((data[10] >> 3) & 0x1)
-        self.battery_state = ((data[10] >> 4) & 0x1)
-        self.gravity_state = ((data[10] >> 5) & 0x1)
-        self.wind_state = ((data[10] >> 7) & 0x1)
-
-        self.imu_calibration_state = data[11]
-        self.battery_percentage = data[12]
-        self.drone_battery_left = int16(data[13], data[14])
-        self.drone_fly_time_left = int16(data[15], data[16])
-
-        self.em_sky = ((data[17] >> 0) & 0x1)
-        self.em_ground = ((data[17] >> 1) & 0x1)
-        self.em_open = ((data[17] >> 2) & 0x1)
-        self.drone_hover = ((data[17] >> 3) & 0x1)
-        self.outage_recording = ((data[17] >> 4) & 0x1)
-        self.battery_low = ((data[17] >> 5) & 0x1)
-        self.battery_lower = ((data[17] >> 6) & 0x1)
-        self.factory_mode = ((data[17] >> 7) & 0x1)
-
-        self.fly_mode = data[18]
-        self.throw_fly_timer = data[19]
-        self.camera_state = data[20]
-        self.electrical_machinery_state = data[21]
-
-        self.front_in = ((data[22] >> 0) & 0x1)
-        self.front_out = ((data[22] >> 1) & 0x1)
-        self.front_lsc = ((data[22] >> 2) & 0x1)
-
-        self.temperature_height = ((data[23] >> 0) & 0x1)
 
     def __str__(self):
         return (
@@ -184,3 +352,161 @@ class FlightData(object):
             (", battery_percentage=%2d" % self.battery_percentage) +
             (", drone_battery_left=0x%04x" % self.drone_battery_left) +
             "")
+
+
+def decode_payload(pkt):
+    return pkt.payload
+
+
+def decode_flight_data(pkt):
+    return FlightData(pkt.payload)
+
+
+def decode_time(pkt):
+    return pkt.data[7:9]
+
+
+if __name__ == '__main__':
+    import os
+    import random
+    import time
+
+    def make_packet(cmd, payload, pkt_type=0x68, seq_num=0):
+        pkt = Packet(cmd, pkt_type)
+        for b in bytearray(payload):
+            pkt.add_byte(b)
+        pkt.fixup(seq_num)
+        return bytes(pkt.get_buffer())
+
+    valid = [make_packet(FLIGHT_MSG, os.urandom(24)),
+             make_packet(WIFI_MSG, os.urandom(2)),
+             make_packet(LOG_MSG, os.urandom(200)),
+             make_packet(TAKEOFF_CMD, b'', seq_num=0x1e4)]
+    validator = PacketValidator()
+    for pkt in valid:
+        assert validator.check(bytearray(pkt))
+        if str is not bytes:
+            # on python 2 the validator is given bytearrays only
+            assert validator.check(pkt)
+            assert validator.check(memoryview(pkt))
+        assert not validator.check(pkt[:-1])
+        assert not validator.check(pkt[:5])
+        flipped = bytearray(pkt)
+        flipped[3] ^= 0x01
+        assert not validator.check(flipped)
+        flipped = bytearray(pkt)
+        flipped[-3] ^= 0x80
+        assert not validator.check(flipped)
+    assert not validator.check(b'')
+
+    # fuzz corpus: garbage, truncated and bit flipped versions of valid packets
+    rand = random.Random(0)
+    corpus = []
+    for i in range(20000):
+        kind = i % 4
+        base = bytearray(valid[i % len(valid)])
+        if kind == 0:
+            corpus.append(bytes(bytearray(rand.getrandbits(8) for j in range(rand.randint(0, 64)))))
+        elif kind == 1:
+            corpus.append(bytes(base[:rand.randint(0, len(base) - 1)]))
+        elif kind == 2:
+            pos = rand.randint(0, len(base) - 1)
+            base[pos] ^= 1 << rand.randint(0, 7)
+            corpus.append(bytes(base))
+        else:
+            corpus.append(bytes(base))
+    if str is bytes:
+        corpus = [bytearray(data) for data in corpus]
+
+    validator = PacketValidator()
+    start = time.time()
+    accepted = 0
+    for data in corpus:
+        if validator.check(data):
+            accepted += 1
+    elapsed = time.time() - start
+    assert accepted == len(corpus) // 4
+    print('validated %d datagrams in %.3f sec (%.0f packets/sec)' %
+          (len(corpus), elapsed, len(corpus) / elapsed))
+    print(validator.get_stats())
+
+    flight_data = FlightData(bytearray(range(1, 25)))
+    assert flight_data.height == 0x0201 and flight_data.fly_time == 0x0a09
+    assert flight_data.battery_percentage == 13 and flight_data.drone_battery_left == 0x0f0e
+    assert flight_data.imu_state == 1 and flight_data.pressure_state == 1
+    assert flight_data.em_sky == 0 and flight_data.em_ground == 1 and flight_data.fly_mode == 19
+    assert FlightData(b'').height == 0 and FlightData(b'').battery_low == 0
+    flight_data.em_sky = True
+    flight_data.em_ground = 0
+    assert flight_data.em_sky == 1 and flight_data.em_ground == 0 and flight_data.state1 == 17
+
+    # stick packets: the previous Packet based construction vs StickEncoder
+    import sys
+    try:
+        import tracemalloc
+    except ImportError:
+        # python 2 has neither tracemalloc nor opcode tracing
+        tracemalloc = None
+
+    def stick_packet(roll, pitch, throttle, yaw, now):
+        pkt = Packet(STICK_CMD, 0x60)
+        axis1 = int(1024 + 660.0 * roll) & 0x7ff
+        axis2 = int(1024 + 660.0 * pitch) & 0x7ff
+        axis3 = int(1024 + 660.0 * throttle) & 0x7ff
+        axis4 = int(1024 + 660.0 * yaw) & 0x7ff
+        pkt.add_byte(((axis2 << 11 | axis1) >> 0) & 0xff)
+        pkt.add_byte(((axis2 << 11 | axis1) >> 8) & 0xff)
+        pkt.add_byte(((axis3 << 11 | axis2) >> 5) & 0xff)
+        pkt.add_byte(((axis4 << 11 | axis3) >> 2) & 0xff)
+        pkt.add_byte(((axis4 << 11 | axis3) >> 10) & 0xff)
+        pkt.add_byte(((axis4 << 11 | axis3) >> 18) & 0xff)
+        pkt.add_time(now)
+        pkt.fixup()
+        return pkt.get_buffer()
+
+    encoder = StickEncoder()
+    for i in range(1000):
+        sticks = [rand.uniform(-1.0, 1.0) for j in range(4)]
+        now = datetime.datetime.now()
+        assert stick_packet(*(sticks + [now])) == encoder.encode(*(sticks + [now]))
+        assert validator.check(encoder.get_buffer())
+
+    def count_opcodes(func):
+        # opcode tracing came in python 3.7
+        if sys.version_info < (3, 7):
+            return None
+        counter = [0]
+
+        def tracer(frame, event, arg):
+            frame.f_trace_opcodes = True
+            if event == 'opcode':
+                counter[0] += 1
+            return tracer
+        sys.settrace(tracer)
+        func()
+        sys.settrace(None)
+        return counter[0]
+
+    def peak_memory(func):
+        # bytes of memory held at the worst point of a single call, all of it garbage afterwards
+        func()
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    now = datetime.datetime.now()
+    for name, func in [('Packet', lambda: stick_packet(0.1, 0.2, 0.3, 0.4, now)),
+                       ('StickEncoder', lambda: encoder.encode(0.1, 0.2, 0.3, 0.4, now))]:
+        number = 20000
+        start = time.time()
+        for i in range(number):
+            func()
+        usec = (time.time() - start) / number * 1e6
+        if tracemalloc is None:
+            print('stick packet by %-12s %6.2f usec' % (name, usec))
+            continue
+        opcodes = count_opcodes(func)
+        print('stick packet by %-12s %6.2f usec, %4s python opcodes, %4d bytes peak memory' %
+              (name, usec, '-' if opcodes is None else opcodes, peak_memory(func)))
@@ -0,0 +1,376 @@
+import bisect
+import collections
+import mmap
+import os
+import struct
+import threading
+import time
+
+from . video_stats import monotonic_ns
+
+CHANNEL_COMMAND = 0
+CHANNEL_VIDEO = 1
+DIRECTION_IN = 0
+DIRECTION_OUT = 1
+
+MAGIC = b'TELLOREC'
+INDEX_MAGIC = b'TELLOIDX'
+VERSION = 1
+# magic, version, flags, wall clock and monotonic_ns time of the start of the recording
+FILE_HEADER = struct.Struct('<8sHHdq4x')
+# monotonic_ns timestamp, length of the data, channel, direction
+RECORD_HEADER = struct.Struct('<qHBB')
+# monotonic_ns timestamp and file offset of the first record of a block
+INDEX_ENTRY = struct.Struct('<qq')
+# offset of the index table, number of records, magic
+TRAILER = struct.Struct('<qq8s')
+
+
+class Recorder(object):
+    """
+    Recorder appends datagrams to a flight recording file. Record() only stamps and queues
+    the datagram, so it can be called from the I/O thread; a writer thread of its own packs
+    the records and writes them through a large buffer. If the writer falls more than
+    maxsize records behind, further records are dropped and counted.
+
+    The file starts with a FILE_HEADER and holds one RECORD_HEADER and the data per datagram.
+    Timestamps are time.monotonic_ns() values, made non-decreasing in file order. Every
+    index_interval bytes the time and offset of the next record are noted, and close() writes
+    these as an index table followed by a TRAILER, so RecordingReader can seek by time in
+    O(log n). A file that was not closed has no index and is scanned instead.
+    """
+
+    def __init__(self, path, index_interval=64 * 1024, maxsize=65536, buffer_size=1024 * 1024):
+        self.path = path
+        self.index_interval = index_interval
+        self.maxsize = maxsize
+        self.file = open(path, 'wb', buffer_size)
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, 0, time.time(), monotonic_ns()))
+        self.offset = FILE_HEADER.size
+        self.next_index = self.offset
+        self.index = []
+        self.last_stamp = 0
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.records = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.thread = threading.Thread(target=self.__run, name='tellopy recorder')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self, channel, direction, data, stamp=None):
+        """
+        Record queues one datagram. Data may be a view into a reused buffer; it is copied.
+        Stamp defaults to time.monotonic_ns() now.
+        """
+        if stamp is None:
+            stamp = monotonic_ns()
+        # bytes() of a memoryview is its repr on python 2
+        data = data.tobytes() if isinstance(data, memoryview) else bytes(data)
+        record = (stamp, channel, direction, data)
+        queue = self.queue
+        # checked and appended under the lock, so the writer cannot go to sleep between the
+        # check for an empty queue and the append that would have woken it
+        self.cond.acquire()
+        try:
+            depth = len(queue)
+            if self.maxsize <= depth or self.closed:
+                self.dropped += 1
+                return
+            queue.append(record)
+            if self.max_depth <= depth:
+                self.max_depth = depth + 1
+            if not depth:
+                self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def close(self, timeout=None):
+        """Close writes what is queued and the index, then closes the file."""
+        self.cond.acquire()
+        self.closed = True
+        self.cond.notify()
+        self.cond.release()
+        self.thread.join(timeout)
+
+    def get_stats(self):
+        return {
+            'records': self.records,
+            'bytes': self.bytes,
+            'dropped': self.dropped,
+            'depth': len(self.queue),
+            'max_depth': self.max_depth,
+        }
+
+    def __run(self):
+        queue = self.queue
+        write = self.file.write
+        pack = RECORD_HEADER.pack
+        while True:
+            self.cond.acquire()
+            while not queue and not self.closed:
+                self.cond.wait()
+            closed = self.closed
+            self.cond.release()
+            while queue:
+                stamp, channel, direction, data = queue.popleft()
+                if stamp < self.last_stamp:
+                    stamp = self.last_stamp
+                self.last_stamp = stamp
+                if self.next_index <= self.offset:
+                    self.index.append((stamp, self.offset))
+                    self.next_index = self.offset + self.index_interval
+                write(pack(stamp, len(data), channel, direction))
+                write(data)
+                self.offset += RECORD_HEADER.size + len(data)
+                self.records += 1
+                self.bytes += len(data)
+            if closed and not queue:
+                break
+        index_offset = self.offset
+        for stamp, offset in self.index:
+            write(INDEX_ENTRY.pack(stamp, offset))
+        write(TRAILER.pack(index_offset, self.records, INDEX_MAGIC))
+        self.file.close()
+
+
+class RecordingReader(object):
+    """
+    RecordingReader reads a file written by Recorder through mmap, so even recordings of
+    several GB are read without loading them. Records are (stamp, channel, direction, data)
+    tuples where data is a memoryview into the mapping, or on python 2, which cannot make a
+    memoryview of a mapping, a copy. Close() closes the file; the mapping stays until the last
+    record still referenced, such as the loop variable of a for loop over the reader, is gone.
+
+    The index table is used when the file has one; otherwise, as after a crash, the records
+    are scanned once to build the index, up to the last complete record.
+    """
+
+    def __init__(self, path, index_interval=64 * 1024):
+        self.path = path
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < FILE_HEADER.size:
+            self.file.close()
+            raise ValueError('%s: not a flight recording' % path)
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = self.map if str is bytes else memoryview(self.map)
+        magic, version, flags, self.start_time, self.start_stamp = FILE_HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('%s: not a flight recording' % path)
+        self.indexed = False
+        self.end = size
+        self.count = None
+        if TRAILER.size <= size - FILE_HEADER.size:
+            index_offset, count, magic = TRAILER.unpack_from(self.map, size - TRAILER.size)
+            entries, remainder = divmod(size - TRAILER.size - index_offset, INDEX_ENTRY.size)
+            if magic == INDEX_MAGIC and FILE_HEADER.size <= index_offset and not remainder:
+                self.indexed = True
+                self.end = index_offset
+                self.count = count
+                self.stamps = []
+                self.offsets = []
+                for i in range(entries):
+                    stamp, offset = INDEX_ENTRY.unpack_from(self.map, index_offset + i * INDEX_ENTRY.size)
+                    self.stamps.append(stamp)
+                    self.offsets.append(offset)
+        if not self.indexed:
+            self.__scan(index_interval)
+
+    def __scan(self, index_interval):
+        self.stamps = []
+        self.offsets = []
+        count = 0
+        next_index = 0
+        offset = FILE_HEADER.size
+        end = self.end
+        unpack_from = RECORD_HEADER.unpack_from
+        while offset + RECORD_HEADER.size <= end:
+            stamp, length, channel, direction = unpack_from(self.map, offset)
+            if end < offset + RECORD_HEADER.size + length:
+                break
+            if next_index <= offset:
+                self.stamps.append(stamp)
+                self.offsets.append(offset)
+                next_index = offset + index_interval
+            offset += RECORD_HEADER.size + length
+            count += 1
+        # a partly written record at the end is ignored
+        self.end = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return self.records()
+
+    def seek(self, stamp):
+        """Seek returns the offset of the index block holding the first record at or after stamp."""
+        # records with stamp can sit at the end of the block before the first index entry
+        # with that stamp, since stamps repeat across block boundaries
+        i = bisect.bisect_left(self.stamps, stamp) - 1
+        if i < 0:
+            return FILE_HEADER.size
+        return self.offsets[i]
+
+    def records(self, start=None, end=None, channel=None):
+        """
+        Records yields the records with start <= stamp < end, of channel if given, in file
+        order. Start and end are monotonic_ns stamps as recorded; see wall_time().
+        """
+        offset = FILE_HEADER.size if start is None else self.seek(start)
+        last = self.end
+        view = self.view
+        header_size = RECORD_HEADER.size
+        unpack_from = RECORD_HEADER.unpack_from
+        while offset < last:
+            stamp, length, chan, direction = unpack_from(view, offset)
+            data_offset = offset + header_size
+            offset = data_offset + length
+            if start is not None and stamp < start:
+                continue
+            if end is not None and end <= stamp:
+                return
+            if channel is None or channel == chan:
+                yield stamp, chan, direction, view[data_offset:offset]
+
+    def wall_time(self, stamp):
+        """Wall_time converts a recorded stamp to seconds since the epoch."""
+        return self.start_time + (stamp - self.start_stamp) / 1e9
+
+    @property
+    def first_stamp(self):
+        return self.stamps[0] if self.stamps else self.start_stamp
+
+    def close(self):
+        if isinstance(self.view, memoryview):
+            self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # records still hold views into the mapping; it is unmapped once they are gone
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+
+    from . utils import byte
+
+    if 1 < len(sys.argv):
+        # summarize a recording: python -m tellopy._internal.recorder flight.rec
+        with RecordingReader(sys.argv[1]) as reader:
+            counts = collections.Counter((chan, direction) for stamp, chan, direction, data in reader)
+            print('%d records, %d index entries%s' % (len(reader), len(reader.stamps),
+                                                     '' if reader.indexed else ' (scanned)'))
+            for (chan, direction), count in sorted(counts.items()):
+                print('  %s %s: %d' % (('command', 'video')[chan], ('in', 'out')[direction], count))
+        sys.exit(0)
+
+    path = os.path.join(tempfile.mkdtemp(), 'flight.rec')
+    recorder = Recorder(path, index_interval=4096)
+    base = 10 ** 12
+    buf = bytearray(1000)
+    view = memoryview(buf)
+    for i in range(1000):
+        buf[0] = i & 0xff
+        if i % 10:
+            recorder.record(CHANNEL_VIDEO, DIRECTION_IN, view, base + i * 1000)
+        else:
+            recorder.record(CHANNEL_COMMAND, DIRECTION_OUT, b'cmd %d' % i, base + i * 1000)
+    # out of order stamps, as from two threads, are made non-decreasing
+    recorder.record(CHANNEL_COMMAND, DIRECTION_IN, b'late', base + 500)
+    recorder.close()
+    assert recorder.records == 1001 and recorder.dropped == 0
+
+    with RecordingReader(path) as reader:
+        assert reader.indexed and len(reader) == 1001 and 150 < len(reader.stamps)
+        records = list(reader)
+        assert len(records) == 1001 and records[-1][0] == base + 999 * 1000
+        assert bytes(records[-1][3]) == b'late'
+        assert all(byte(records[i][3][0]) == i & 0xff for i in range(1, 1000) if i % 10)
+        selected = list(reader.records(base + 500 * 1000, base + 600 * 1000))
+        assert [r[0] for r in selected] == [base + i * 1000 for i in range(500, 600)]
+        commands = list(reader.records(base + 500 * 1000, channel=CHANNEL_COMMAND))
+        assert [bytes(r[3]) for r in commands][:2] == [b'cmd 500', b'cmd 510']
+        assert commands[0][2] == DIRECTION_OUT
+        del records, selected, commands
+
+    # a record kept past close(), as by the loop variable, stays readable
+    with RecordingReader(path) as reader:
+        for record in reader:
+            pass
+    assert reader.file.closed and bytes(record[3]) == b'late'
+    del record
+
+    # a recording cut short, as by a crash, is scanned up to the last complete record
+    with open(path, 'rb') as f:
+        data = f.read()
+    cut = FILE_HEADER.size + 400 * (RECORD_HEADER.size + 1000) + 10
+    with open(path, 'wb') as f:
+        f.write(data[:cut])
+    with RecordingReader(path) as reader:
+        assert not reader.indexed and len(reader) == len(list(reader))
+        assert 400 < len(reader) < 500
+        assert [r[0] for r in reader.records(base + 100 * 1000, base + 102 * 1000)] == [
+            base + 100 * 1000, base + 101 * 1000]
+    os.remove(path)
+
+    # a stamp repeated across block boundaries is found from its first record
+    recorder = Recorder(path, index_interval=4096)
+    recorder.record(CHANNEL_COMMAND, DIRECTION_OUT, b'first', base)
+    for i in range(20):
+        recorder.record(CHANNEL_VIDEO, DIRECTION_IN, view, base + 1000)
+    recorder.close()
+    with RecordingReader(path) as reader:
+        assert 2 < reader.stamps.count(base + 1000)
+        assert len(list(reader.records(base + 1000))) == 20
+        assert len(list(reader.records(base + 1, base + 1001))) == 20
+    os.remove(path)
+
+    # producers on several threads against a writer that keeps emptying the queue
+    recorder = Recorder(path, maxsize=64)
+
+    def produce():
+        for i in range(20000):
+            recorder.record(CHANNEL_COMMAND, DIRECTION_OUT, b'x')
+            if i % 100 == 0:
+                time.sleep(0)
+    threads = [threading.Thread(target=produce) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    time.sleep(0.2)
+    assert not recorder.queue, recorder.get_stats()
+    recorder.close()
+    assert recorder.records + recorder.dropped == 80000, recorder.get_stats()
+    os.remove(path)
+
+    recorder = Recorder(path)
+    data = bytearray(1460)
+    number = 100000
+    begin = time.time()
+    for i in range(number):
+        recorder.record(CHANNEL_VIDEO, DIRECTION_IN, data)
+    elapsed = time.time() - begin
+    recorder.close()
+    print('%.2f usec/datagram recorded, %d dropped' % (elapsed / number * 1e6, recorder.dropped))
+    begin = time.time()
+    with RecordingReader(path) as reader:
+        count = sum(1 for record in reader)
+    print('%.2f usec/datagram read' % ((time.time() - begin) / count * 1e6))
+    os.remove(path)
@@ -0,0 +1,308 @@
+import select
+import socket
+import threading
+import time
+
+from . import logger
+from . import recorder
+from . video_stats import monotonic_ns
+
+log = logger.Logger('Replay')
+
+TRANSPORT_SOCKET = 'socket'
+TRANSPORT_INJECT = 'inject'
+
+
+INJECT_BATCH = 64
+# batches handed to the loop but not yet processed, before the replaying thread waits
+INJECT_BACKLOG = 4
+# video datagrams sent over the socket but not yet received by the drone, before the
+# replaying thread waits; well inside the default receive buffer, so the kernel drops none
+SOCKET_BACKLOG = 128
+# how long the replaying thread waits for the drone to receive before sending regardless
+SOCKET_STALL = 1.0
+
+
+class Replayer(object):
+    """
+    Replayer plays a recording made with Tello.start_recording() back into a Tello, which
+    runs its normal receive path: packet validation and decoding, events, VideoStream and
+    statistics. Only the received datagrams are replayed. The replayer points drone.tello_addr
+    at a loopback socket of its own, so the drone's commands never leave the host; it answers
+    the connection request and ignores the rest.
+
+    With TRANSPORT_SOCKET the datagrams are sent over loopback UDP to the drone's command and
+    video ports, which is how a real drone reaches it. With TRANSPORT_INJECT they skip the
+    sockets and the kernel: the replaying thread hands them, in batches of up to INJECT_BATCH,
+    to the drone's I/O loop, which passes them to drone.receive_packet() and
+    drone.receive_video() on its own thread. Either way the drone's state is only touched by
+    its loop thread, as in flight; the replaying thread only reads and paces the datagrams.
+    Over the socket it also keeps at most SOCKET_BACKLOG video datagrams in flight, so a fast
+    replay does not overflow the receive buffer; if the drone stops receiving for SOCKET_STALL
+    seconds it sends regardless, and the kernel drops the excess (see get_video_stats()).
+
+    Speed 1.0 replays at the recorded pace, 2.0 twice as fast and so on; speed None replays
+    as fast as possible, for measuring throughput. Only the video the drone has enabled
+    (start_video() or get_video_stream()) is processed.
+    """
+
+    def __init__(self, drone, recording, speed=1.0, transport=TRANSPORT_SOCKET):
+        if transport not in (TRANSPORT_SOCKET, TRANSPORT_INJECT):
+            raise ValueError('unknown transport %s' % str(transport))
+        self.drone = drone
+        if isinstance(recording, recorder.RecordingReader):
+            self.reader = recording
+            self.own_reader = False
+        else:
+            self.reader = recorder.RecordingReader(recording)
+            self.own_reader = True
+        self.speed = speed
+        self.transport = transport
+        self.running = False
+        self.thread = None
+        self.commands = 0
+        self.video = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+        self.max_late = 0.0
+        self.backlog = threading.Semaphore(INJECT_BACKLOG)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.setblocking(False)
+        drone.tello_addr = self.sock.getsockname()
+
+    def connect(self, timeout=2.0):
+        """Connect makes the drone connect to the replayer, unless it is connected already."""
+        drone = self.drone
+        if drone.state == drone.STATE_CONNECTED:
+            return
+        drone.connect()
+        deadline = time.time() + timeout
+        while not drone.connected.is_set():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise RuntimeError('replay: the drone did not connect')
+            self.__answer(min(remaining, 0.1))
+
+    def __answer(self, timeout):
+        # take whatever the drone sent and acknowledge connection requests
+        if timeout and not select.select([self.sock], [], [], timeout)[0]:
+            return
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except socket.error:
+                return
+            if data.startswith(b'conn_req:'):
+                self.sock.sendto(b'conn_ack:' + data[9:11], addr)
+
+    def run(self, start=None, end=None):
+        """
+        Run connects the drone and replays the recorded datagrams with start <= stamp < end
+        (recorded monotonic_ns stamps, all by default). It returns get_stats().
+        """
+        self.running = True
+        self.connect()
+        drone = self.drone
+        speed = self.speed
+        inject = self.transport == TRANSPORT_INJECT
+        command_addr = ('127.0.0.1', drone.port)
+        video_addr = ('127.0.0.1', drone.video_port)
+        sendto = self.sock.sendto
+        pool = drone.video_pool
+        # video datagrams sent minus received up to here
+        received = pool.datagrams - self.video
+        CHANNEL_VIDEO = recorder.CHANNEL_VIDEO
+        DIRECTION_IN = recorder.DIRECTION_IN
+        batch = []
+        first = None
+        begin = time.time()
+        for stamp, channel, direction, data in self.reader.records(start, end):
+            if not self.running:
+                break
+            if direction != DIRECTION_IN:
+                continue
+            if speed is not None:
+                if first is None:
+                    first = stamp
+                    begin = time.time()
+                delay = begin + (stamp - first) / 1e9 / speed - time.time()
+                if 0 < delay:
+                    if batch:
+                        batch = self.__inject(batch)
+                    self.__answer(delay)
+                elif self.max_late < -delay:
+                    self.max_late = -delay
+            if inject:
+                batch.append((channel, data))
+                if INJECT_BATCH <= len(batch):
+                    batch = self.__inject(batch)
+            elif channel == CHANNEL_VIDEO:
+                if SOCKET_BACKLOG <= self.video - (pool.datagrams - received):
+                    self.__wait_received(pool, received)
+                sendto(data, video_addr)
+            else:
+                sendto(data, command_addr)
+            if channel == CHANNEL_VIDEO:
+                self.video += 1
+            else:
+                self.commands += 1
+            self.bytes += len(data)
+        if inject:
+            self.__inject(batch)
+            self.__wait_injected()
+        self.elapsed = time.time() - begin
+        self.__answer(0)
+        self.running = False
+        log.info('replayed %d command and %d video datagrams in %.3f sec',
+                 self.commands, self.video, self.elapsed)
+        return self.get_stats()
+
+    def __inject(self, batch):
+        # hand the batch to the loop thread, waiting while too many are outstanding
+        self.backlog.acquire()
+        self.drone.io_loop.call_soon(self.__receive, batch)
+        return []
+
+    def __receive(self, batch):
+        drone = self.drone
+        try:
+            for channel, data in batch:
+                if channel == recorder.CHANNEL_VIDEO:
+                    drone.receive_video(data)
+                else:
+                    drone.receive_packet(bytes(data))
+        finally:
+            self.backlog.release()
+
+    def __wait_received(self, pool, received):
+        # wait until the drone has room for more video, or has stopped receiving
+        deadline = time.time() + SOCKET_STALL
+        count = pool.datagrams
+        while self.running and SOCKET_BACKLOG // 2 < self.video - (count - received):
+            now = time.time()
+            if deadline <= now:
+                return
+            self.__answer(0.0005)
+            if count != pool.datagrams:
+                count = pool.datagrams
+                deadline = now + SOCKET_STALL
+
+    def __wait_injected(self):
+        # the views into the recording must stay valid until the loop has processed them
+        for i in range(INJECT_BACKLOG):
+            self.backlog.acquire()
+        for i in range(INJECT_BACKLOG):
+            self.backlog.release()
+
+    def start(self, start=None, end=None):
+        """Start runs the replay on a thread of its own; see wait() and stop()."""
+        self.thread = threading.Thread(target=self.run, args=(start, end), name='tellopy replay')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def wait(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+            return not self.thread.is_alive()
+        return True
+
+    def stop(self):
+        self.running = False
+        self.wait()
+
+    def close(self):
+        self.stop()
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.own_reader:
+            self.reader.close()
+
+    def get_stats(self):
+        """
+        Get_stats returns the number of command and video datagrams and bytes replayed, the
+        time taken, the datagram rate and, when paced, how late the replay fell at most.
+        """
+        datagrams = self.commands + self.video
+        return {
+            'commands': self.commands,
+            'video': self.video,
+            'bytes': self.bytes,
+            'elapsed': self.elapsed,
+            'rate': datagrams / self.elapsed if self.elapsed else 0.0,
+            'max_late': self.max_late,
+        }
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    import tempfile
+    from . protocol import Packet, FLIGHT_MSG, WIFI_MSG
+    from . tello import Tello
+
+    if 1 < len(sys.argv):
+        # measure the receive path on a recording: python -m tellopy._internal.replay flight.rec
+        drone = Tello(port=0, video_port=0)
+        drone.set_loglevel(drone.LOG_WARN)
+        drone.video_enabled = True
+        replayer = Replayer(drone, sys.argv[1], speed=None, transport=TRANSPORT_INJECT)
+        print(replayer.run())
+        drone.quit()
+        replayer.close()
+        sys.exit(0)
+
+    # make a recording of a short flight: flight data, wifi and video at their usual rates
+    path = os.path.join(tempfile.mkdtemp(), 'flight.rec')
+    rec = recorder.Recorder(path)
+    stamp = monotonic_ns()
+    flight = Packet(FLIGHT_MSG, 0x88)
+    flight.add_byte(0x00)
+    flight.buf.extend(bytearray(24))
+    flight.fixup()
+    wifi = Packet(WIFI_MSG, 0x88)
+    wifi.add_byte(0x50)
+    wifi.add_byte(0x00)
+    wifi.fixup()
+    for i in range(200):
+        t = stamp + i * 5000000
+        if i % 2 == 0:
+            rec.record(recorder.CHANNEL_COMMAND, recorder.DIRECTION_IN, flight.get_buffer(), t)
+        if i % 20 == 0:
+            rec.record(recorder.CHANNEL_COMMAND, recorder.DIRECTION_IN, wifi.get_buffer(), t)
+            rec.record(recorder.CHANNEL_COMMAND, recorder.DIRECTION_OUT, b'ignored', t)
+        rec.record(recorder.CHANNEL_VIDEO, recorder.DIRECTION_IN,
+                   bytearray([i & 0xff, 0x80 if i % 20 == 0 else 0]) + bytearray(1000), t)
+    rec.close()
+
+    for transport, speed in ((TRANSPORT_SOCKET, 1.0), (TRANSPORT_INJECT, 1.0),
+                             (TRANSPORT_SOCKET, None), (TRANSPORT_INJECT, None)):
+        drone = Tello(port=0, video_port=0)
+        drone.set_loglevel(drone.LOG_WARN)
+        counts = {}
+        threads = set()
+
+        def handler(event, sender, data, **args):
+            threads.add(threading.current_thread())
+            counts[event] = counts.get(event, 0) + 1
+        for event in (drone.EVENT_CONNECTED, drone.EVENT_FLIGHT_DATA, drone.EVENT_WIFI,
+                      drone.EVENT_VIDEO_FRAME):
+            drone.subscribe(event, handler)
+        drone.video_enabled = True
+        replayer = Replayer(drone, path, speed, transport)
+        stats = replayer.run()
+        time.sleep(0.1)
+        assert stats['commands'] == 110 and stats['video'] == 200, stats
+        assert counts[drone.EVENT_CONNECTED] == 1, counts
+        assert counts[drone.EVENT_FLIGHT_DATA] == 100 and counts[drone.EVENT_WIFI] == 10, counts
+        assert counts[drone.EVENT_VIDEO_FRAME] == 200, counts
+        assert drone.get_video_stats()['sequence_loss'] == 0
+        assert threads == set([drone.io_loop.thread]), threads
+        if speed is not None:
+            assert 0.99 < stats['elapsed'] < 1.2, stats
+        drone.quit()
+        replayer.close()
+        print('%s %s: %.0f datagrams/sec, max late %.1f ms' % (
+            transport, 'paced' if speed else 'fast', stats['rate'], stats['max_late'] * 1000))
+    os.remove(path)
@@ -0,0 +1,383 @@
+import socket
+
+from . import io_loop as io_loop_module
+from . import log_data
+from . import logger
+from . protocol import *
+
+log = logger.Logger('Simulator')
+
+VIDEO_CHUNK = 1460
+START_CODE = b'\x00\x00\x00\x01'
+
+
+def split_frames(stream):
+    """
+    Split_frames splits an H.264 elementary stream into access units, starting a new one at
+    the first slice, parameter set or delimiter NAL unit after a slice.
+    """
+    frames = []
+    start = 0
+    has_slice = False
+    pos = stream.find(START_CODE)
+    while pos != -1:
+        nal_type = bytearray(stream[pos + 4:pos + 5] or b'\x00')[0] & 0x1f
+        if has_slice and nal_type in (1, 5, 7, 9):
+            frames.append(stream[start:pos])
+            start = pos
+            has_slice = False
+        if nal_type in (1, 5):
+            has_slice = True
+        pos = stream.find(START_CODE, pos + 4)
+    if start < len(stream):
+        frames.append(stream[start:])
+    return frames
+
+
+def synthetic_frames(count=30, key_size=20000, size=4000):
+    """Synthetic_frames returns count frames shaped like H.264 access units: one key frame first."""
+    frames = []
+    for i in range(count):
+        if i == 0:
+            body = b'\x00\x00\x00\x01\x67' + b'\x42' * 8 + b'\x00\x00\x00\x01\x68\xce\x3c\x80'
+            body += b'\x00\x00\x00\x01\x65' + bytes(bytearray([i & 0xff])) * key_size
+        else:
+            body = b'\x00\x00\x00\x01\x41' + bytes(bytearray([i & 0xff])) * size
+        frames.append(body)
+    return frames
+
+
+class SimulatedDrone(object):
+    """
+    SimulatedDrone answers a Tello client on a local UDP socket the way the drone does:
+
+    - conn_req: is answered with conn_ack: and tells it where to send video,
+    - commands that expect an acknowledgement (takeoff, land, flip, video and exposure
+      settings) are acknowledged, and TIME_CMD is answered with the simulator's time,
+    - FLIGHT_MSG and WIFI_MSG are sent flight_rate and wifi_rate times a second, with the
+      height following takeoff and land, and the battery draining slowly,
+    - LOG_HEADER_MSG is repeated until acknowledged, then LOG_DATA_MSG with IMU and MVO
+      records is sent log_rate times a second,
+    - once video is started, frames are sent at fps, split into datagrams of VIDEO_CHUNK
+      bytes behind the drone's 2 byte header (frame number, then the datagram's index in the
+      frame with 0x80 set on the last one).
+
+    Frames come from an H.264 file given as video_file and loop at its end; synthetic frames
+    of the usual sizes are used otherwise. Everything runs on io_loop, so any number of
+    simulated drones can share one thread.
+    """
+
+    def __init__(self, io_loop, local_ip='127.0.0.1', port=0, video_file=None, frames=None,
+                 fps=30.0, flight_rate=10.0, wifi_rate=2.0, log_rate=10.0):
+        self.io_loop = io_loop
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((local_ip, port))
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+        if frames is None:
+            if video_file is not None:
+                with open(video_file, 'rb') as f:
+                    frames = split_frames(f.read())
+            else:
+                frames = synthetic_frames()
+        self.frames = frames
+        self.fps = fps
+        self.flight_rate = flight_rate
+        self.wifi_rate = wifi_rate
+        self.log_rate = log_rate
+        self.peer = None
+        self.video_addr = None
+        self.video_enabled = False
+        self.frame = 0
+        self.flying = False
+        self.height = 0
+        self.battery = 100.0
+        self.fly_time = 0
+        self.log_acked = False
+        self.log_seq = 0
+        self.timers = []
+        self.closed = False
+        self.seq = 0
+        self.stats = {
+            'conn_reqs': 0,
+            'commands': 0,
+            'acks': 0,
+            'sticks': 0,
+            'invalid': 0,
+            'telemetry': 0,
+            'video_datagrams': 0,
+            'video_bytes': 0,
+        }
+        self.validator = PacketValidator()
+        io_loop.add_reader(self.sock, self.__on_readable)
+
+    def close(self):
+        self.closed = True
+        for timer in self.timers:
+            timer.cancel()
+        self.timers = []
+        self.io_loop.remove_reader(self.sock, close=True)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['connected'] = self.peer is not None
+        stats['flying'] = self.flying
+        return stats
+
+    def __on_readable(self, sock):
+        while True:
+            try:
+                data, addr = sock.recvfrom(2048)
+            except socket.error:
+                return
+            self.__process(bytearray(data), addr)
+
+    def __process(self, data, addr):
+        if data[0:9] == b'conn_req:':
+            self.stats['conn_reqs'] += 1
+            port = data[9] | (data[10] << 8) if 11 <= len(data) else 6038
+            self.video_addr = (addr[0], port)
+            self.sock.sendto(b'conn_ack:' + bytes(data[9:11]), addr)
+            if self.peer is None:
+                self.peer = addr
+                self.__start()
+            self.peer = addr
+            return
+        if not self.validator.check(data):
+            self.stats['invalid'] += 1
+            return
+        pkt = PacketView(data)
+        cmd = pkt.cmd
+        if cmd == STICK_CMD:
+            self.stats['sticks'] += 1
+            return
+        self.stats['commands'] += 1
+        if cmd == TIME_CMD:
+            reply = Packet(TIME_CMD, 0x50)
+            reply.add_byte(0)
+            reply.add_time()
+            self.__send(reply, pkt.seq)
+        elif cmd == LOG_HEADER_MSG:
+            self.log_acked = True
+        elif cmd in (TAKEOFF_CMD, LAND_CMD, FLIP_CMD, VIDEO_START_CMD, VIDEO_ENCODER_RATE_CMD,
+                     EXPOSURE_CMD):
+            if cmd == TAKEOFF_CMD:
+                self.flying = True
+            elif cmd == LAND_CMD:
+                self.flying = False
+            elif cmd == VIDEO_START_CMD and not self.video_enabled:
+                self.video_enabled = True
+                self.__every(1.0 / self.fps, self.__send_frame)
+            ack = Packet(cmd, 0x90)
+            ack.add_byte(0)
+            self.__send(ack, pkt.seq)
+            self.stats['acks'] += 1
+
+    def __send(self, pkt, seq=None):
+        if seq is None:
+            seq = self.seq
+            self.seq = (self.seq + 1) & 0xffff
+        pkt.fixup(seq)
+        try:
+            self.sock.sendto(pkt.get_buffer(), self.peer)
+        except socket.error as ex:
+            log.debug('send: %s', str(ex))
+
+    def __start(self):
+        self.__every(1.0 / self.flight_rate, self.__send_flight_data)
+        self.__every(1.0 / self.wifi_rate, self.__send_wifi)
+        self.__every(1.0, self.__send_log_header)
+        self.__every(1.0 / self.log_rate, self.__send_log_data)
+
+    def __every(self, interval, func):
+        # keep a fixed grid so the rates hold however late a callback runs
+        state = {'deadline': self.io_loop.time() + interval}
+
+        def tick():
+            if self.closed:
+                return
+            func()
+            state['deadline'] += interval
+            now = self.io_loop.time()
+            if state['deadline'] < now:
+                state['deadline'] = now + interval
+            self.timers[index] = self.io_loop.call_at(state['deadline'], tick)
+        index = len(self.timers)
+        self.timers.append(self.io_loop.call_at(state['deadline'], tick))
+
+    def __send_flight_data(self):
+        if self.flying:
+            self.height = min(self.height + 1, 12)
+            self.fly_time += 1
+            self.battery = max(0.0, self.battery - 0.01)
+        else:
+            self.height = max(self.height - 2, 0)
+        battery = int(self.battery)
+        pkt = Packet(FLIGHT_MSG, 0x48)
+        pkt.buf.extend(FlightData.FORMAT.pack(
+            self.height, 0, 0, 0, self.fly_time, 0x01 if self.flying else 0x00, 0, battery,
+            battery * 40, 600, 0, 6, 0, 0, 0, 0, 0))
+        self.__send(pkt)
+        self.stats['telemetry'] += 1
+
+    def __send_wifi(self):
+        pkt = Packet(WIFI_MSG, 0x48)
+        pkt.add_byte(90)
+        pkt.add_byte(0)
+        self.__send(pkt)
+        self.stats['telemetry'] += 1
+
+    def __send_log_header(self):
+        if self.log_acked:
+            return
+        pkt = Packet(LOG_HEADER_MSG, 0x50)
+        pkt.add_int16(0x1234)
+        pkt.buf.extend(b'\x00' * 16)
+        self.__send(pkt)
+        self.stats['telemetry'] += 1
+
+    def __send_log_data(self):
+        if not self.log_acked:
+            return
+        i = self.log_seq
+        self.log_seq += 1
+        decoder = log_data.LogDecoder
+        imu = bytearray(decoder.IMU_OFFSET - log_data.RECORD_HEADER_SIZE)
+        imu += decoder.IMU_FORMAT.pack(0.0, 0.0, -1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0,
+                                       25.0, 0.0, 0.0)
+        mvo = decoder.MVO_FORMAT.pack(i & 0xffff, 0, 0, 0, 0.0, 0.0, -self.height / 10.0)
+        pkt = Packet(LOG_DATA_MSG, 0x50)
+        pkt.add_byte(0)
+        pkt.buf.extend(log_data.encode_record(log_data.ID_IMU_ATTI, imu, i & 0xff))
+        pkt.buf.extend(log_data.encode_record(log_data.ID_NEW_MVO_FEEDBACK, mvo, i & 0xff))
+        self.__send(pkt)
+        self.stats['telemetry'] += 1
+
+    def __send_frame(self):
+        if not self.video_enabled or self.video_addr is None:
+            return
+        frame = self.frames[self.frame % len(self.frames)]
+        number = self.frame & 0xff
+        self.frame += 1
+        chunks = (len(frame) + VIDEO_CHUNK - 1) // VIDEO_CHUNK
+        for i in range(chunks):
+            header = bytearray([number, i | (0x80 if i == chunks - 1 else 0)])
+            data = bytes(header) + frame[i * VIDEO_CHUNK:(i + 1) * VIDEO_CHUNK]
+            try:
+                self.sock.sendto(data, self.video_addr)
+            except socket.error as ex:
+                log.debug('video send: %s', str(ex))
+                return
+            self.stats['video_datagrams'] += 1
+            self.stats['video_bytes'] += len(data)
+
+
+class Simulator(object):
+    """
+    Simulator runs count SimulatedDrones on one shared IOLoop. With port 0 each drone gets a
+    port chosen by the system; otherwise drones listen on port, port + 1 and so on.
+    Addresses lists where the drones are reached, for Tello(tello_addr=...) or Fleet.add().
+    """
+
+    def __init__(self, count=1, local_ip='127.0.0.1', port=0, **kwargs):
+        self.io_loop = io_loop_module.IOLoop(name='tellopy simulator', log=log)
+        self.drones = []
+        for i in range(count):
+            self.drones.append(SimulatedDrone(self.io_loop, local_ip, port + i if port else 0,
+                                              **kwargs))
+
+    @property
+    def addresses(self):
+        return [drone.address for drone in self.drones]
+
+    def get_stats(self):
+        totals = {}
+        for drone in self.drones:
+            for key, value in drone.get_stats().items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def close(self):
+        for drone in self.drones:
+            drone.close()
+        self.io_loop.stop()
+
+    def __len__(self):
+        return len(self.drones)
+
+    def __getitem__(self, index):
+        return self.drones[index]
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    if 1 < len(sys.argv):
+        import argparse
+        parser = argparse.ArgumentParser(description='Simulate Tello drones on local UDP ports')
+        parser.add_argument('--count', type=int, default=1)
+        parser.add_argument('--ip', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8889)
+        parser.add_argument('--video', help='H.264 elementary stream to send as video')
+        args = parser.parse_args()
+        simulator = Simulator(args.count, args.ip, args.port, video_file=args.video)
+        for address in simulator.addresses:
+            print('drone at %s:%d' % address)
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass
+        simulator.close()
+        sys.exit(0)
+
+    from . fleet import Fleet
+
+    frames = split_frames(b''.join(synthetic_frames(5)))
+    assert len(frames) == 5 and frames[0].startswith(b'\x00\x00\x00\x01\x67')
+    assert frames[1].startswith(b'\x00\x00\x00\x01\x41') and len(frames[1]) == 4005
+
+    simulator = Simulator(8)
+    fleet = Fleet()
+    counts = {}
+
+    drone_data = {}
+
+    def handler(event, sender, data, **args):
+        if event is sender.EVENT_FLIGHT_DATA:
+            drone_data[id(sender)] = data
+        key = (id(sender), event)
+        counts[key] = counts.get(key, 0) + 1
+    frames = {}
+
+    def on_frame(event, sender, data, **args):
+        frames[id(sender)] = frames.get(id(sender), 0) + 1
+    for address in simulator.addresses:
+        drone = fleet.add(tello_addr=address)
+        drone.set_loglevel(drone.LOG_WARN)
+        for event in (drone.EVENT_FLIGHT_DATA, drone.EVENT_WIFI, drone.EVENT_LOG_MVO):
+            drone.subscribe(event, handler)
+        drone.subscribe(drone.EVENT_VIDEO_FRAME, on_frame)
+    fleet.connect()
+    fleet.wait_for_connection(2.0)
+    for drone in fleet:
+        drone.start_video()
+        drone.takeoff()
+    time.sleep(1.5)
+    for drone in fleet:
+        assert 10 <= counts[(id(drone), drone.EVENT_FLIGHT_DATA)], counts
+        assert 2 <= counts[(id(drone), drone.EVENT_WIFI)], counts
+        assert 3 <= counts[(id(drone), drone.EVENT_LOG_MVO)], counts
+        assert 20 <= frames[id(drone)], frames
+        assert drone.get_video_stats()['sequence_loss'] == 0
+        flight_data = drone_data[id(drone)]
+        assert flight_data.height == 12 and flight_data.battery_percentage == 99, str(flight_data)
+        stats = drone.get_command_stats()
+        assert stats['failed'] == 0 and 2 <= stats['acked'], stats
+    stats = simulator.get_stats()
+    assert stats['connected'] == 8 and stats['flying'] == 8 and stats['invalid'] == 0, stats
+    assert 8 * 20 <= stats['sticks'], stats
+    fleet.quit()
+    simulator.close()
+    print(stats)
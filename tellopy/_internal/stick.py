@@ -0,0 +1,124 @@
+import threading
+
+
+class StickScheduler(object):
+    """
+    StickScheduler calls send() at a fixed rate on a timer, which is an IOLoop or an asyncio
+    event loop. Deadlines are kept on a fixed monotonic grid, so a late callback does not
+    shift the following ones; when a whole period is missed the scheduler skips to
+    the next deadline ahead and counts the missed ones. Kick() sends at once, between ticks,
+    so a stick change does not wait for the next deadline.
+
+    Lateness of each tick against its deadline is tracked as jitter (a running mean of the
+    absolute lateness, weight 1/16 as in RFC 3550) and max_late.
+    """
+
+    def __init__(self, timer, send, rate=20.0):
+        self.timer = timer
+        self.send = send
+        self.period = 1.0 / rate
+        self.lock = threading.Lock()
+        self.handle = None
+        self.running = False
+        self.deadline = None
+        self.ticks = 0
+        self.kicks = 0
+        self.missed = 0
+        self.jitter = 0.0
+        self.max_late = 0.0
+
+    @property
+    def rate(self):
+        return 1.0 / self.period
+
+    def set_rate(self, rate):
+        """Set_rate changes the send rate in Hz; it takes effect from the next deadline."""
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.period = 1.0 / rate
+
+    def start(self):
+        self.stop()
+        self.running = True
+        self.deadline = self.timer.time()
+        self.handle = self.timer.call_at(self.deadline, self.__tick)
+
+    def stop(self):
+        self.running = False
+        handle = self.handle
+        self.handle = None
+        if handle is not None:
+            handle.cancel()
+
+    def kick(self):
+        """Kick sends immediately if the scheduler is running."""
+        if not self.running:
+            return
+        self.kicks += 1
+        self.__send()
+
+    def __send(self):
+        self.lock.acquire()
+        try:
+            self.send()
+        finally:
+            self.lock.release()
+
+    def __tick(self):
+        if not self.running:
+            return
+        now = self.timer.time()
+        late = now - self.deadline
+        self.jitter += (abs(late) - self.jitter) / 16.0
+        if self.max_late < late:
+            self.max_late = late
+        deadline = self.deadline + self.period
+        if deadline <= now:
+            skipped = int((now - deadline) / self.period) + 1
+            self.missed += skipped
+            deadline += skipped * self.period
+        self.deadline = deadline
+        self.handle = self.timer.call_at(deadline, self.__tick)
+        self.ticks += 1
+        self.__send()
+
+    def get_stats(self):
+        return {
+            'rate': self.rate,
+            'ticks': self.ticks,
+            'kicks': self.kicks,
+            'missed': self.missed,
+            'jitter': self.jitter,
+            'max_late': self.max_late,
+        }
+
+
+if __name__ == '__main__':
+    import time
+    from . io_loop import IOLoop
+
+    timer = IOLoop()
+    sent = []
+    scheduler = StickScheduler(timer, lambda: sent.append(timer.time()), rate=50.0)
+    scheduler.start()
+    time.sleep(0.5)
+    scheduler.kick()
+    time.sleep(0.5)
+    scheduler.stop()
+    stats = scheduler.get_stats()
+    print(stats)
+    assert 45 <= stats['ticks'] <= 52 and stats['kicks'] == 1
+    assert len(sent) == stats['ticks'] + 1
+    count = len(sent)
+    time.sleep(0.1)
+    assert len(sent) == count
+
+    # a blocked loop thread misses deadlines instead of sending a burst to catch up
+    scheduler = StickScheduler(timer, lambda: time.sleep(0.1), rate=50.0)
+    scheduler.start()
+    time.sleep(0.5)
+    scheduler.stop()
+    stats = scheduler.get_stats()
+    assert 15 <= stats['missed'] and stats['ticks'] <= 6, stats
+    timer.stop()
+    timer.thread.join(1.0)
@@ -1,32 +1,27 @@
 import threading
 import socket
-import time
-import datetime
-import sys
 
-from . import crc
 from . import logger
 from . import event
-from . import state
 from . import error
 from . import video_stream
+from . import buffer_pool
+from . import video_stats
+from . import io_loop as io_loop_module
+from . import clock
+from . import stick
+from . import command
+from . import delivery
+from . import recorder
 from . utils import *
 from . protocol import *
 from . import dispatcher
+from . core import TelloCore
 
 log = logger.Logger('Tello')
 
 
-class Tello(object):
-    EVENT_CONNECTED = event.Event('connected')
-    EVENT_WIFI = event.Event('wifi')
-    EVENT_LIGHT = event.Event('light')
-    EVENT_FLIGHT_DATA = event.Event('fligt_data')
-    EVENT_LOG = event.Event('log')
-    EVENT_TIME = event.Event('time')
-    EVENT_VIDEO_FRAME = event.Event('video frame')
-    EVENT_VIDEO_DATA = event.Event('video data')
-    EVENT_DISCONNECTED = event.Event('disconnected')
+class Tello(TelloCore):
     # internal events
     __EVENT_CONN_REQ = event.Event('conn_req')
     __EVENT_CONN_ACK = event.Event('conn_ack')
@@ -34,18 +29,13 @@ class Tello(object):
     __EVENT_QUIT_REQ = event.Event('quit_req')
 
     # for backward comaptibility
-    CONNECTED_EVENT = EVENT_CONNECTED
-    WIFI_EVENT = EVENT_WIFI
-    LIGHT_EVENT = EVENT_LIGHT
-    FLIGHT_EVENT = EVENT_FLIGHT_DATA
-    LOG_EVENT = EVENT_LOG
-    TIME_EVENT = EVENT_TIME
-    VIDEO_FRAME_EVENT = EVENT_VIDEO_FRAME
-
-    STATE_DISCONNECTED = state.State('disconnected')
-    STATE_CONNECTING = state.State('connecting')
-    STATE_CONNECTED = state.State('connected')
-    STATE_QUIT = state.State('quit')
+    CONNECTED_EVENT = TelloCore.EVENT_CONNECTED
+    WIFI_EVENT = TelloCore.EVENT_WIFI
+    LIGHT_EVENT = TelloCore.EVENT_LIGHT
+    FLIGHT_EVENT = TelloCore.EVENT_FLIGHT_DATA
+    LOG_EVENT = TelloCore.EVENT_LOG
+    TIME_EVENT = TelloCore.EVENT_TIME
+    VIDEO_FRAME_EVENT = TelloCore.EVENT_VIDEO_FRAME
 
     LOG_ERROR = logger.LOG_ERROR
     LOG_WARN = logger.LOG_WARN
@@ -53,37 +43,77 @@ class Tello(object):
     LOG_DEBUG = logger.LOG_DEBUG
     LOG_ALL = logger.LOG_ALL
 
-    def __init__(self, port=9000):
-        self.tello_addr = ('192.168.10.1', 8889)
+    # drop policies of subscribe(..., policy=...)
+    QUEUE_LATEST = delivery.LATEST
+    QUEUE_DROP_OLDEST = delivery.DROP_OLDEST
+    QUEUE_DROP_NEWEST = delivery.DROP_NEWEST
+
+    @property
+    def pkt_seq_num(self):
+        """Pkt_seq_num is the sequence number the next command will be sent with."""
+        return self.command_channel.seq
+
+    def __init__(self, port=9000, stick_rate=20.0, tello_addr=('192.168.10.1', 8889),
+                 video_port=6038, local_ip='', io_loop=None):
+        """
+        Port and video_port are the local UDP ports for commands and video (0 lets the system
+        choose), bound on local_ip. Tello_addr is the drone's command address. The drone runs
+        on io_loop when one is given (see Fleet) and on an IOLoop of its own otherwise; either
+        way handlers are called on the loop thread.
+        """
+        self.tello_addr = tello_addr
         self.debug = False
-        self.pkt_seq_num = 0x01e4
         self.port = port
+        self.video_port = video_port
+        self.own_io_loop = io_loop is None
+        if io_loop is None:
+            io_loop = io_loop_module.IOLoop(name='tellopy', log=log)
+        self.io_loop = io_loop
+        self.timer = io_loop
+        self.dispatcher = dispatcher.Dispatcher()
+        self.queued_receivers = []
         self.udpsize = 2000
-        self.left_x = 0.0
-        self.left_y = 0.0
-        self.right_x = 0.0
-        self.right_y = 0.0
         self.sock = None
         self.state = self.STATE_DISCONNECTED
         self.lock = threading.Lock()
         self.connected = threading.Event()
         self.video_enabled = False
-        self.prev_video_data_time = None
-        self.video_data_size = 0
-        self.video_data_loss = 0
+        self.video_stats = video_stats.VideoRxStats()
+        self.video_pool = buffer_pool.BufferPool(count=64, size=2048)
+        self.last_recv = 0.0
+        self.watchdog = None
+        self.video_refresh = None
         self.log = log
         self.exposure = 0
         self.video_encoder_rate = 4
         self.video_stream = None
+        self.recorder = None
+        self._init_core()
+        self.command_channel = command.CommandChannel(self.send_packet, self.timer, log=log)
+        self.clock = clock.ClockService(self.timer, self._send_time_command)
+        self.stick_scheduler = stick.StickScheduler(self.timer, self._send_stick_command, stick_rate)
 
-        # Create a UDP socket
+        # Create UDP sockets for commands and video
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.bind(('', self.port))
-        self.sock.settimeout(2.0)
-
-        dispatcher.connect(self.__state_machine, dispatcher.signal.All)
-        threading.Thread(target=self.__recv_thread).start()
-        threading.Thread(target=self.__video_thread).start()
+        self.sock.bind((local_ip, self.port))
+        self.port = self.sock.getsockname()[1]
+        self.video_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.video_sock.bind((local_ip, self.video_port))
+        self.video_port = self.video_sock.getsockname()[1]
+        self.video_rcvbuf = buffer_pool.ReceiveBufferSizer(self.video_sock, log=log)
+        log.info('video receive buffer size = %d', self.video_rcvbuf.size)
+        self.video_pool.track_overflow(self.video_sock)
+
+        # the state machine only needs the internal events, not telemetry or video
+        for event in (self.__EVENT_CONN_REQ, self.__EVENT_CONN_ACK, self.__EVENT_TIMEOUT,
+                      self.__EVENT_QUIT_REQ):
+            self.dispatcher.connect(self.__state_machine, event)
+        self.sock.setblocking(False)
+        self.video_sock.setblocking(False)
+        self.last_recv = self.timer.time()
+        io_loop.add_reader(self.sock, self.__on_readable)
+        io_loop.add_reader(self.video_sock, self.__on_video_readable)
+        self.watchdog = io_loop.call_later(2.0, self.__check_timeout)
 
     def set_loglevel(self, level):
         """
@@ -113,9 +143,27 @@ class Tello(object):
 
         return res
 
+    def get_video_stats(self, window=2.0):
+        """
+        Get_video_stats returns statistics of the video receive path: datagrams, receive
+        batches and the largest batch, how many wakeups left datagrams queued for the next
+        one to let commands and timers run (capped), the bitrate and loss of the last
+        window seconds, inter-arrival jitter in seconds and a histogram of the gaps between
+        datagrams. Losses are counted separately: kernel_drops are datagrams dropped by this
+        host because the socket queue overflowed (Linux only), sequence_loss are gaps in the
+        drone's packet counter, which also include anything lost on the radio link, and runts
+        are empty datagrams. The receive buffer size (rcvbuf) grows automatically after kernel drops.
+        Video_stats.history() gives the latest datagrams for closer inspection.
+        """
+        stats = self.video_pool.get_stats()
+        stats.update(self.video_stats.get_stats(window))
+        stats['rcvbuf'] = self.video_rcvbuf.size
+        stats['rcvbuf_grows'] = self.video_rcvbuf.grows
+        return stats
+
     def connect(self):
         """Connect is used to send the initial connection request to the drone."""
-        self.__publish(event=self.__EVENT_CONN_REQ)
+        self._publish(event=self.__EVENT_CONN_REQ)
 
     def wait_for_connection(self, timeout=None):
         """Wait_for_connection will block until the connection is established."""
@@ -123,349 +171,299 @@ class Tello(object):
             raise error.TelloError('timeout')
 
     def __send_conn_req(self):
-        port = 9617
-        port0 = (int(port/1000) % 10) << 4 | (int(port/100) % 10)
-        port1 = (int(port/10) % 10) << 4 | (int(port/1) % 10)
-        buf = 'conn_req:%c%c' % (chr(port0), chr(port1))
-        log.info('send connection request (cmd="%s%02x%02x")' % (str(buf[:-2]), port0, port1))
-        return self.send_packet(Packet(buf))
-
-    def subscribe(self, signal, handler):
-        """Subscribe a event such as EVENT_CONNECTED, EVENT_FLIGHT_DATA, EVENT_VIDEO_FRAME and so on."""
-        dispatcher.connect(handler, signal)
-
-    def __publish(self, event, data=None, **args):
+        pkt = conn_req_packet(self.video_port)
+        log.info('send connection request (cmd="conn_req:%02x%02x")', pkt.buf[-2], pkt.buf[-1])
+        return self.send_packet(pkt)
+
+    def subscribe(self, signal, handler, policy=None, maxsize=64):
+        """
+        Subscribe a event such as EVENT_CONNECTED, EVENT_FLIGHT_DATA, EVENT_VIDEO_FRAME and so on.
+        The data of EVENT_VIDEO_FRAME and EVENT_VIDEO_DATA is a memoryview into reused receive
+        buffers; copy it with bytes() to keep it after the handler returns. On python 3 the data
+        of EVENT_LOG, EVENT_WIFI, EVENT_LIGHT and EVENT_TIME is a memoryview into the received
+        packet too: it is only valid while the handler runs, and str() of it does not show the
+        bytes, so copy it with bytes() to keep or print it.
+
+        Handlers are called on the receive thread, which waits for them. Give a policy
+        (QUEUE_LATEST, QUEUE_DROP_OLDEST or QUEUE_DROP_NEWEST) to call the handler on a thread
+        of its own instead, through a queue of up to maxsize events that drops events by that
+        policy when the handler falls behind; the QueuedReceiver is returned so its depth and
+        drops can be watched (see also get_subscriber_stats()). Queued video data is copied.
+        """
+        if policy is None:
+            self.dispatcher.connect(handler, signal)
+            return handler
+        receiver = delivery.QueuedReceiver(handler, policy, maxsize,
+                                           name='tellopy %s' % str(signal), log=log)
+        self.queued_receivers.append((signal, receiver))
+        self.dispatcher.connect(receiver, signal)
+        return receiver
+
+    def get_subscriber_stats(self):
+        """
+        Get_subscriber_stats returns (event, stats) pairs of the handlers subscribed with a
+        policy, where stats holds the queue depth, the largest depth seen and the number of
+        events queued, delivered and dropped.
+        """
+        return [(signal, receiver.get_stats()) for signal, receiver in self.queued_receivers]
+
+    def _publish(self, event, data=None, **args):
+        if not self.dispatcher.receivers(event):
+            return
         args.update({'data': data})
         if 'signal' in args:
             del args['signal']
         if 'sender' in args:
             del args['sender']
-        log.debug('publish signal=%s, args=%s' % (event, args))
-        dispatcher.send(event, sender=self, **args)
+        log.debug('publish signal=%s, args=%s', event, args)
+        self.dispatcher.send(event, sender=self, **args)
 
     def takeoff(self):
-        """Takeoff tells the drones to liftoff and start flying."""
-        log.info('takeoff (cmd=0x%02x seq=0x%04x)' % (TAKEOFF_CMD, self.pkt_seq_num))
+        """
+        Takeoff tells the drones to liftoff and start flying. It returns a Future that
+        resolves to True when the drone acknowledges the command; the command is retransmitted
+        until then and the Future fails with TelloError if no ack arrives.
+        """
+        log.info('takeoff (cmd=0x%02x seq=0x%04x)', TAKEOFF_CMD, self.pkt_seq_num)
         pkt = Packet(TAKEOFF_CMD)
-        pkt.fixup()
-        return self.send_packet(pkt)
+        return self.__send_command(pkt, TAKEOFF_CMD)
 
     def land(self):
-        """Land tells the drone to come in for landing."""
-        log.info('land (cmd=0x%02x seq=0x%04x)' % (LAND_CMD, self.pkt_seq_num))
+        """
+        Land tells the drone to come in for landing. It returns a Future like takeoff().
+        """
+        log.info('land (cmd=0x%02x seq=0x%04x)', LAND_CMD, self.pkt_seq_num)
         pkt = Packet(LAND_CMD)
         pkt.add_byte(0x00)
-        pkt.fixup()
-        return self.send_packet(pkt)
+        return self.__send_command(pkt, LAND_CMD)
 
     def quit(self):
         """Quit stops the internal threads."""
         log.info('quit')
-        self.__publish(event=self.__EVENT_QUIT_REQ)
-
-    def __send_time_command(self):
-        log.info('send_time (cmd=0x%02x seq=0x%04x)' % (TIME_CMD, self.pkt_seq_num))
-        pkt = Packet(TIME_CMD, 0x50)
-        pkt.add_byte(0)
-        pkt.add_time()
-        pkt.fixup()
-        return self.send_packet(pkt)
-
-    def __send_start_video(self):
+        self._publish(event=self.__EVENT_QUIT_REQ)
+        self.clock.stop()
+        self.stick_scheduler.stop()
+        self.command_channel.close()
+        self.watchdog.cancel()
+        self.io_loop.remove_reader(self.sock, close=True)
+        self.io_loop.remove_reader(self.video_sock, close=True)
+        # the queued handlers see the disconnected event published above, then finish
+        for signal, receiver in self.queued_receivers:
+            receiver.close(timeout=0)
+        self.stop_recording()
+        if self.own_io_loop:
+            # stops once the sockets are closed, and returns once the loop thread is gone so
+            # it does not run into interpreter exit
+            self.io_loop.stop()
+
+    def start_recording(self, path, **kwargs):
+        """
+        Start_recording records every command and video datagram sent or received to the
+        file at path until stop_recording() or quit(), and returns the Recorder. Datagrams are
+        written by a thread of its own; read the file with recorder.RecordingReader.
+        """
+        self.stop_recording()
+        self.recorder = recorder.Recorder(path, **kwargs)
+        log.info('recording to %s', path)
+        return self.recorder
+
+    def stop_recording(self):
+        """Stop_recording stops recording and completes the file."""
+        rec = self.recorder
+        if rec is not None:
+            self.recorder = None
+            rec.close()
+            log.info('recorded %d datagrams (%d dropped)', rec.records, rec.dropped)
+
+    def set_stick_rate(self, rate):
+        """Set_stick_rate sets how many stick commands are sent per second (20 by default)."""
+        self.stick_scheduler.set_rate(rate)
+
+    def __send_start_video(self, ack=True):
         pkt = Packet(VIDEO_START_CMD, 0x60)
-        pkt.fixup()
-        return self.send_packet(pkt)
+        return self.__send_command(pkt, VIDEO_START_CMD, ack)
 
     def start_video(self):
         """Start_video tells the drone to send start info (SPS/PPS) for video stream."""
-        log.info('start video (cmd=0x%02x seq=0x%04x)' % (VIDEO_START_CMD, self.pkt_seq_num))
+        log.info('start video (cmd=0x%02x seq=0x%04x)', VIDEO_START_CMD, self.pkt_seq_num)
         self.video_enabled = True
         self.__send_exposure()
         self.__send_video_encoder_rate()
         return self.__send_start_video()
 
     def set_exposure(self, level):
-        """Set_exposure sets the drone camera exposure level. Valid levels are 0, 1, and 2."""
+        """
+        Set_exposure sets the drone camera exposure level. Valid levels are 0, 1, and 2.
+        It returns a Future like takeoff().
+        """
         if level < 0 or 2 < level:
             raise error.TelloError('Invalid exposure level')
-        log.info('set exposure (cmd=0x%02x seq=0x%04x)' % (EXPOSURE_CMD, self.pkt_seq_num))
+        log.info('set exposure (cmd=0x%02x seq=0x%04x)', EXPOSURE_CMD, self.pkt_seq_num)
         self.exposure = level
         return self.__send_exposure()
 
     def __send_exposure(self):
         pkt = Packet(EXPOSURE_CMD, 0x48)
         pkt.add_byte(self.exposure)
-        pkt.fixup()
-        return self.send_packet(pkt)
+        return self.__send_command(pkt, EXPOSURE_CMD)
 
     def set_video_encoder_rate(self, rate):
-        """Set_video_encoder_rate sets the drone video encoder rate."""
-        log.info('set video encoder rate (cmd=0x%02x seq=%04x)' %
-                 (VIDEO_ENCODER_RATE_CMD, self.pkt_seq_num))
+        """Set_video_encoder_rate sets the drone video encoder rate. It returns a Future like takeoff()."""
+        log.info('set video encoder rate (cmd=0x%02x seq=%04x)',
+                 VIDEO_ENCODER_RATE_CMD, self.pkt_seq_num)
         self.video_encoder_rate = rate
         return self.__send_video_encoder_rate()
 
     def __send_video_encoder_rate(self):
         pkt = Packet(VIDEO_ENCODER_RATE_CMD, 0x68)
         pkt.add_byte(self.video_encoder_rate)
-        pkt.fixup()
-        return self.send_packet(pkt)
+        return self.__send_command(pkt, VIDEO_ENCODER_RATE_CMD)
 
     def up(self, val):
         """Up tells the drone to ascend. Pass in an int from 0-100."""
-        log.info('up(val=%d)' % val)
+        log.info('up(val=%d)', val)
         self.left_y = val / 100.0
+        self.stick_scheduler.kick()
 
     def down(self, val):
         """Down tells the drone to descend. Pass in an int from 0-100."""
-        log.info('down(val=%d)' % val)
+        log.info('down(val=%d)', val)
         self.left_y = val / 100.0 * -1
+        self.stick_scheduler.kick()
 
     def forward(self, val):
         """Forward tells the drone to go forward. Pass in an int from 0-100."""
-        log.info('forward(val=%d)' % val)
+        log.info('forward(val=%d)', val)
         self.right_y = val / 100.0
+        self.stick_scheduler.kick()
 
     def backward(self, val):
         """Backward tells the drone to go in reverse. Pass in an int from 0-100."""
-        log.info('backward(val=%d)' % val)
+        log.info('backward(val=%d)', val)
         self.right_y = val / 100.0 * -1
+        self.stick_scheduler.kick()
 
     def right(self, val):
         """Right tells the drone to go right. Pass in an int from 0-100."""
-        log.info('right(val=%d)' % val)
+        log.info('right(val=%d)', val)
         self.right_x = val / 100.0
+        self.stick_scheduler.kick()
 
     def left(self, val):
         """Left tells the drone to go left. Pass in an int from 0-100."""
-        log.info('left(val=%d)' % val)
+        log.info('left(val=%d)', val)
         self.right_x = val / 100.0 * -1
+        self.stick_scheduler.kick()
 
     def clockwise(self, val):
         """
         Clockwise tells the drone to rotate in a clockwise direction.
         Pass in an int from 0-100.
         """
-        log.info('clockwise(val=%d)' % val)
+        log.info('clockwise(val=%d)', val)
         self.left_x = val / 100.0
+        self.stick_scheduler.kick()
 
     def counter_clockwise(self, val):
         """
         CounterClockwise tells the drone to rotate in a counter-clockwise direction.
         Pass in an int from 0-100.
         """
-        log.info('counter_clockwise(val=%d)' % val)
+        log.info('counter_clockwise(val=%d)', val)
         self.left_x = val / 100.0 * -1
+        self.stick_scheduler.kick()
 
     def flip_forward(self):
         """flip_forward tells the drone to perform a forwards flip"""
-        log.info('flip_forward (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, self.pkt_seq_num))
+        log.info('flip_forward (cmd=0x%02x seq=0x%04x)', FLIP_CMD, self.pkt_seq_num)
         pkt = Packet(FLIP_CMD, 0x70)
         pkt.add_byte(FlipFront)
-        pkt.fixup()
-        return self.send_packet(pkt)
+        return self.__send_command(pkt, FLIP_CMD, retransmit=False)
 		
     def flip_back(self):
         """flip_back tells the drone to perform a backwards flip"""
-        log.info('flip_back (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, self.pkt_seq_num))
+        log.info('flip_back (cmd=0x%02x seq=0x%04x)', FLIP_CMD, self.pkt_seq_num)
         pkt = Packet(FLIP_CMD, 0x70)
         pkt.add_byte(FlipBack)
-        pkt.fixup()
-        return self.send_packet(pkt)
+        return self.__send_command(pkt, FLIP_CMD, retransmit=False)
 		
     def flip_right(self):
         """flip_right tells the drone to perform a right flip"""
-        log.info('flip_right (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, self.pkt_seq_num))
+        log.info('flip_right (cmd=0x%02x seq=0x%04x)', FLIP_CMD, self.pkt_seq_num)
         pkt = Packet(FLIP_CMD, 0x70)
         pkt.add_byte(FlipRight)
-        pkt.fixup()
-        return self.send_packet(pkt)
+        return self.__send_command(pkt, FLIP_CMD, retransmit=False)
 
     def flip_left(self):
         """flip_left tells the drone to perform a left flip"""
-        log.info('flip_left (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, self.pkt_seq_num))
+        log.info('flip_left (cmd=0x%02x seq=0x%04x)', FLIP_CMD, self.pkt_seq_num)
         pkt = Packet(FLIP_CMD, 0x70)
         pkt.add_byte(FlipLeft)
-        pkt.fixup()
-        return self.send_packet(pkt)
+        return self.__send_command(pkt, FLIP_CMD, retransmit=False)
 
     def flip_forwardleft(self):
         """flip_forwardleft tells the drone to perform a forwards left flip"""
-        log.info('flip_forwardleft (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, self.pkt_seq_num))
+        log.info('flip_forwardleft (cmd=0x%02x seq=0x%04x)', FLIP_CMD, self.pkt_seq_num)
         pkt = Packet(FLIP_CMD, 0x70)
         pkt.add_byte(FlipForwardLeft)
-        pkt.fixup()
-        return self.send_packet(pkt)
+        return self.__send_command(pkt, FLIP_CMD, retransmit=False)
 
     def flip_backleft(self):
         """flip_backleft tells the drone to perform a backwards left flip"""
-        log.info('flip_backleft (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, self.pkt_seq_num))
+        log.info('flip_backleft (cmd=0x%02x seq=0x%04x)', FLIP_CMD, self.pkt_seq_num)
         pkt = Packet(FLIP_CMD, 0x70)
         pkt.add_byte(FlipBackLeft)
-        pkt.fixup()
-        return self.send_packet(pkt)
+        return self.__send_command(pkt, FLIP_CMD, retransmit=False)
 
     def flip_forwardright(self):
         """flip_forwardright tells the drone to perform a forwards right flip"""
-        log.info('flip_forwardright (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, self.pkt_seq_num))
+        log.info('flip_forwardright (cmd=0x%02x seq=0x%04x)', FLIP_CMD, self.pkt_seq_num)
         pkt = Packet(FLIP_CMD, 0x70)
         pkt.add_byte(FlipForwardRight)
-        pkt.fixup()
-        return self.send_packet(pkt)
+        return self.__send_command(pkt, FLIP_CMD, retransmit=False)
 
     def flip_backright(self):
-        """flip_backleft tells the drone to perform a backwards right flip"""
-        log.info('flip_backright (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, self.pkt_seq_num))
+        """flip_backright tells the drone to perform a backwards right flip"""
+        log.info('flip_backright (cmd=0x%02x seq=0x%04x)', FLIP_CMD, self.pkt_seq_num)
         pkt = Packet(FLIP_CMD, 0x70)
-        pkt.add_byte(FlipBackLeft)
-        pkt.fixup()
-        return self.send_packet(pkt)
-
-    def __fix_range(self, val, min=-1.0, max=1.0):
-        if val < min:
-            val = min
-        elif val > max:
-            val = max
-        return val
+        pkt.add_byte(FlipBackRight)
+        return self.__send_command(pkt, FLIP_CMD, retransmit=False)
 
-    def set_throttle(self, throttle):
-        """
-        Set_throttle controls the vertical up and down motion of the drone.
-        Pass in an int from -1.0 ~ 1.0. (positive value means upward)
-        """
-        if self.left_y != self.__fix_range(throttle):
-            log.info('set_throttle(val=%4.2f)' % throttle)
-        self.left_y = self.__fix_range(throttle)
-
-    def set_yaw(self, yaw):
-        """
-        Set_yaw controls the left and right rotation of the drone.
-        Pass in an int from -1.0 ~ 1.0. (positive value will make the drone turn to the right)
-        """
-        if self.left_x != self.__fix_range(yaw):
-            log.info('set_yaw(val=%4.2f)' % yaw)
-        self.left_x = self.__fix_range(yaw)
-
-    def set_pitch(self, pitch):
-        """
-        Set_pitch controls the forward and backward tilt of the drone.
-        Pass in an int from -1.0 ~ 1.0. (positive value will make the drone move forward)
-        """
-        if self.right_y != self.__fix_range(pitch):
-            log.info('set_pitch(val=%4.2f)' % pitch)
-        self.right_y = self.__fix_range(pitch)
-
-    def set_roll(self, roll):
-        """
-        Set_roll controls the the side to side tilt of the drone.
-        Pass in an int from -1.0 ~ 1.0. (positive value will make the drone move to the right)
-        """
-        if self.right_x != self.__fix_range(roll):
-            log.info('set_roll(val=%4.2f)' % roll)
-        self.right_x = self.__fix_range(roll)
-
-    def __send_stick_command(self):
-        pkt = Packet(STICK_CMD, 0x60)
-
-        axis1 = int(1024 + 660.0 * self.right_x) & 0x7ff
-        axis2 = int(1024 + 660.0 * self.right_y) & 0x7ff
-        axis3 = int(1024 + 660.0 * self.left_y) & 0x7ff
-        axis4 = int(1024 + 660.0 * self.left_x) & 0x7ff
-        '''
-        11 bits (-1024 ~ +1023) x 4 axis = 44 bits
-        44 bits will be packed in to 6 bytes (48 bits)
-
-                    axis4      axis3      axis2      axis1
-             |          |          |          |          |
-                 4         3         2         1         0
-        98765432109876543210987654321098765432109876543210
-         |       |       |       |       |       |       |
-             byte5   byte4   byte3   byte2   byte1   byte0
-        '''
-        log.debug("stick command: yaw=%4d thr=%4d pit=%4d rol=%4d" %
-                  (axis4, axis3, axis2, axis1))
-        log.debug("stick command: yaw=%04x thr=%04x pit=%04x rol=%04x" %
-                  (axis4, axis3, axis2, axis1))
-        pkt.add_byte(((axis2 << 11 | axis1) >> 0) & 0xff)
-        pkt.add_byte(((axis2 << 11 | axis1) >> 8) & 0xff)
-        pkt.add_byte(((axis3 << 11 | axis2) >> 5) & 0xff)
-        pkt.add_byte(((axis4 << 11 | axis3) >> 2) & 0xff)
-        pkt.add_byte(((axis4 << 11 | axis3) >> 10) & 0xff)
-        pkt.add_byte(((axis4 << 11 | axis3) >> 18) & 0xff)
-        pkt.add_time()
-        pkt.fixup()
-        log.debug("stick command: %s" % byte_to_hexstring(pkt.get_buffer()))
-        return self.send_packet(pkt)
+    def __send_command(self, pkt, cmd, ack=True, retransmit=True):
+        return self.command_channel.submit(pkt, cmd, ack, retransmit)
 
     def send_packet(self, pkt):
         """Send_packet is used to send a command packet to the drone."""
         try:
             cmd = pkt.get_buffer()
             self.sock.sendto(cmd, self.tello_addr)
-            log.debug("send_packet: %s" % byte_to_hexstring(cmd))
+            rec = self.recorder
+            if rec is not None:
+                rec.record(recorder.CHANNEL_COMMAND, recorder.DIRECTION_OUT, cmd)
+            if log.is_enabled(logger.LOG_DEBUG):
+                log.debug("send_packet: %s", byte_to_hexstring(cmd))
         except socket.error as err:
             if self.state == self.STATE_CONNECTED:
-                log.error("send_packet: %s" % str(err))
+                log.error("send_packet: %s", str(err))
             else:
-                log.info("send_packet: %s" % str(err))
+                log.info("send_packet: %s", str(err))
             return False
 
         return True
 
-    def __process_packet(self, data):
-        if isinstance(data, str):
-            data = bytearray([x for x in data])
-
-        if str(data[0:9]) == 'conn_ack:' or data[0:9] == b'conn_ack:':
-            log.info('connected. (port=%2x%2x)' % (data[9], data[10]))
-            log.debug('    %s' % byte_to_hexstring(data))
-            if self.video_enabled:
-                self.__send_exposure()
-                self.__send_video_encoder_rate()
-                self.__send_start_video()
-            self.__publish(self.__EVENT_CONN_ACK, data)
-
-            return True
-
-        if data[0] != START_OF_PACKET:
-            log.info('start of packet != %02x (%02x) (ignored)' % (START_OF_PACKET, data[0]))
-            log.info('    %s' % byte_to_hexstring(data))
-            log.info('    %s' % str(map(chr, data))[1:-1])
-            return False
-
-        pkt = Packet(data)
-        cmd = int16(data[5], data[6])
-        if cmd == LOG_MSG:
-            log.debug("recv: log: %s" % byte_to_hexstring(data[9:]))
-            self.__publish(event=self.EVENT_LOG, data=data[9:])
-        elif cmd == WIFI_MSG:
-            log.debug("recv: wifi: %s" % byte_to_hexstring(data[9:]))
-            self.__publish(event=self.EVENT_WIFI, data=data[9:])
-        elif cmd == LIGHT_MSG:
-            log.debug("recv: light: %s" % byte_to_hexstring(data[9:]))
-            self.__publish(event=self.EVENT_LIGHT, data=data[9:])
-        elif cmd == FLIGHT_MSG:
-            flight_data = FlightData(data[9:])
-            log.debug("recv: flight data: %s" % str(flight_data))
-            self.__publish(event=self.EVENT_FLIGHT_DATA, data=flight_data)
-        elif cmd == TIME_CMD:
-            log.debug("recv: time data: %s" % byte_to_hexstring(data))
-            self.__publish(event=self.EVENT_TIME, data=data[7:9])
-        elif (TAKEOFF_CMD, LAND_CMD, VIDEO_START_CMD, VIDEO_ENCODER_RATE_CMD):
-            log.info("recv: ack: cmd=0x%02x seq=0x%04x %s" %
-                     (int16(data[5], data[6]), int16(data[7], data[8]), byte_to_hexstring(data)))
-        else:
-            log.info('unknown packet: %s' % byte_to_hexstring(data))
-            return False
-
-        return True
+    def _connection_acked(self, data):
+        if self.video_enabled:
+            self.__send_exposure()
+            self.__send_video_encoder_rate()
+            self.__send_start_video()
+        self._publish(self.__EVENT_CONN_ACK, data)
 
     def __state_machine(self, event, sender, data, **args):
         self.lock.acquire()
         cur_state = self.state
         event_connected = False
         event_disconnected = False
-        log.debug('event %s in state %s' % (str(event), str(self.state)))
+        log.debug('event %s in state %s', event, self.state)
 
         if self.state == self.STATE_DISCONNECTED:
             if event == self.__EVENT_CONN_REQ:
@@ -480,8 +478,10 @@ class Tello(object):
             if event == self.__EVENT_CONN_ACK:
                 self.state = self.STATE_CONNECTED
                 event_connected = True
-                # send time
-                self.__send_time_command()
+                # send time now and then periodically to measure the link
+                self.clock.start()
+                self.stick_scheduler.start()
+                self.video_refresh = self.timer.call_later(2.0, self.__refresh_video)
             elif event == self.__EVENT_TIMEOUT:
                 self.__send_conn_req()
             elif event == self.__EVENT_QUIT_REQ:
@@ -502,129 +502,103 @@ class Tello(object):
             pass
 
         if cur_state != self.state:
-            log.info('state transit %s -> %s' % (cur_state, self.state))
+            log.info('state transit %s -> %s', cur_state, self.state)
         self.lock.release()
 
         if event_connected:
-            self.__publish(event=self.EVENT_CONNECTED, **args)
+            self._publish(event=self.EVENT_CONNECTED, **args)
             self.connected.set()
         if event_disconnected:
-            self.__publish(event=self.EVENT_DISCONNECTED, **args)
+            self.clock.stop()
+            self.stick_scheduler.stop()
+            if self.video_refresh is not None:
+                self.video_refresh.cancel()
+            self._publish(event=self.EVENT_DISCONNECTED, **args)
             self.connected.clear()
 
-    def __recv_thread(self):
-        sock = self.sock
-
-        while self.state != self.STATE_QUIT:
+    def __on_readable(self, sock):
+        try:
+            data = sock.recv(self.udpsize)
+        except socket.error as ex:
+            log.info('recv: %s', str(ex))
+            return
+        self.receive_packet(data)
 
+    def receive_packet(self, data):
+        """
+        Receive_packet processes data as if it had been received on the command socket. It must
+        be called on the I/O loop thread (see IOLoop.call_soon), as replay.Replayer does to
+        inject recorded packets without a socket.
+        """
+        self.last_recv = self.timer.time()
+        rec = self.recorder
+        if rec is not None:
+            rec.record(recorder.CHANNEL_COMMAND, recorder.DIRECTION_IN, data)
+        if log.is_enabled(logger.LOG_DEBUG):
+            log.debug("recv: %s", byte_to_hexstring(data))
+        self._process_packet(data)
+
+    def __on_video_readable(self, sock):
+        # drain everything queued; the handlers see memoryviews into the pool
+        pool = self.video_pool
+        kernel_drops = pool.kernel_drops
+        try:
+            pool.drain(sock, self.__process_video if self.video_enabled else None)
+        except socket.error as ex:
+            log.info('video recv: %s', str(ex))
+        if kernel_drops != pool.kernel_drops:
+            # we are not reading fast enough for the queue we have; make it longer
+            log.limited(logger.LOG_WARN, 1.0, 'video recv: %d datagrams dropped by the kernel',
+                        pool.kernel_drops - kernel_drops)
+            self.video_rcvbuf.grow()
+
+    def __check_timeout(self):
+        # fires 2 seconds after the last received packet, so a busy link costs no wakeups
+        if self.state == self.STATE_QUIT:
+            return
+        now = self.timer.time()
+        elapsed = now - self.last_recv
+        if 2.0 <= elapsed:
+            self.last_recv = now
+            elapsed = 0.0
             if self.state == self.STATE_CONNECTED:
-                self.__send_stick_command()  # ignore errors
-
-            try:
-                data, server = sock.recvfrom(self.udpsize)
-                log.debug("recv: %s" % byte_to_hexstring(data))
-                self.__process_packet(data)
-            except socket.timeout as ex:
-                if self.state == self.STATE_CONNECTED:
-                    log.error('recv: timeout')
-                self.__publish(event=self.__EVENT_TIMEOUT)
-            except Exception as ex:
-                log.error('recv: %s' % str(ex))
-                show_exception(ex)
-
-        log.info('exit from the recv thread.')
-
-    def __video_thread(self):
-        log.info('start video thread')
-        # Create a UDP socket
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        port = 6038
-        sock.bind(('', port))
-        sock.settimeout(5.0)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 512 * 1024)
-        log.info('video receive buffer size = %d' %
-                 sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF))
-
-        prev_header = None
-        prev_ts = None
-        history = []
-        while self.state != self.STATE_QUIT:
-            if not self.video_enabled:
-                time.sleep(1.0)
-                continue
-            try:
-                data, server = sock.recvfrom(self.udpsize)
-                now = datetime.datetime.now()
-                log.debug("video recv: %s %d bytes" % (byte_to_hexstring(data[0:2]), len(data)))
-                show_history = False
-
-                # check video data loss
-                header = byte(data[0])
-                if (prev_header is not None and
-                    header != prev_header and
-                    header != ((prev_header + 1) & 0xff)):
-                    loss = header - prev_header
-                    if loss < 0:
-                        loss = loss + 256
-                    self.video_data_loss += loss
-                    #
-                    # enable this line to see packet history
-                    # show_history = True
-                    #
-                prev_header = header
-
-                # check video data interval
-                if prev_ts is not None and 0.1 < (now - prev_ts).total_seconds():
-                    log.info('video recv: %d bytes %02x%02x +%03d' %
-                             (len(data), byte(data[0]), byte(data[1]),
-                              (now - prev_ts).total_seconds() * 1000))
-                prev_ts = now
-
-                # save video data history
-                history.append([now, len(data), byte(data[0])*256 + byte(data[1])])
-                if 100 < len(history):
-                    history = history[1:]
-
-                # show video data history
-                if show_history:
-                    prev_ts = history[0][0]
-                    for i in range(1, len(history)):
-                        [ ts, sz, sn ] = history[i]
-                        print('    %02d:%02d:%02d.%03d %4d bytes %04x +%03d%s' %
-                              (ts.hour, ts.minute, ts.second, ts.microsecond/1000,
-                               sz, sn, (ts - prev_ts).total_seconds()*1000,
-                               (' *' if i == len(history) - 1 else '')))
-                        prev_ts = ts
-                    history = history[-1:]
-
-                # deliver video frame to subscribers
-                self.__publish(event=self.EVENT_VIDEO_FRAME, data=data[2:])
-                self.__publish(event=self.EVENT_VIDEO_DATA, data=data)
-
-                # show video frame statistics
-                if self.prev_video_data_time is None:
-                    self.prev_video_data_time = now
-                self.video_data_size += len(data)
-                dur = (now - self.prev_video_data_time).total_seconds()
-                if 2.0 < dur:
-                    log.info(('video data %d bytes %5.1fKB/sec' %
-                              (self.video_data_size, self.video_data_size / dur / 1024)) +
-                             ((' loss=%d' % self.video_data_loss) if self.video_data_loss != 0 else ''))
-                    self.video_data_size = 0
-                    self.prev_video_data_time = now
-                    self.video_data_loss = 0
-
-                    # keep sending start video command
-                    self.__send_start_video()
-
-            except socket.timeout as ex:
-                log.error('video recv: timeout')
-                data = None
-            except Exception as ex:
-                log.error('video recv: %s' % str(ex))
-                show_exception(ex)
-
-        log.info('exit from the video thread.')
+                log.error('recv: timeout')
+            self._publish(event=self.__EVENT_TIMEOUT)
+        self.watchdog = self.timer.call_later(2.0 - elapsed, self.__check_timeout)
+
+    def __refresh_video(self):
+        # the drone sends key frames only on request, so keep asking while video is enabled
+        if self.state != self.STATE_CONNECTED:
+            return
+        self.video_refresh = self.timer.call_later(2.0, self.__refresh_video)
+        if self.video_enabled:
+            self.__send_start_video(ack=False)
+
+    def receive_video(self, data):
+        """
+        Receive_video processes data as if it had been received on the video socket. Like
+        receive_packet(), it must be called on the I/O loop thread.
+        """
+        if self.video_enabled:
+            self.__process_video(byte_view(data))
+
+    def __process_video(self, data):
+        if log.is_enabled(logger.LOG_DEBUG):
+            log.debug("video recv: %s %d bytes", byte_to_hexstring(data[0:2]), len(data))
+        self.video_stats.add(data)
+        rec = self.recorder
+        if rec is not None:
+            rec.record(recorder.CHANNEL_VIDEO, recorder.DIRECTION_IN, data)
+
+        # deliver video frame to subscribers, if there are any
+        receivers = self.dispatcher.receivers(self.EVENT_VIDEO_FRAME)
+        if receivers:
+            frame = data[2:]
+            for receiver in receivers:
+                receiver(event=self.EVENT_VIDEO_FRAME, sender=self, data=frame)
+        receivers = self.dispatcher.receivers(self.EVENT_VIDEO_DATA)
+        for receiver in receivers:
+            receiver(event=self.EVENT_VIDEO_DATA, sender=self, data=data)
 
 if __name__ == '__main__':
     print('You can use test.py for testing.')
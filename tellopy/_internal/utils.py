@@ -1,4 +1,6 @@
+import binascii
 import sys
+import time
 import traceback
 
 
@@ -8,6 +10,17 @@ def byte(c):
     return c
 
 
+def byte_view(data):
+    """Byte_view returns data as a sequence of ints, without copying where possible."""
+    return data if isinstance(data, memoryview) else memoryview(data)
+
+
+if str is bytes:
+    # the items of a memoryview are 1 byte strings in python 2, so a copy is used there
+    def byte_view(data):
+        return data if isinstance(data, bytearray) else bytearray(data)
+
+
 def le16(val):
     return (val & 0xff), ((val >> 8) & 0xff)
 
@@ -16,11 +29,28 @@ def int16(val0, val1):
     return (val0 & 0xff) | ((val1 & 0xff) << 8)
 
 
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    # python 2 has no monotonic clock, so timers follow the wall clock there
+    monotonic = time.time
+
+
+try:
+    # python 3.8 and later format with a separator in one call
+    bytes().hex(' ')
+    hex_separator = True
+except (AttributeError, TypeError):
+    hex_separator = False
+
+
 def byte_to_hexstring(buf):
     if isinstance(buf, str):
-        return ''.join(["%02x " % ord(x) for x in buf]).strip()
-
-    return ''.join(["%02x " % ord(chr(x)) for x in buf]).strip()
+        buf = bytearray([ord(x) for x in buf])
+    if hex_separator:
+        return memoryview(buf).hex(' ')
+    hexstring = binascii.hexlify(buf).decode('ascii')
+    return ' '.join([hexstring[i:i + 2] for i in range(0, len(hexstring), 2)])
 
 
 def show_exception(ex):
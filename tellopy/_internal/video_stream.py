@@ -24,16 +24,16 @@ class VideoStream(object):
         finally:
             self.cond.release()
         # returning data of zero length indicates end of stream
-        self.log.debug('%s.read(size=%d) = %d' % (self.__class__, size, len(data)))
+        self.log.debug('%s.read(size=%d) = %d', self.__class__, size, len(data))
         return data
 
     def seek(self, offset, whence):
-        self.log.info('%s.seek(%d, %d)' % (str(self.__class__), offset, whence))
+        self.log.info('%s.seek(%d, %d)', str(self.__class__), offset, whence)
         return -1
 
     def __handle_event(self, event, sender, data):
         if event is self.drone.EVENT_CONNECTED:
-            self.log.info('%s.handle_event(CONNECTED)' % (self.__class__))
+            self.log.info('%s.handle_event(CONNECTED)', self.__class__)
         elif event is self.drone.EVENT_DISCONNECTED:
             print('%s.handle_event(DISCONNECTED)' % (self.__class__))
             self.cond.acquire()
@@ -42,8 +42,9 @@ class VideoStream(object):
             self.cond.notifyAll()
             self.cond.release()
         elif event is self.drone.EVENT_VIDEO_DATA:
-            self.log.debug('%s.handle_event(VIDEO_DATA, size=%d)' % (self.__class__, len(data)))
+            self.log.debug('%s.handle_event(VIDEO_DATA, size=%d)', self.__class__, len(data))
             self.cond.acquire()
-            self.queue.append(data[2:])
+            # data is a view into the receive buffers, which are reused once this returns
+            self.queue.append(bytes(data[2:]))
             self.cond.notifyAll()
             self.cond.release()
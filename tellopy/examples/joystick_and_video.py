@@ -165,8 +165,9 @@ def main():
     drone = tellopy.Tello()
     drone.connect()
     drone.start_video()
-    drone.subscribe(drone.EVENT_FLIGHT_DATA, handler)
-    drone.subscribe(drone.EVENT_VIDEO_FRAME, handler)
+    # writing to mplayer may block, so let the handler run off the receive thread
+    drone.subscribe(drone.EVENT_FLIGHT_DATA, handler, policy=drone.QUEUE_LATEST)
+    drone.subscribe(drone.EVENT_VIDEO_FRAME, handler, policy=drone.QUEUE_DROP_OLDEST, maxsize=256)
     speed = 100
     throttle = 0.0
     yaw = 0.0
@@ -0,0 +1,314 @@
+"""
+Benchmarks of the protocol, dispatch and video paths, and end-to-end runs against the
+local simulator. No drone is needed.
+
+    python tests/benchmark.py                  # everything, as a table
+    python tests/benchmark.py --only micro     # microbenchmarks only
+    python tests/benchmark.py --json out.json  # also write the results as JSON
+    python tests/benchmark.py --json -         # JSON on stdout, the table on stderr
+
+Compare two JSON files with --compare old.json new.json to see the change of each result.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import timeit
+
+# run from a checkout without installing, like tests/test.bash does with PYTHONPATH
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import tellopy
+from tellopy._internal import crc
+from tellopy._internal import dispatcher
+from tellopy._internal import event
+from tellopy._internal import log_data
+from tellopy._internal import logger
+from tellopy._internal import recorder
+from tellopy._internal import replay
+from tellopy._internal import simulator
+from tellopy._internal import video_stats
+from tellopy._internal.protocol import *
+from tellopy._internal.utils import *
+
+results = []
+
+# cpu time of the process; python 2 only has time.clock()
+process_time = getattr(time, 'process_time', None) or time.clock
+
+
+def report(group, name, value, unit, **extra):
+    result = {'group': group, 'name': name, 'value': value, 'unit': unit}
+    result.update(extra)
+    results.append(result)
+    print('%-6s %-44s %12.3f %s' % (group, name, value, unit))
+
+
+def bench(name, func, min_time=0.2, repeat=3):
+    """Bench reports the best of repeat runs of func, each taking at least min_time, in usec."""
+    number = 1
+    while True:
+        elapsed = timeit.timeit(func, number=number)
+        if min_time <= elapsed:
+            break
+        number *= 2 if min_time / 10 < elapsed else 10
+    best = elapsed
+    for i in range(repeat - 1):
+        best = min(best, timeit.timeit(func, number=number))
+    report('micro', name, best / number * 1e6, 'usec', number=number)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def micro(args):
+    for n in (3, 22, 1460):
+        buf = bytearray(os.urandom(n))
+        bench('crc8(%d bytes)' % n, lambda: crc.crc8(buf))
+        bench('crc16(%d bytes)' % n, lambda: crc.crc16(buf))
+
+    def takeoff_packet():
+        pkt = Packet(TAKEOFF_CMD)
+        pkt.fixup(0x1e4)
+        return pkt
+    bench('Packet(TAKEOFF_CMD) + fixup', takeoff_packet)
+
+    def time_packet():
+        pkt = Packet(TIME_CMD, 0x50)
+        pkt.add_byte(0)
+        pkt.add_time()
+        pkt.fixup(0x1e4)
+        return pkt
+    bench('Packet(TIME_CMD) + add_time + fixup', time_packet)
+
+    encoder = StickEncoder()
+    bench('StickEncoder.encode', lambda: encoder.encode(0.1, -0.2, 0.3, -0.4))
+
+    flight = Packet(FLIGHT_MSG, 0x48)
+    flight.buf.extend(os.urandom(24))
+    flight.fixup()
+    flight_data = bytes(flight.get_buffer())
+    validator = PacketValidator()
+    bench('PacketValidator.check(FLIGHT_MSG)', lambda: validator.check(flight_data))
+    bench('PacketView + decode_flight_data', lambda: decode_flight_data(PacketView(flight_data)))
+    bench('str(FlightData)', lambda: str(decode_flight_data(PacketView(flight_data))))
+
+    stream = b''
+    for i in range(10):
+        body = bytearray(log_data.LogDecoder.IMU_OFFSET - log_data.RECORD_HEADER_SIZE)
+        body += log_data.LogDecoder.IMU_FORMAT.pack(*[float(k) for k in range(13)])
+        stream += log_data.encode_record(log_data.ID_IMU_ATTI, body, i)
+    decoder = log_data.LogDecoder()
+    bench('LogDecoder.feed(10 IMU records)', lambda: decoder.feed(stream, 0.0))
+
+    sig = event.Event('bench')
+    other = event.Event('other')
+    for count in (0, 1, 4, 16):
+        d = dispatcher.Dispatcher()
+        for i in range(count):
+            d.connect(lambda event, sender, data: None, sig)
+        d.connect(lambda event, sender, data: None, other)
+        bench('Dispatcher.send to %d receivers' % count, lambda: d.send(sig, sender=None, data=1))
+
+    stats = video_stats.VideoRxStats()
+    datagram = bytearray(1462)
+    bench('VideoRxStats.add', lambda: stats.add(datagram))
+
+    log = logger.Logger('bench')
+    bench('disabled log.debug with an argument', lambda: log.debug('recv: %s', datagram))
+    bench('byte_to_hexstring(22 bytes)', lambda: byte_to_hexstring(flight_data))
+
+    # VideoStream as mplayer or PyAV use it: one datagram in, read in large blocks
+    drone = tellopy.Tello(port=0, video_port=0)
+    drone.set_loglevel(drone.LOG_WARN)
+    drone.video_enabled = True
+    from tellopy._internal.video_stream import VideoStream
+    stream = VideoStream(drone)
+    view = memoryview(bytearray(1462))
+
+    def video_stream_read():
+        for i in range(32):
+            drone.dispatcher.send(drone.EVENT_VIDEO_DATA, sender=drone, data=view)
+        stream.read(32 * 1460 + 1)
+    number = 200
+    elapsed = timeit.timeit(video_stream_read, number=number)
+    report('micro', 'VideoStream 32 datagrams in, one read', elapsed / number / 32 * 1e6,
+           'usec/datagram', number=number)
+    drone.quit()
+
+
+def make_recording(path, seconds, fps=30, frame_datagrams=4):
+    rec = recorder.Recorder(path)
+    stamp = video_stats.monotonic_ns()
+    flight = Packet(FLIGHT_MSG, 0x48)
+    flight.buf.extend(bytearray(24))
+    flight.fixup()
+    payload = bytearray(1460)
+    number = 0
+    for frame in range(int(seconds * fps)):
+        t = stamp + int(frame * 1e9 / fps)
+        if frame % 3 == 0:
+            rec.record(recorder.CHANNEL_COMMAND, recorder.DIRECTION_IN, flight.get_buffer(), t)
+        for i in range(frame_datagrams):
+            last = 0x80 if i == frame_datagrams - 1 else 0
+            rec.record(recorder.CHANNEL_VIDEO, recorder.DIRECTION_IN,
+                       bytearray([frame & 0xff, i | last]) + payload, t)
+            number += 1
+    rec.close()
+    return number
+
+
+def e2e_replay(args):
+    """Receive path throughput: a recorded flight replayed as fast as possible."""
+    path = os.path.join(tempfile.mkdtemp(), 'bench.rec')
+    make_recording(path, args.seconds * 10)
+    for transport in (replay.TRANSPORT_INJECT, replay.TRANSPORT_SOCKET):
+        drone = tellopy.Tello(port=0, video_port=0)
+        drone.set_loglevel(drone.LOG_WARN)
+        drone.video_enabled = True
+        datagrams = []
+        drone.subscribe(drone.EVENT_VIDEO_FRAME, lambda event, sender, data, **a: datagrams.append(1))
+        replayer = replay.Replayer(drone, path, speed=None, transport=transport)
+        stats = replayer.run()
+        time.sleep(0.2)
+        video = drone.get_video_stats()
+        report('e2e', 'replay %s: datagrams/sec' % transport, stats['rate'], '1/s')
+        report('e2e', 'replay %s: video delivered' % transport,
+               100.0 * len(datagrams) / stats['video'], '%',
+               kernel_drops=video['kernel_drops'])
+        drone.quit()
+        replayer.close()
+    os.remove(path)
+
+
+def e2e_commands(args):
+    """Command round trips against one simulated drone."""
+    sim = simulator.Simulator(1)
+    drone = tellopy.Tello(port=0, video_port=0, tello_addr=sim.addresses[0])
+    drone.set_loglevel(drone.LOG_WARN)
+    begin = time.time()
+    drone.connect()
+    drone.wait_for_connection(5.0)
+    report('e2e', 'connect', (time.time() - begin) * 1000, 'ms')
+    rtts = []
+    for i in range(args.commands):
+        begin = time.time()
+        future = drone.takeoff() if i % 2 == 0 else drone.land()
+        future.result(1.0)
+        rtts.append((time.time() - begin) * 1000)
+    report('e2e', 'command ack round trip p50', percentile(rtts, 0.5), 'ms')
+    report('e2e', 'command ack round trip p99', percentile(rtts, 0.99), 'ms')
+    report('e2e', 'command ack round trips/sec', len(rtts) / (sum(rtts) / 1000), '1/s')
+    drone.quit()
+    sim.close()
+
+
+def e2e_fleet(args):
+    """A fleet of simulated drones streaming telemetry and video for args.seconds."""
+    sim = simulator.Simulator(args.drones)
+    fleet = tellopy.Fleet()
+    counts = {'flight': 0}
+
+    def on_flight(event, sender, data, **a):
+        counts['flight'] += 1
+    for address in sim.addresses:
+        drone = fleet.add(tello_addr=address)
+        drone.set_loglevel(drone.LOG_WARN)
+        drone.subscribe(drone.EVENT_FLIGHT_DATA, on_flight)
+    fleet.connect()
+    fleet.wait_for_connection(10.0)
+    for drone in fleet:
+        drone.start_video()
+    time.sleep(0.5)
+    sent = sim.get_stats()['video_datagrams']
+    received = sum(drone.get_video_stats()['datagrams'] for drone in fleet)
+    flight = counts['flight']
+    cpu = process_time()
+    begin = time.time()
+    time.sleep(args.seconds)
+    elapsed = time.time() - begin
+    cpu = process_time() - cpu
+    sent = sim.get_stats()['video_datagrams'] - sent
+    received = sum(drone.get_video_stats()['datagrams'] for drone in fleet) - received
+    report('e2e', 'fleet of %d: flight data events/sec' % args.drones,
+           (counts['flight'] - flight) / elapsed, '1/s')
+    report('e2e', 'fleet of %d: video datagrams/sec' % args.drones, received / elapsed, '1/s')
+    report('e2e', 'fleet of %d: video delivered' % args.drones,
+           100.0 * received / sent if sent else 0.0, '%')
+    report('e2e', 'fleet of %d: cpu (drones and simulator)' % args.drones,
+           100.0 * cpu / elapsed, '%')
+    rtts = [drone.get_clock_stats()['rtt'] for drone in fleet]
+    rtts = [rtt * 1000 for rtt in rtts if rtt is not None]
+    if rtts:
+        report('e2e', 'fleet of %d: time exchange rtt p50' % args.drones, percentile(rtts, 0.5), 'ms')
+    stick = [drone.get_stick_stats() for drone in fleet]
+    report('e2e', 'fleet of %d: stick tick max late' % args.drones,
+           max(s['max_late'] for s in stick) * 1000, 'ms')
+    fleet.quit()
+    sim.close()
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = dict(((r['group'], r['name']), r) for r in json.load(f)['results'])
+    with open(new_path) as f:
+        new = json.load(f)['results']
+    for r in new:
+        before = old.get((r['group'], r['name']))
+        if before is None or not before['value']:
+            continue
+        change = (r['value'] - before['value']) / before['value'] * 100
+        print('%-6s %-44s %12.3f -> %12.3f %s (%+.1f%%)' % (
+            r['group'], r['name'], before['value'], r['value'], r['unit'], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='tellopy benchmarks')
+    parser.add_argument('--only', choices=('micro', 'e2e'))
+    parser.add_argument('--json', help='write the results to this file, - for stdout')
+    parser.add_argument('--seconds', type=float, default=2.0, help='length of end-to-end runs')
+    parser.add_argument('--drones', type=int, default=16, help='simulated drones in the fleet run')
+    parser.add_argument('--commands', type=int, default=200, help='command round trips to time')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two JSON result files and exit')
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    json_stream = sys.stdout
+    if args.json == '-':
+        # keep stdout for the JSON document: the table and anything else printed go to stderr
+        sys.stdout = sys.stderr
+    logger.set_sink(logger.AsyncSink(logger.PrintSink(sys.stderr)))
+    if args.only in (None, 'micro'):
+        micro(args)
+    if args.only in (None, 'e2e'):
+        e2e_replay(args)
+        e2e_commands(args)
+        e2e_fleet(args)
+
+    if args.json:
+        output = {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'args': vars(args),
+            'results': results,
+        }
+        if args.json == '-':
+            json.dump(output, json_stream, indent=1)
+            json_stream.write('\n')
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(output, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -21,6 +21,8 @@ def handler(event, sender, data, **args):
         print('event="%s" data=%d' % (event.getname(), data[0] + data[1] << 8))
     elif event is drone.EVENT_VIDEO_FRAME:
         pass
+    elif isinstance(data, memoryview):
+        print('event="%s" data=%s' % (event.getname(), str(bytes(data))))
     else:
         print('event="%s" data=%s' % (event.getname(), str(data)))
 